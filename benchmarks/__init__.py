@@ -0,0 +1 @@
+"""Benchmarks of hspf_reader run with airspeed velocity (asv)."""
@@ -0,0 +1,145 @@
+"""Benchmarks of the hbn, wdm, and plotgen readers on synthetic files.
+
+The synthetic files are made once by `setup_cache` in the asv working
+directory.  Set the HSPF_READER_BENCH_SCALE environment variable to
+multiply the length of the time-series, for example 20 makes a hbn file of
+about 5 GB.  asv records wall time ('time_'), peak resident memory
+('peakmem_'), and reading throughput in MB/s ('track_') for each commit.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from hspf_reader import hspf_reader
+
+from .generators import make_hbn, make_plotgen, make_wdm
+
+SCALE = int(os.environ.get("HSPF_READER_BENCH_SCALE", "1"))
+
+
+def _cli(*args):
+    """Run the hspf_reader command line with the output discarded."""
+    subprocess.run(
+        [sys.executable, "-m", "hspf_reader.hspf_reader", *args],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def _throughput(path, func, *args, **kwds):
+    """Return the MB/s of reading path with func(*args, **kwds)."""
+    start = time.perf_counter()
+    func(*args, **kwds)
+    return os.path.getsize(path) / (time.perf_counter() - start) / 1e6
+
+
+class HBN:
+    """Hourly output of 100 operations with 20 variables."""
+
+    number = 1
+    repeat = (1, 5, 60.0)
+    timeout = 1200
+
+    def setup_cache(self):
+        path = os.path.abspath("bench.hbn")
+        make_hbn(path, operations=100, variables=20, years=2 * SCALE)
+        return path
+
+    def time_one_label(self, path):
+        hspf_reader.hbn(path, "bivl", "PERLND,50,,V010")
+
+    def time_one_variable(self, path):
+        hspf_reader.hbn(path, "bivl", ",,,V010")
+
+    def time_all_labels(self, path):
+        hspf_reader.hbn(path, "bivl")
+
+    def time_all_labels_numpy(self, path):
+        hspf_reader.hbn(path, "bivl", return_type="numpy")
+
+    def time_aggregate_monthly(self, path):
+        hspf_reader.hbn(path, "bivl", ",,,V010", aggregate="MS:mean,max")
+
+    def peakmem_one_label(self, path):
+        hspf_reader.hbn(path, "bivl", "PERLND,50,,V010")
+
+    def peakmem_all_labels(self, path):
+        hspf_reader.hbn(path, "bivl")
+
+    def track_throughput_all_labels(self, path):
+        return _throughput(path, hspf_reader.hbn, path, "bivl")
+
+    track_throughput_all_labels.unit = "MB/s"
+
+    def time_cli_one_label(self, path):
+        _cli("hbn", path, "bivl", "PERLND,50,,V010")
+
+
+class Plotgen:
+    """Hourly plotgen file with 10 curves."""
+
+    number = 1
+    repeat = (1, 5, 60.0)
+    timeout = 1200
+
+    def setup_cache(self):
+        path = os.path.abspath("bench.plt")
+        make_plotgen(path, curves=10, years=5 * SCALE)
+        return path
+
+    def time_read(self, path):
+        hspf_reader.plotgen(path)
+
+    def time_read_numpy(self, path):
+        hspf_reader.plotgen(path, return_type="numpy")
+
+    def peakmem_read(self, path):
+        hspf_reader.plotgen(path)
+
+    def track_throughput(self, path):
+        return _throughput(path, hspf_reader.plotgen, path)
+
+    track_throughput.unit = "MB/s"
+
+    def time_cli(self, path):
+        _cli("plotgen", path)
+
+
+class WDM:
+    """Hourly WDM file with 10 data sets.  Skipped without wdmtoolbox."""
+
+    number = 1
+    repeat = (1, 5, 60.0)
+    timeout = 1200
+
+    def setup_cache(self):
+        try:
+            import wdmtoolbox  # noqa: F401
+        except ImportError:
+            return None
+        path = os.path.abspath("bench.wdm")
+        make_wdm(path, dsns=10, years=5 * SCALE)
+        return path
+
+    def setup(self, path):
+        if path is None:
+            raise NotImplementedError("requires wdmtoolbox")
+
+    def time_one_dsn(self, path):
+        hspf_reader.wdm(path, 5)
+
+    def time_all_dsns(self, path):
+        hspf_reader.wdm(path, *range(1, 11))
+
+    def peakmem_all_dsns(self, path):
+        hspf_reader.wdm(path, *range(1, 11))
+
+    def track_throughput_one_dsn(self, path):
+        return _throughput(path, hspf_reader.wdm, path, 5)
+
+    track_throughput_one_dsn.unit = "MB/s"
+
+    def time_cli_one_dsn(self, path):
+        _cli("wdm", f"{path},5")
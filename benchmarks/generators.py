@@ -0,0 +1,342 @@
+"""Synthetic HSPF binary output, WDM, and plotgen files for benchmarks.
+
+The files are written in chunks so they can be made as large as needed,
+for example a multi-GB hbn file::
+
+    python -m benchmarks.generators hbn big.hbn --operations 500 --years 30
+
+The WDM generator needs the "wdmtoolbox" package.
+"""
+
+import argparse
+import struct
+
+import numpy as np
+
+# Level (interval code) of each hbn interval.
+HBN_LEVELS = {"bivl": 2, "daily": 3, "monthly": 4, "yearly": 5}
+
+# WDM time codes.
+WDM_TCODES = {"min": 2, "h": 3, "D": 4, "MS": 5, "YS": 6}
+
+# Time steps per chunk written to the file.
+_CHUNK = 8760
+
+
+def _tail(reclen):
+    """Return the back pointer that ends a hbn record of length reclen."""
+    reccnt = (reclen + 4) * 4 + 1
+    size = 1 if reccnt < 256 else 2 if reccnt < 256**2 else 3
+    return np.frombuffer(reccnt.to_bytes(size, "big"), dtype=np.uint8)
+
+
+def _record_dtype(body, tail):
+    """Return the numpy dtype of one hbn record with a body of body bytes."""
+    return np.dtype(
+        [("word", "<u4"), ("body", "u1", (body,)), ("tail", "u1", (tail,))]
+    )
+
+
+def _hbn_record(body):
+    """Return the bytes of one hbn record with the body bytes."""
+    reclen = len(body)
+    return struct.pack("<I", (reclen << 2) | 3) + body + _tail(reclen).tobytes()
+
+
+def _end_dates(start, step, count, interval):
+    """Return the HSPF (year, month, day, hour, minute) of each interval end."""
+    if interval == "bivl":
+        ends = np.datetime64(start, "m") + step * np.arange(1, count + 1)
+    elif interval == "daily":
+        ends = np.datetime64(start, "D") + np.arange(1, count + 1)
+    elif interval == "monthly":
+        ends = (np.datetime64(start, "M") + np.arange(1, count + 1)).astype("M8[D]")
+    else:
+        ends = (np.datetime64(start, "Y") + np.arange(1, count + 1)).astype("M8[D]")
+    ends = ends.astype("M8[m]")
+    # HSPF writes the end of the day as hour 24 of the day before.
+    days = (ends - np.timedelta64(1, "m")).astype("M8[D]")
+    minutes = (ends - days).astype(np.int64)
+    months = days.astype("M8[M]")
+    years = days.astype("M8[Y]")
+    return (
+        years.astype(np.int64) + 1970,
+        (months - years).astype(np.int64) + 1,
+        (days - months).astype(np.int64) + 1,
+        minutes // 60,
+        minutes % 60,
+    )
+
+
+def make_hbn(
+    path,
+    operations=10,
+    variables=10,
+    years=10,
+    interval="bivl",
+    timestep=60,
+    start="2000-01-01",
+    optype="PERLND",
+    group="PWATER",
+    seed=0,
+):
+    """Write a synthetic HSPF binary output file.
+
+    Parameters
+    ----------
+    path
+        File to write.
+    operations
+        Number of operations, with ids 1 to `operations`.
+    variables
+        Number of variables of each operation, named V000, V001, ...
+    years
+        Length of the time-series in years.
+    interval
+        One of 'bivl', 'daily', 'monthly', or 'yearly'.
+    timestep
+        Minutes in each 'bivl' interval.
+    start
+        Start date.
+    optype, group
+        Operation type and variable group.
+    seed
+        Seed of the random values.
+
+    Returns
+    -------
+    int
+        Size of the file in bytes.
+    """
+    start = np.datetime64(start, "m")
+    stop = np.datetime64(str(start.astype("M8[Y]") + years), "m")
+    count = {
+        "bivl": (stop - start) // np.timedelta64(timestep, "m"),
+        "daily": (stop - start) // np.timedelta64(1440, "m"),
+        "monthly": 12 * years,
+        "yearly": years,
+    }[interval]
+    optype = optype.encode("ascii").ljust(8)
+    group = group.encode("ascii").ljust(8)
+    names = [f"V{i:03d}".encode("ascii") for i in range(variables)]
+    body = 24 + 28 + 4 * variables
+    dtype = _record_dtype(body, len(_tail(body)))
+    leader = np.dtype(
+        [
+            ("rectype", "<u4"),
+            ("optype", "S8"),
+            ("lue", "<u4"),
+            ("group", "S8"),
+            ("zero", "<u4"),
+            ("level", "<u4"),
+            ("date", "<u4", (5,)),
+            ("values", "<f4", (variables,)),
+        ]
+    )
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as fpointer:
+        fpointer.write(b"\xfd")
+        for lue in range(1, operations + 1):
+            fpointer.write(
+                _hbn_record(
+                    struct.pack("<I8sI8s", 0, optype, lue, group)
+                    + b"".join(struct.pack("<I", len(i)) + i for i in names)
+                )
+            )
+        for first in range(0, count, _CHUNK):
+            nsteps = min(_CHUNK, count - first)
+            dates = _end_dates(
+                start + first * np.timedelta64(timestep, "m")
+                if interval == "bivl"
+                else {
+                    "daily": start.astype("M8[D]") + first,
+                    "monthly": start.astype("M8[M]") + first,
+                    "yearly": start.astype("M8[Y]") + first,
+                }[interval],
+                timestep,
+                nsteps,
+                interval,
+            )
+            bodies = np.zeros((nsteps, operations), dtype=leader)
+            bodies["rectype"] = 1
+            bodies["optype"] = optype
+            bodies["lue"] = np.arange(1, operations + 1)
+            bodies["group"] = group
+            bodies["level"] = HBN_LEVELS[interval]
+            bodies["date"] = np.stack(dates, axis=-1)[:, None, :]
+            bodies["values"] = rng.random(
+                (nsteps, operations, variables), dtype=np.float32
+            )
+            records = np.zeros(nsteps * operations, dtype=dtype)
+            records["word"] = (body << 2) | 3
+            records["body"] = bodies.reshape(-1).view((np.uint8, body))
+            records["tail"] = _tail(body)
+            records.tofile(fpointer)
+        return fpointer.tell()
+
+
+def make_plotgen(
+    path,
+    curves=4,
+    years=10,
+    timestep=60,
+    start="2000-01-01",
+    seed=0,
+):
+    """Write a synthetic plotgen file with mean-valued curves.
+
+    Parameters
+    ----------
+    path
+        File to write.
+    curves
+        Number of curves, labeled CURVE000, CURVE001, ...
+    years
+        Length of the time-series in years.
+    timestep
+        Minutes in each interval.
+    start
+        Start date.
+    seed
+        Seed of the random values.
+
+    Returns
+    -------
+    int
+        Size of the file in bytes.
+    """
+    start = np.datetime64(start, "m")
+    stop = np.datetime64(str(start.astype("M8[Y]") + years), "m")
+    count = (stop - start) // np.timedelta64(timestep, "m")
+    header = [
+        "SIMU HSPF FILE FOR DRIVING SEPARATE PLOT PROGRAM",
+        f"SIMU Time interval: {timestep:4d} mins          Last month in printout"
+        " year:  9",
+        f"SIMU No. of curves plotted:  Point-valued:  0   Mean-valued:{curves:3d}"
+        f"   Total{curves:3d}",
+        "SIMU Label flag:  0          Pivl:   24          Idelt:   60",
+        "SIMU Plot title:   SYNTHETIC",
+        "SIMU Y-axis label: CFS",
+        "SIMU Scale info:  Ymin:   0.0000               Threshold:-0.10000E+31",
+        "SIMU              Ymax:   1500.0",
+        "SIMU              Time:   20.000     intervals/inch",
+        "SIMU Data for each curve (Point-valued first, then mean-valued):",
+        "SIMU Label                   LINTYP     INTEQ    COLCOD      TRAN   TRANCOD",
+    ]
+    header.extend(
+        f"SIMU {f'CURVE{i:03d}':<24}{0:5d}{1:10d}{1:10d}      AVER{2:10d}"
+        for i in range(curves)
+    )
+    header.extend(["SIMU"] * 6)
+    header.extend(
+        [
+            "SIMU Time series (pt-valued, then mean-valued):",
+            "SIMU",
+            "SIMU Date/time                      Values",
+            "SIMU",
+        ]
+    )
+    line = "SIMU %5d%3d%3d%3d%3d" + "%14.7G" * curves + "\n"
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as fpointer:
+        fpointer.write("\n".join(header) + "\n")
+        for first in range(0, count, _CHUNK):
+            nsteps = min(_CHUNK, count - first)
+            dates = _end_dates(
+                start + first * np.timedelta64(timestep, "m"), timestep, nsteps, "bivl"
+            )
+            values = 100 * rng.random((nsteps, curves))
+            rows = np.column_stack(dates + (values,)).tolist()
+            fpointer.writelines(line % tuple(row) for row in rows)
+        return fpointer.tell()
+
+
+def make_wdm(
+    path,
+    dsns=4,
+    years=10,
+    freq="h",
+    start="2000-01-01",
+    seed=0,
+):
+    """Write a synthetic WDM file with the "wdmtoolbox" package.
+
+    Parameters
+    ----------
+    path
+        File to write.
+    dsns
+        Number of data sets, numbered 1 to `dsns`.
+    years
+        Length of the time-series in years.
+    freq
+        One of the pandas offset aliases 'min', 'h', 'D', 'MS', or 'YS'.
+    start
+        Start date.
+    seed
+        Seed of the random values.
+
+    Returns
+    -------
+    int
+        Size of the file in bytes.
+    """
+    import os
+
+    import pandas as pd
+    import wdmtoolbox
+
+    index = pd.date_range(
+        start,
+        pd.Timestamp(start) + pd.DateOffset(years=years),
+        freq=freq,
+        inclusive="left",
+    )
+    rng = np.random.default_rng(seed)
+    wdmtoolbox.createnewwdm(path, overwrite=True)
+    for dsn in range(1, dsns + 1):
+        wdmtoolbox.createnewdsn(path, dsn, tcode=WDM_TCODES[freq], tsstep=1)
+        wdmtoolbox.csvtowdm(
+            path,
+            dsn,
+            input_ts=pd.DataFrame(
+                {f"dsn{dsn}": 100 * rng.random(len(index))}, index=index
+            ),
+        )
+    return os.path.getsize(path)
+
+
+def main():
+    """Command line interface to the generators."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    hbn = commands.add_parser("hbn", help="HSPF binary output file")
+    hbn.add_argument("path")
+    hbn.add_argument("--operations", type=int, default=10)
+    hbn.add_argument("--variables", type=int, default=10)
+    hbn.add_argument("--years", type=int, default=10)
+    hbn.add_argument("--interval", choices=list(HBN_LEVELS), default="bivl")
+    hbn.add_argument("--timestep", type=int, default=60)
+
+    plotgen = commands.add_parser("plotgen", help="plotgen file")
+    plotgen.add_argument("path")
+    plotgen.add_argument("--curves", type=int, default=4)
+    plotgen.add_argument("--years", type=int, default=10)
+    plotgen.add_argument("--timestep", type=int, default=60)
+
+    wdm = commands.add_parser("wdm", help="WDM file, requires wdmtoolbox")
+    wdm.add_argument("path")
+    wdm.add_argument("--dsns", type=int, default=4)
+    wdm.add_argument("--years", type=int, default=10)
+    wdm.add_argument("--freq", choices=list(WDM_TCODES), default="h")
+
+    args = vars(parser.parse_args())
+    func = {"hbn": make_hbn, "plotgen": make_plotgen, "wdm": make_wdm}[
+        args.pop("command")
+    ]
+    print(f"Wrote {func(**args)} bytes to {args['path']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,29 @@
 """Collection of functions for the manipulation of time series."""
 
-from .hspf_reader import hbn, plotgen, wdm
+from .hspf_reader import (
+    ahbn,
+    aplotgen,
+    awdm,
+    batch,
+    calibration_metrics,
+    hbn,
+    hbn_ensemble,
+    hbn_many,
+    index_tree,
+    lookup,
+    open_hbn_dataset,
+    plotgen,
+    plotgen_catalog,
+    plotgen_iter,
+    series_stats,
+    wdm,
+)
+from .hbnfile import HBNFile
+from .instrument import Stats, profile
+from .plotgenfile import PlotgenFile
+from .shared import SharedFrame, share
+from .spill import SpilledFrame
+from .wdmfile import WDMFile
 from .toolbox_utils.src.toolbox_utils.tsutils import about as _about
 
 
@@ -9,4 +32,30 @@ def about():
     _about(__name__)
 
 
-__all__ = ["about", "hbn", "plotgen", "wdm"]
+__all__ = [
+    "HBNFile",
+    "PlotgenFile",
+    "SharedFrame",
+    "SpilledFrame",
+    "Stats",
+    "WDMFile",
+    "about",
+    "ahbn",
+    "aplotgen",
+    "awdm",
+    "batch",
+    "calibration_metrics",
+    "hbn",
+    "hbn_ensemble",
+    "hbn_many",
+    "index_tree",
+    "lookup",
+    "open_hbn_dataset",
+    "plotgen",
+    "plotgen_catalog",
+    "plotgen_iter",
+    "profile",
+    "series_stats",
+    "share",
+    "wdm",
+]
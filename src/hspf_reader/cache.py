@@ -0,0 +1,231 @@
+"""Content addressed on-disk cache of extracted results.
+
+Results are stored in a cache directory as pickle files named by a hash of
+the command, the normalized arguments, and the real path, size, and
+modification time of each source file, so a cache hit only stats the
+source files.  A changed source file gives a new key, so stale entries are
+never returned and are eventually evicted.  Set the
+HSPF_READER_CACHE_STRICT environment variable to also hash the first bytes
+of each source file, for file systems with coarse modification times.
+
+The directory is set with the HSPF_READER_CACHE_DIR environment variable
+or the `cache_dir` keyword.  When the total size of the entries is more
+than HSPF_READER_CACHE_SIZE bytes (default 1 GiB) the least recently used
+entries are removed.  Entries are written to a temporary file and renamed,
+so several processes of one user can share a cache directory.
+
+Loading a pickle can run arbitrary code, so the directory must be private.
+It is created readable only by the user, and a directory owned by another
+user or writable by other users is refused.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+
+CACHE_DIR_ENV = "HSPF_READER_CACHE_DIR"
+CACHE_SIZE_ENV = "HSPF_READER_CACHE_SIZE"
+CACHE_STRICT_ENV = "HSPF_READER_CACHE_STRICT"
+DEFAULT_SIZE = 1 << 30
+
+# Number of bytes at the start of each source file in a strict key.
+HEADER_BYTES = 1 << 16
+
+# Change to invalidate every entry written by older versions.
+_FORMAT = 2
+_SUFFIX = ".pickle"
+
+# Return types that are handles to data outside of the result.
+_UNCACHED = ("arrow_stream", "shared")
+
+
+def directory(cache_dir=None):
+    """Return the cache directory from cache_dir or the environment, or None."""
+    cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+    return os.path.abspath(os.path.expanduser(str(cache_dir)))
+
+
+def private(cache_dir):
+    """Create cache_dir readable only by the user, or check an existing one."""
+    try:
+        os.makedirs(cache_dir, mode=0o700)
+    except FileExistsError:
+        pass
+    if not hasattr(os, "getuid"):
+        return
+    stat = os.stat(cache_dir)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The cache directory "{cache_dir}" must be owned by you and
+                not writable by other users, because the cached results are
+                pickles that run code when loaded.  Use a private directory,
+                for example one with 0o700 permissions.
+                """
+            )
+        )
+
+
+def size_limit():
+    """Return the cache size limit in bytes."""
+    try:
+        return int(os.environ[CACHE_SIZE_ENV])
+    except KeyError:
+        return DEFAULT_SIZE
+    except ValueError as exc:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The {CACHE_SIZE_ENV} environment variable must be an integer
+                number of bytes.  You gave "{os.environ[CACHE_SIZE_ENV]}".
+                """
+            )
+        ) from exc
+
+
+def _fingerprint(path, strict=False):
+    """Return the (path, size, mtime_ns) of a source file.
+
+    If strict, a hash of the first HEADER_BYTES of the file is appended.
+    """
+    path = os.path.realpath(path)
+    if not strict:
+        stat = os.stat(path)
+        return [path, stat.st_size, stat.st_mtime_ns]
+    with open(path, "rb") as fpointer:
+        stat = os.fstat(fpointer.fileno())
+        header = hashlib.blake2b(fpointer.read(HEADER_BYTES), digest_size=16)
+    return [path, stat.st_size, stat.st_mtime_ns, header.hexdigest()]
+
+
+def key(command, paths, args, kwds):
+    """Return the hex digest cache key of a command."""
+    strict = bool(os.environ.get(CACHE_STRICT_ENV))
+    return hashlib.blake2b(
+        json.dumps(
+            [
+                _FORMAT,
+                command,
+                [_fingerprint(i, strict=strict) for i in paths],
+                args,
+                sorted((k, v) for k, v in kwds.items() if v is not None),
+            ],
+            default=str,
+        ).encode("utf-8"),
+        digest_size=20,
+    ).hexdigest()
+
+
+def _entry(cache_dir, digest):
+    return os.path.join(cache_dir, digest + _SUFFIX)
+
+
+def get(cache_dir, digest):
+    """Return (True, result) on a hit or (False, None) on a miss."""
+    entry = _entry(cache_dir, digest)
+    try:
+        with open(entry, "rb") as fpointer:
+            result = pickle.load(fpointer)
+    except FileNotFoundError:
+        return False, None
+    except (OSError, EOFError, pickle.UnpicklingError):
+        # Unreadable entry, remove so it is written again.
+        _remove(entry)
+        return False, None
+    try:
+        # The modification time of an entry is its last use.
+        os.utime(entry)
+    except OSError:
+        pass
+    return True, result
+
+
+def put(cache_dir, digest, result):
+    """Store result under digest and evict entries over the size limit."""
+    fdesc, tmpname = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fdesc, "wb") as fpointer:
+            pickle.dump(result, fpointer, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, _entry(cache_dir, digest))
+    except BaseException:
+        _remove(tmpname)
+        raise
+    evict(cache_dir)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def evict(cache_dir, limit=None):
+    """Remove the least recently used entries until under the size limit."""
+    limit = size_limit() if limit is None else limit
+    entries = []
+    with os.scandir(cache_dir) as scan:
+        for item in scan:
+            if not item.name.endswith(_SUFFIX):
+                continue
+            try:
+                stat = item.stat()
+            except FileNotFoundError:
+                # Removed by another process.
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, item.path))
+    total = sum(i[1] for i in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        _remove(path)
+        total -= size
+
+
+def cached(command, normalize, ignore=()):
+    """Decorate an extraction function to use the cache.
+
+    The decorated function takes a `cache_dir` keyword.  The normalize
+    function is called with the positional arguments and returns the list
+    of source files and the normalized arguments.  The keywords in ignore
+    do not change the result and are left out of the key.  Results with
+    the 'arrow_stream' and 'shared' return types, or with a `max_memory`,
+    are not cached.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwds):
+            cache_dir = directory(kwds.pop("cache_dir", None))
+            if (
+                cache_dir is None
+                or kwds.get("return_type") in _UNCACHED
+                or kwds.get("max_memory") is not None
+            ):
+                return func(*args, **kwds)
+            private(cache_dir)
+            paths, nargs = normalize(args)
+            digest = key(
+                command,
+                paths,
+                nargs,
+                {k: v for k, v in kwds.items() if k not in ignore},
+            )
+            hit, result = get(cache_dir, digest)
+            if hit:
+                return result
+            result = func(*args, **kwds)
+            put(cache_dir, digest, result)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,343 @@
+"""SQLite catalog of the time-series in a tree of HSPF files.
+
+`update` crawls a directory tree for hbn, WDM, and plotgen files, identified
+by their first bytes rather than the file name extension, and records each
+hbn label, WDM DSN, and plotgen curve with the byte offset of its first
+record and its period of record.  Files are only read again when their size
+or modification time changes, and files that are gone are removed.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+from hspf_reader import hbnfile as _hbnfile
+from hspf_reader import plotgenfile as _plotgenfile
+from hspf_reader import wdmfile as _wdmfile
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+from hspf_reader.toolbox_utils.src.toolbox_utils.readers import utils as _utils
+
+DEFAULT_NAME = "hspf_reader_index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS series (
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,
+    optype TEXT,
+    opid INTEGER,
+    grp TEXT,
+    variable TEXT,
+    dsn INTEGER,
+    interval TEXT,
+    position INTEGER,
+    offset INTEGER,
+    nrecords INTEGER,
+    start_date TEXT,
+    end_date TEXT,
+    attributes TEXT
+);
+CREATE INDEX IF NOT EXISTS series_path ON series (path);
+CREATE INDEX IF NOT EXISTS series_label ON series (label);
+CREATE INDEX IF NOT EXISTS series_hbn ON series (optype, opid, grp, variable);
+"""
+
+COLUMNS = (
+    "path",
+    "kind",
+    "label",
+    "optype",
+    "opid",
+    "grp",
+    "variable",
+    "dsn",
+    "interval",
+    "position",
+    "offset",
+    "nrecords",
+    "start_date",
+    "end_date",
+    "attributes",
+)
+
+
+def connect(database):
+    """Return a connection to the catalog database, creating the tables."""
+    connection = sqlite3.connect(database)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def kind(path):
+    """Return 'hbn', 'wdm', 'plotgen', or None from the first bytes of path."""
+    try:
+        with open(path, "rb") as fpointer:
+            head = fpointer.read(16)
+    except OSError:
+        return None
+    if head[:1] == b"\xfd":
+        return "hbn"
+    if len(head) >= 4 and int.from_bytes(head[:4], "little", signed=True) == -998:
+        return "wdm"
+    if head.startswith(b"SIMU HSPF"):
+        return "plotgen"
+    return None
+
+
+def _isoformat(date):
+    if date is None:
+        return None
+    return np.datetime_as_string(np.datetime64(date, "s"))
+
+
+def _hbn_entries(path):
+    with _hbnfile.borrow_mmap(path) as buf:
+        vnames, _, offsets, _ = _hbnfile.scan(buf)
+        for (optype, lue, group, level), offs in offsets.items():
+            interval = _utils.code2intervalmap.get(level)
+            if interval is None or (optype, lue, group) not in vnames:
+                continue
+            start, end = _hbnfile.period_start(
+                _hbnfile.record_dates(buf, offs[[0, -1]], bivl=interval == "bivl"),
+                interval,
+            )
+            for num, vname in enumerate(vnames[(optype, lue, group)]):
+                yield {
+                    "label": f"{optype},{lue},{group},{vname}",
+                    "optype": optype,
+                    "opid": lue,
+                    "grp": group,
+                    "variable": vname,
+                    "interval": interval,
+                    "position": num,
+                    "offset": int(offs[0]),
+                    "nrecords": len(offs),
+                    "start_date": _isoformat(start),
+                    "end_date": _isoformat(end),
+                }
+
+
+def _wdm_entries(path):
+    dsns = _wdmfile.directory(path)
+    data = _wdmfile.extract(path, *dsns) if dsns else None
+    for dsn, label in dsns.items():
+        attributes = label["attributes"]
+        index = []
+        column = f"{path}_{dsn}"
+        if data is not None and column in data.columns:
+            index = data[column].dropna().index
+        yield {
+            "label": str(dsn),
+            "dsn": dsn,
+            "interval": _wdmfile.interval(attributes),
+            "position": dsn,
+            "offset": label["offset"],
+            "nrecords": len(index),
+            "start_date": _isoformat(index[0]) if len(index) else None,
+            "end_date": _isoformat(index[-1]) if len(index) else None,
+            "attributes": json.dumps(attributes),
+        }
+
+
+def _plotgen_entries(path):
+    head = _plotgenfile.header(path)
+    start, end = _plotgenfile.period(path, head)
+    for num, curve in enumerate(head["curves"]):
+        yield {
+            "label": curve["label"],
+            "interval": f"{head['interval']}min",
+            "position": num,
+            "offset": head["offset"],
+            "start_date": _isoformat(start),
+            "end_date": _isoformat(end),
+            "attributes": json.dumps({"title": head["title"], **curve}),
+        }
+
+
+_ENTRIES = {"hbn": _hbn_entries, "wdm": _wdm_entries, "plotgen": _plotgen_entries}
+
+
+def _walk(directory, skip):
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(i for i in dirs if not i.startswith("."))
+        for name in sorted(files):
+            path = os.path.abspath(os.path.join(root, name))
+            if path != skip:
+                yield path
+
+
+def update(directory, database=None):
+    """Add, update, or remove the files under directory in the catalog.
+
+    Parameters
+    ----------
+    directory
+        The root of the tree to crawl.  Hidden directories are skipped.
+    database
+        [optional, default is "hspf_reader_index.sqlite" in directory]
+
+        The SQLite database file.
+
+    Returns
+    -------
+    dict
+        The number of files "added", "updated", "removed", and "unchanged",
+        and the number of "series" in the added and updated files.
+    """
+    directory = os.path.abspath(directory)
+    if not os.path.isdir(directory):
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The directory "{directory}" does not exist.
+                """
+            )
+        )
+    if database is None:
+        database = os.path.join(directory, DEFAULT_NAME)
+    database = os.path.abspath(database)
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "series": 0}
+    prefix = os.path.join(directory, "")
+    connection = connect(database)
+    try:
+        known = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in connection.execute(
+                "SELECT path, size, mtime_ns FROM files WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+        }
+        for path in _walk(directory, database):
+            stat = os.stat(path)
+            old = known.pop(path, None)
+            if old == (stat.st_size, stat.st_mtime_ns):
+                counts["unchanged"] += 1
+                continue
+            ftype = kind(path)
+            entries = None
+            if ftype is not None:
+                try:
+                    entries = list(_ENTRIES[ftype](path))
+                except (OSError, ValueError, IndexError) as exc:
+                    sys.stderr.write(
+                        tsutils.error_wrapper(
+                            f"""
+                            Warning: Skipped {path}, can't read it as a
+                            {ftype} file: {exc}
+                            """
+                        )
+                    )
+            with connection:
+                _remove(connection, path)
+                if entries is not None:
+                    _insert(connection, path, ftype, stat, entries)
+            if entries is None:
+                counts["removed"] += old is not None
+                continue
+            counts["updated" if old else "added"] += 1
+            counts["series"] += len(entries)
+        with connection:
+            for path in known:
+                _remove(connection, path)
+                counts["removed"] += 1
+    finally:
+        connection.close()
+    return counts
+
+
+def _insert(connection, path, ftype, stat, entries):
+    connection.execute(
+        "INSERT INTO files VALUES (?, ?, ?, ?)",
+        (path, ftype, stat.st_size, stat.st_mtime_ns),
+    )
+    connection.executemany(
+        f"INSERT INTO series VALUES ({', '.join('?' * len(COLUMNS))})",
+        (
+            tuple({"path": path, "kind": ftype, **entry}.get(i) for i in COLUMNS)
+            for entry in entries
+        ),
+    )
+
+
+def _remove(connection, path):
+    connection.execute("DELETE FROM series WHERE path = ?", (path,))
+    connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+
+def _where(label, file_type):
+    """Return the SQL condition and parameters that match one label."""
+    label = str(label).strip()
+    if "," in label:
+        parts = (label.split(",") + [""] * 4)[:4]
+        clauses = ["kind = 'hbn'"]
+        params = []
+        for column, value in zip(("optype", "opid", "grp", "variable"), parts):
+            value = value.strip()
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(int(value) if column == "opid" else value)
+        return " AND ".join(clauses), params
+    if label.isdigit() and file_type in (None, "wdm"):
+        return "kind = 'wdm' AND dsn = ?", [int(label)]
+    return "label = ?", [label]
+
+
+def find(database, *labels, file_type=None):
+    """Return the catalog entries that match any of labels.
+
+    Parameters
+    ----------
+    database
+        The SQLite database file written by `update`.
+    labels
+        An hbn label "OPTYPE,ID,GROUP,VARIABLE" where empty parts match
+        anything, a WDM DSN number, or a plotgen curve label.  With no labels
+        every entry is returned.
+    file_type
+        [optional] Only return entries of 'hbn', 'wdm', or 'plotgen' files.
+
+    Returns
+    -------
+    list
+        A dictionary of the catalog columns for each entry.
+    """
+    if not os.path.exists(database):
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The catalog database "{database}" does not exist.  Create it
+                with "hspf_reader index".
+                """
+            )
+        )
+    conditions = []
+    params = []
+    for label in labels:
+        clause, lparams = _where(label, file_type)
+        conditions.append(f"({clause})")
+        params.extend(lparams)
+    sql = f"SELECT {', '.join(COLUMNS)} FROM series"
+    where = []
+    if conditions:
+        where.append(f"({' OR '.join(conditions)})")
+    if file_type is not None:
+        where.append("kind = ?")
+        params.append(file_type)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY path, kind, optype, opid, grp, interval, position"
+    connection = connect(database)
+    try:
+        rows = connection.execute(sql, params).fetchall()
+    finally:
+        connection.close()
+    return [dict(zip(COLUMNS, row)) for row in rows]
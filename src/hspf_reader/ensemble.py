@@ -0,0 +1,208 @@
+"""Streaming statistics of one series across an ensemble of model runs.
+
+`Ensemble` accumulates, for each timestamp of a block, the count, mean,
+variance, minimum, and maximum of the values of the ensemble members added
+with `Ensemble.update`, and estimates percentiles with the P-square
+algorithm of Jain and Chlamtac (1985), so the memory used depends on the
+number of timestamps and statistics but not on the number of members.
+"""
+
+import numpy as np
+
+from hspf_reader import hbnfile as _hbnfile
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+
+# Statistics other than the "pNN" percentiles.
+STATISTICS = ("count", "mean", "std", "min", "max")
+
+DEFAULT_STATS = ("mean", "std", "min", "p5", "p50", "p95", "max")
+
+
+def parse_stats(stats):
+    """Return the list of statistic names and the list of percentile probabilities.
+
+    Percentiles are given as "p" followed by the percent, for example "p5"
+    or "p97.5".
+    """
+    if stats is None:
+        stats = DEFAULT_STATS
+    if isinstance(stats, str):
+        stats = stats.replace(",", " ").split()
+    names = []
+    probs = []
+    for stat in stats:
+        stat = str(stat).strip().lower()
+        if stat in STATISTICS:
+            names.append(stat)
+            continue
+        try:
+            prob = float(stat[1:]) / 100 if stat.startswith("p") else None
+        except ValueError:
+            prob = None
+        if prob is None or not 0 < prob < 1:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The statistics must be in {STATISTICS} or a percentile
+                    between 0 and 100 as "p" followed by the percent, for
+                    example "p5" or "p97.5".  You gave "{stat}".
+                    """
+                )
+            )
+        names.append(stat)
+        if prob not in probs:
+            probs.append(prob)
+    if not names:
+        raise ValueError(
+            tsutils.error_wrapper(
+                """
+                At least one statistic is required.
+                """
+            )
+        )
+    return names, probs
+
+
+class P2Quantile:
+    """P-square estimate of one quantile at each of `size` timestamps.
+
+    Keeps five marker heights and positions for each timestamp.  Until five
+    values have been added the markers are the values themselves and the
+    quantile is exact.
+    """
+
+    def __init__(self, size, prob):
+        self.prob = prob
+        self.count = np.zeros(size, dtype=np.int64)
+        self.heights = np.full((size, 5), np.nan)
+        self.positions = np.tile(np.arange(1.0, 6.0), (size, 1))
+        self.desired = np.tile(
+            [1.0, 1 + 2 * prob, 1 + 4 * prob, 3 + 2 * prob, 5.0], (size, 1)
+        )
+        self.increments = np.array([0, prob / 2, prob, (1 + prob) / 2, 1])
+
+    def update(self, values):
+        """Add one value for each timestamp, NaN values are skipped."""
+        valid = ~np.isnan(values)
+        steady = np.flatnonzero(valid & (self.count >= 5))
+        start = np.flatnonzero(valid & (self.count < 5))
+        if len(start):
+            self.heights[start, self.count[start]] = values[start]
+            self.count[start] += 1
+            full = start[self.count[start] == 5]
+            self.heights[full] = np.sort(self.heights[full], axis=1)
+        if not len(steady):
+            return
+        self.count[steady] += 1
+        value = values[steady]
+        heights = self.heights[steady]
+        positions = self.positions[steady]
+        desired = self.desired[steady] + self.increments
+        np.minimum(heights[:, 0], value, out=heights[:, 0])
+        np.maximum(heights[:, 4], value, out=heights[:, 4])
+        cell = (heights[:, 1:4] <= value[:, None]).sum(axis=1)
+        positions += np.arange(5) > cell[:, None]
+        for i in (1, 2, 3):
+            delta = desired[:, i] - positions[:, i]
+            up = (delta >= 1) & (positions[:, i + 1] - positions[:, i] > 1)
+            down = (delta <= -1) & (positions[:, i - 1] - positions[:, i] < -1)
+            move = up | down
+            if not move.any():
+                continue
+            sign = np.where(up[move], 1.0, -1.0)
+            qlo, qmid, qhi = (heights[move, j] for j in (i - 1, i, i + 1))
+            nlo, nmid, nhi = (positions[move, j] for j in (i - 1, i, i + 1))
+            parabolic = qmid + sign / (nhi - nlo) * (
+                (nmid - nlo + sign) * (qhi - qmid) / (nhi - nmid)
+                + (nhi - nmid - sign) * (qmid - qlo) / (nmid - nlo)
+            )
+            linear = qmid + sign * (
+                np.where(up[move], qhi, qlo) - qmid
+            ) / np.where(up[move], nhi - nmid, nmid - nlo)
+            heights[move, i] = np.where(
+                (qlo < parabolic) & (parabolic < qhi), parabolic, linear
+            )
+            positions[move, i] += sign
+        self.heights[steady] = heights
+        self.positions[steady] = positions
+        self.desired[steady] = desired
+
+    def result(self):
+        """Return the estimated quantile at each timestamp."""
+        out = self.heights[:, 2].copy()
+        for count in range(6):
+            rows = np.flatnonzero(self.count == count)
+            if not len(rows):
+                continue
+            if count == 0:
+                out[rows] = np.nan
+            else:
+                out[rows] = np.quantile(self.heights[rows, :count], self.prob, axis=1)
+        return out
+
+
+class Ensemble:
+    """Running statistics of the ensemble members at `size` timestamps."""
+
+    def __init__(self, size, probs=()):
+        self.count = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.nan)
+        self.max = np.full(size, np.nan)
+        self.quantiles = {prob: P2Quantile(size, prob) for prob in probs}
+
+    def update(self, values):
+        """Add the values of one member, NaN values are skipped."""
+        values = np.asarray(values, dtype="float64")
+        valid = ~np.isnan(values)
+        self.count += valid
+        delta = np.where(valid, values - self.mean, 0)
+        self.mean += np.divide(
+            delta, self.count, out=np.zeros_like(delta), where=valid
+        )
+        self.m2 += np.where(valid, delta * (values - self.mean), 0)
+        self.min = np.fmin(self.min, values)
+        self.max = np.fmax(self.max, values)
+        for quantile in self.quantiles.values():
+            quantile.update(values)
+
+    def result(self, names):
+        """Return the (size, len(names)) array of the named statistics."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.sqrt(self.m2 / (self.count - 1))
+        std[self.count < 2] = np.nan
+        mean = np.where(self.count > 0, self.mean, np.nan)
+        columns = {
+            "count": self.count.astype("float64"),
+            "mean": mean,
+            "std": std,
+            "min": self.min,
+            "max": self.max,
+        }
+        out = np.empty((len(self.count), len(names)), order="F")
+        for num, name in enumerate(names):
+            if name in columns:
+                out[:, num] = columns[name]
+            else:
+                out[:, num] = self.quantiles[float(name[1:]) / 100].result()
+        return out
+
+
+def block_worker(hbnpaths, plan_ids, plans, size, names, probs):
+    """Return the statistics of a block of `size` timestamps of every file.
+
+    `plans[plan_ids[i]]` is the (offsets, variable index, rows) of the
+    records of hbnpaths[i] in the block.  The files are read one after
+    another so only the values of one file are held at a time.
+    """
+    ensemble = Ensemble(size, probs)
+    values = np.empty(size)
+    for hbnpath, plan_id in zip(hbnpaths, plan_ids):
+        offsets, index, rows = plans[plan_id]
+        values[:] = np.nan
+        if len(offsets):
+            with _hbnfile.borrow_mmap(hbnpath) as buf:
+                values[rows] = _hbnfile.record_values(buf, offsets, [index])[:, 0]
+        ensemble.update(values)
+    return ensemble.result(names)
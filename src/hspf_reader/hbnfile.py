@@ -0,0 +1,1320 @@
+"""Record level reader for HSPF binary output (hbn) files."""
+
+import concurrent.futures as _futures
+import contextlib
+import hashlib
+import json
+import mmap
+import multiprocessing.shared_memory as _shared_memory
+import os
+import struct
+import sys
+import tempfile
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from hspf_reader import instrument as _instrument
+from hspf_reader import pool as _pool
+from hspf_reader import shared as _shared
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+from hspf_reader.toolbox_utils.src.toolbox_utils.readers import utils as _utils
+
+# Every record starts with a four byte length word followed by the record
+# leader: record type, operation type, operation id, and variable group.
+_LEADER = struct.Struct("<II8sI8s")
+
+# Data records follow the leader with seven words, the second is the interval
+# code (level) and the next five are year, month, day, hour, and minute.  The
+# float32 values follow, one for each variable in the header record.
+_WORD = struct.Struct("<I")
+_LEVEL_OFFSET = 32
+_DATE_OFFSET = 36
+_VALUES_OFFSET = 56
+
+_INTERVALS = ("bivl", "daily", "monthly", "yearly")
+
+# Callbacks are called after roughly this many bytes have been scanned.
+BATCH_BYTES = 1 << 22
+
+# Upper limit on the size of the temporary index arrays used by _gather.
+_GATHER_BYTES = 1 << 24
+
+
+def _parallel(workers):
+    """Return True if workers asks for processes and there is more than one CPU.
+
+    With a single CPU the worker processes only add start up and transfer
+    costs, so the file is read in this process instead.
+    """
+    return workers is not None and workers > 1 and (os.cpu_count() or 1) > 1
+
+
+def _tail_size(reclen):
+    """Return the size of the back pointer that ends each record."""
+    reccnt = (reclen + 4) * 4 + 1
+    if reccnt >= 256**2:
+        return 3
+    if reccnt >= 256:
+        return 2
+    return 1
+
+
+def _match(key, lablist):
+    """Return True if the (optype, lue, group, vname, level) key matches."""
+    return any(_utils.tuple_match(key, lbl) for lbl in lablist)
+
+
+def open_mmap(hbnpath):
+    """Return a read only memory map of hbnpath after checking the magic byte."""
+    with open(hbnpath, "rb") as fpointer:
+        magicbyte = fpointer.read(1)
+        if magicbyte != b"\xfd":
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    {hbnpath} is not a valid HSPF binary output file (.hbn),
+                    The first byte must be FD hexadecimal, but it was
+                    {magicbyte}.
+                    """
+                )
+            )
+        return mmap.mmap(fpointer.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def borrow_mmap(hbnpath):
+    """Return a context manager of the `open_mmap` of hbnpath from the pool."""
+    return _pool.borrow(hbnpath, open_mmap)
+
+
+def _decode(okey):
+    """Decode a raw (optype, lue, group) record key."""
+    optype, lue, group = okey
+    return (optype.strip().decode("ascii"), lue, group.strip().decode("ascii"))
+
+
+def _scan_range(buf, start, stop, lablist, intervalcode, callback=None):
+    """Index the records that start at or after `start` and before `stop`.
+
+    Returns the raw (undecoded) vnames, matched, offsets, and headers of
+    `scan`.  Data records of operations whose header record is not in the
+    range are also kept, so that ranges can be scanned separately and
+    matched after merging.
+    """
+    size = len(buf)
+    unpack = _LEADER.unpack_from
+    unpack_word = _WORD.unpack_from
+    vnames = {}
+    matched = {}
+    offsets = {}
+    headers = []
+    nrecords = 0
+    pos = start
+    next_callback = pos + BATCH_BYTES
+    while pos < stop:
+        if callback is not None and pos >= next_callback:
+            callback(pos, size)
+            next_callback = pos + BATCH_BYTES
+        try:
+            word, rectype, optype, lue, group = unpack(buf, pos)
+        except struct.error:
+            # End of file or a truncated final record.
+            break
+        reclen = word >> 2
+        nrecords += 1
+        if rectype == 1:
+            okey = (optype, lue, group)
+            hit = matched.get(okey)
+            if hit or hit is None:
+                level = unpack_word(buf, pos + _LEVEL_OFFSET)[0]
+                if lablist is None or level == intervalcode:
+                    offsets.setdefault(okey + (level,), []).append(pos)
+        elif rectype == 0:
+            headers.append((pos, 4 + reclen))
+            okey = (optype, lue, group)
+            key = _decode(okey)
+            npos = pos + 28
+            end = pos + 4 + reclen
+            while npos < end:
+                length = unpack_word(buf, npos)[0]
+                vname = bytes(buf[npos + 4 : npos + 4 + length]).decode("ascii")
+                vnames.setdefault(key, []).append(vname)
+                npos += length + 4
+            matched[okey] = [
+                i
+                for i, vname in enumerate(vnames[key])
+                if lablist is None or _match(key + (vname, intervalcode), lablist)
+            ]
+        else:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    Unexpected record type {rectype} at byte {pos}.  The file
+                    is not a valid or complete HSPF binary output file.
+                    """
+                )
+            )
+        pos += 4 + reclen + _tail_size(reclen)
+    _instrument.add("scan", bytes=min(pos, size) - start, records=nrecords)
+    return vnames, matched, offsets, headers
+
+
+def _scanned(vnames, matched, offsets, headers):
+    """Decode the keys of `_scan_range` and drop unmatched data records."""
+    return (
+        vnames,
+        {_decode(okey): i for okey, i in matched.items()},
+        {
+            _decode(key[:3]) + (key[3],): np.asarray(offs, dtype=np.int64)
+            for key, offs in offsets.items()
+            if matched.get(key[:3])
+        },
+        headers,
+    )
+
+
+def scan(buf, lablist=None, intervalcode=None, callback=None):
+    """Index the records of a hbn file held in buf.
+
+    Parameters
+    ----------
+    buf
+        Memory map or bytes of the complete hbn file.
+    lablist
+        Normalized labels from `normalize_labels`.  If None, the data records
+        of every operation, group, and level are indexed.
+    intervalcode
+        Only index data records at this level when lablist is given.
+    callback
+        Called as callback(position, size) after about BATCH_BYTES bytes have
+        been scanned.  An exception raised by callback stops the scan.
+
+    Returns
+    -------
+    vnames
+        Dictionary of (optype, lue, group) to list of variable names.
+    matched
+        Dictionary of (optype, lue, group) to list of the indices of matched
+        variables.  Contains every variable when lablist is None.
+    offsets
+        Dictionary of (optype, lue, group, level) to a numpy array of data
+        record offsets in file order.
+    headers
+        List of the (offset, length) of each header record.
+    """
+    return _scanned(
+        *_scan_range(buf, 1, len(buf), lablist, intervalcode, callback=callback)
+    )
+
+
+def _is_record(buf, pos, count=4):
+    """Return True if `count` valid records follow each other from pos.
+
+    Each record must have a known record type, an alphabetic operation
+    type, fit in buf, and end with the back pointer that matches its
+    length.
+    """
+    size = len(buf)
+    for _ in range(count):
+        if pos == size:
+            return True
+        try:
+            word, rectype, optype, _, _ = _LEADER.unpack_from(buf, pos)
+        except struct.error:
+            return False
+        reclen = word >> 2
+        if (
+            rectype not in (0, 1)
+            or reclen < 24
+            or reclen > size - pos - 4
+            or (reclen + 4) * 4 + 1 >= 256**3
+            or not optype.strip().isalpha()
+        ):
+            return False
+        end = pos + 4 + reclen
+        tail = _tail_size(reclen)
+        if buf[end : end + tail] != ((reclen + 4) * 4 + 1).to_bytes(tail, "big"):
+            return False
+        pos = end + tail
+    return True
+
+
+def split_points(buf, parts):
+    """Return record aligned offsets that split buf into about `parts` ranges.
+
+    The first offset is the first record and the last is the size of buf.
+    """
+    size = len(buf)
+    points = [1]
+    for num in range(1, parts):
+        pos = max(points[-1] + 1, size * num // parts)
+        while pos < size and not _is_record(buf, pos):
+            pos += 1
+        if pos < size:
+            points.append(pos)
+    points.append(size)
+    return points
+
+
+def _scan_worker(hbnpath, start, stop, lablist, intervalcode):
+    """Scan one range of hbnpath in a worker process."""
+    with borrow_mmap(hbnpath) as buf, _instrument.profile() as stats:
+        vnames, matched, offsets, headers = _scan_range(
+            buf, start, stop, lablist, intervalcode
+        )
+    return (
+        vnames,
+        matched,
+        {key: np.array(offs, dtype=np.int64) for key, offs in offsets.items()},
+        headers,
+        stats.stages["scan"].as_dict(),
+    )
+
+
+def scan_parallel(hbnpath, workers, lablist=None, intervalcode=None, callback=None):
+    """Same as `scan`, but splits hbnpath into ranges scanned by workers.
+
+    The callback is called as each range in file order is merged.
+    """
+    with borrow_mmap(hbnpath) as buf:
+        points = split_points(buf, workers)
+    size = points[-1]
+    nranges = len(points) - 1
+    vnames = {}
+    matched = {}
+    offsets = {}
+    headers = []
+    with _futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _scan_worker,
+            [hbnpath] * nranges,
+            points[:-1],
+            points[1:],
+            [lablist] * nranges,
+            [intervalcode] * nranges,
+        )
+        for stop, result in zip(points[1:], results):
+            rvnames, rmatched, roffsets, rheaders, rstats = result
+            _instrument.add("scan", bytes=rstats["bytes"], records=rstats["records"])
+            for key, names in rvnames.items():
+                vnames.setdefault(key, []).extend(names)
+            matched.update(rmatched)
+            for key, offs in roffsets.items():
+                offsets.setdefault(key, []).append(offs)
+            headers.extend(rheaders)
+            if callback is not None:
+                callback(stop, size)
+    return _scanned(
+        vnames,
+        matched,
+        {key: np.concatenate(offs) for key, offs in offsets.items()},
+        headers,
+    )
+
+
+def _gather(buf, offsets, fields, dtype):
+    """Return an array of the values at offsets[:, None] + fields."""
+    dtype = np.dtype(dtype)
+    width = dtype.itemsize
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    cols = (np.asarray(fields)[:, None] + np.arange(width)).ravel()
+    out = np.empty((len(offsets), len(fields)), dtype=dtype)
+    step = max(1, _GATHER_BYTES // (8 * len(cols)))
+    for i in range(0, len(offsets), step):
+        idx = offsets[i : i + step, None] + cols
+        out[i : i + step] = raw[idx].view(dtype)
+    return out
+
+
+def record_dates(buf, offsets, bivl=False):
+    """Return the datetime64[ns] date of each data record at offsets."""
+    parts = _gather(
+        buf, offsets, _DATE_OFFSET + 4 * np.arange(5), np.dtype("<i4")
+    ).astype(np.int64)
+    year, month, day, hour, minute = parts.T
+    dates = ((year - 1970) * 12 + month - 1).astype("datetime64[M]").astype(
+        "datetime64[ns]"
+    ) + (day - 1).astype("timedelta64[D]")
+    if bivl:
+        # HSPF uses hour 24 to represent the end of the last interval of the
+        # day.
+        dates = (
+            dates + hour.astype("timedelta64[h]") + minute.astype("timedelta64[m]")
+        )
+    return dates
+
+
+def record_values(buf, offsets, indices):
+    """Return the float32 values of variables `indices` at offsets."""
+    return _gather(
+        buf, offsets, _VALUES_OFFSET + 4 * np.asarray(indices), np.dtype("<f4")
+    )
+
+
+def columns(vnames, matched, offsets, sort_columns=False):
+    """Return a list of (column name, offsets key, variable index)."""
+    cols = [(key, i) for key in offsets for i in matched[key[:3]]]
+    if sort_columns:
+        cols.sort(key=lambda x: (x[0][1], x[0][2], vnames[x[0][:3]][x[1]], x[0][3]))
+    return [
+        (f"{key[0]}_{key[1]}_{vnames[key[:3]][i]}".replace(" ", "-"), key, i)
+        for key, i in cols
+    ]
+
+
+def label_columns(lay, label):
+    """Return the positions in lay.columns of the columns matched by label."""
+    lablist, intervalcode = _utils.normalize_labels([label], lay.interval)
+    return [
+        num
+        for num, (_, key, i) in enumerate(lay.columns)
+        if _match(key[:3] + (lay.vnames[key[:3]][i], intervalcode), lablist)
+    ]
+
+
+def period_start(index, interval):
+    """Return the start of each period for record dates at interval."""
+    unit = {"yearly": "Y", "monthly": "M", "daily": "D"}.get(interval.lower())
+    if unit is None:
+        return index
+    return index.astype(f"datetime64[{unit}]").astype("datetime64[ns]")
+
+
+def to_frame(index, data, names, interval):
+    """Assemble the extracted hbn arrays into a period indexed DataFrame."""
+    with _instrument.stage("frame"):
+        result = pd.DataFrame(data, index=pd.DatetimeIndex(index), columns=names)
+        if interval == "bivl":
+            result.index = result.index.to_period(result.index[1] - result.index[0])
+        else:
+            result.index = result.index.to_period()
+        result.index.name = "Datetime"
+    _instrument.add("frame", rows=len(result))
+    return result
+
+
+def _check_interval(interval):
+    """Return the lower case interval or raise a ValueError."""
+    interval = interval.lower()
+    if interval not in _INTERVALS:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The "interval" argument must be one of "bivl", "daily",
+                "monthly", or "yearly".  You supplied "{interval}".
+                """
+            )
+        )
+    return interval
+
+
+# The record layout of the labels matched in a hbn file.  'size' and
+# 'digest' (of the header records at 'headers') are used by `same_layout` to
+# check whether another file, for example a different scenario run of the
+# same model, can reuse the layout without a scan.
+Layout = namedtuple(
+    "Layout", "interval size headers digest vnames matched offsets columns"
+)
+
+
+def select(scanned, lablist, intervalcode):
+    """Return the `scan` result of lablist from a scan of every record."""
+    vnames, _, offsets, headers = scanned
+    matched = {
+        key: [
+            i
+            for i, vname in enumerate(names)
+            if _match(key + (vname, intervalcode), lablist)
+        ]
+        for key, names in vnames.items()
+    }
+    offsets = {
+        key: offs
+        for key, offs in offsets.items()
+        if key[3] == intervalcode and matched.get(key[:3])
+    }
+    return vnames, matched, offsets, headers
+
+
+def _digest(buf, headers):
+    """Return a digest of the header records."""
+    hsh = hashlib.blake2b(digest_size=16)
+    for pos, length in headers:
+        hsh.update(buf[pos : pos + length])
+    return hsh.hexdigest()
+
+
+def block_digests(buf, offsets):
+    """Return a digest of the records of each key of offsets.
+
+    The interval code, dates, and values of every record of the key are
+    hashed, so the digest changes if any value of any variable of that
+    operation, group, and interval changes.
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    result = {}
+    with _instrument.stage("digest"):
+        for key, offs in offsets.items():
+            hsh = hashlib.blake2b(len(offs).to_bytes(8, "little"), digest_size=16)
+            if len(offs):
+                end = 4 + (_WORD.unpack_from(buf, int(offs[0]))[0] >> 2)
+                cols = np.arange(_LEVEL_OFFSET, end)
+                step = max(1, _GATHER_BYTES // (8 * len(cols)))
+                for i in range(0, len(offs), step):
+                    hsh.update(raw[offs[i : i + step, None] + cols].tobytes())
+                _instrument.add(
+                    "digest", records=len(offs), bytes=len(offs) * len(cols)
+                )
+            result[key] = hsh.hexdigest()
+    return result
+
+
+def block_extent(buf, offs):
+    """Return the number of records, first and last offset, record length,
+    and a digest of the last record.
+
+    A block of records with a different extent has changed without reading
+    the rest of its values.
+    """
+    if not len(offs):
+        return (0, 0, 0, 0, "")
+    reclen = _WORD.unpack_from(buf, int(offs[0]))[0] >> 2
+    last = int(offs[-1])
+    tail = hashlib.blake2b(
+        buf[last + _LEVEL_OFFSET : last + 4 + reclen], digest_size=8
+    ).hexdigest()
+    return (len(offs), int(offs[0]), last, reclen, tail)
+
+
+def layout(
+    buf,
+    interval,
+    *labels,
+    sort_columns=False,
+    callback=None,
+    workers=None,
+    hbnpath=None,
+    scanned=None,
+):
+    """Scan buf and return the Layout of the records matched by labels.
+
+    If `workers` is more than one and there is more than one CPU, `hbnpath`,
+    the file name of buf, is scanned in that many processes with
+    `scan_parallel`.  If `scanned` is
+    the result of `scan` of every record of buf, with lablist of None, the
+    records are selected from it without scanning again.
+    """
+    interval = _check_interval(interval)
+    lablist, intervalcode = _utils.normalize_labels(labels, interval)
+
+    with _instrument.stage("scan"):
+        if scanned is not None:
+            vnames, matched, offsets, headers = select(
+                scanned, lablist, intervalcode
+            )
+        elif _parallel(workers):
+            vnames, matched, offsets, headers = scan_parallel(
+                hbnpath,
+                workers,
+                lablist=lablist,
+                intervalcode=intervalcode,
+                callback=callback,
+            )
+        else:
+            vnames, matched, offsets, headers = scan(
+                buf, lablist=lablist, intervalcode=intervalcode, callback=callback
+            )
+    if callback is not None:
+        callback(len(buf), len(buf))
+    if not offsets:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The label specifications below matched no records in the
+                binary file.
+
+                {lablist}
+                """
+            )
+        )
+    with _instrument.stage("match"):
+        for lbl in lablist:
+            if not any(
+                _match(key + (vnames[key][i], intervalcode), [lbl])
+                for key in matched
+                for i in matched[key]
+                if key + (intervalcode,) in offsets
+            ):
+                sys.stderr.write(
+                    tsutils.error_wrapper(
+                        f"""
+                        Warning: The label '{lbl}' matched no records in the
+                        binary file.
+                        """
+                    )
+                )
+        cols = columns(vnames, matched, offsets, sort_columns=sort_columns)
+    _instrument.add(
+        "match", matched=len(cols), records=sum(len(i) for i in offsets.values())
+    )
+
+    return Layout(
+        interval,
+        len(buf),
+        headers,
+        _digest(buf, headers),
+        vnames,
+        matched,
+        offsets,
+        cols,
+    )
+
+
+def same_layout(buf, lay):
+    """Return True if buf has the same record layout as the Layout lay.
+
+    Compares the file size, the header records, and the leader and level of
+    the first and last data record of each matched operation.
+    """
+    if len(buf) != lay.size or _digest(buf, lay.headers) != lay.digest:
+        return False
+    for (optype, lue, group, level), offs in lay.offsets.items():
+        for pos in (offs[0], offs[-1]):
+            _, rectype, roptype, rlue, rgroup = _LEADER.unpack_from(buf, pos)
+            rlevel = _WORD.unpack_from(buf, pos + _LEVEL_OFFSET)[0]
+            if (
+                rectype != 1
+                or _decode((roptype, rlue, rgroup)) != (optype, lue, group)
+                or rlevel != level
+            ):
+                return False
+    return True
+
+
+def timestamps(buf, lay, period_starts=False):
+    """Return the dates of each offsets key and the sorted union of dates.
+
+    The result can be passed to `blocks` as `stamps` to not read the
+    record dates again.
+    """
+    dates = {}
+    with _instrument.stage("dates"):
+        for key, offs in lay.offsets.items():
+            dates[key] = record_dates(buf, offs, bivl=lay.interval == "bivl")
+            if period_starts:
+                dates[key] = period_start(dates[key], lay.interval)
+            _instrument.add("dates", records=len(offs), bytes=20 * len(offs))
+        index = next(iter(dates.values()))
+        if any(len(i) != len(index) or (i != index).any() for i in dates.values()):
+            index = np.unique(np.concatenate(list(dates.values())))
+    return dates, index
+
+
+def _window(index, start_date=None, end_date=None):
+    """Return the first and last + 1 rows of index between the dates."""
+    first = 0 if start_date is None else np.searchsorted(index, start_date)
+    last = (
+        len(index) if end_date is None else np.searchsorted(index, end_date, "right")
+    )
+    return first, last
+
+
+def window_index(index, start_date=None, end_date=None):
+    """Return the timestamps of index that `blocks` generates between the dates."""
+    first, last = _window(index, start_date=start_date, end_date=end_date)
+    return index[first:last]
+
+
+def period_freq(index, interval):
+    """Return the frequency of the periods of the 'pandas' return type.
+
+    For 'bivl' output the frequency is the step between the first two
+    timestamps of index, and None if there are fewer than two.
+    """
+    if interval != "bivl":
+        return {"yearly": "Y", "monthly": "M", "daily": "D"}[interval]
+    if len(index) < 2:
+        return None
+    return pd.Timedelta(index[1] - index[0])
+
+
+def blocks(
+    buf,
+    lay,
+    chunksize=None,
+    start_date=None,
+    end_date=None,
+    period_starts=False,
+    callback=None,
+    stamps=None,
+):
+    """Yield (timestamps, values) blocks of at most chunksize rows.
+
+    The values are float64 arrays in column major order and are only
+    decoded as each block is generated.  If `period_starts` is True the
+    timestamps of 'yearly', 'monthly', and 'daily' output are the start of
+    each period instead of the record dates.  The optional numpy datetime64
+    `start_date` and `end_date` limit the rows to that window of timestamps.
+    The callback is called as callback(size, size) after the records of
+    each operation are decoded, and an exception raised by the callback
+    stops the decoding.  If `stamps` is the result of `timestamps` with the
+    same `period_starts` the record dates are not read again.
+    """
+    if stamps is None:
+        stamps = timestamps(buf, lay, period_starts=period_starts)
+    dates, index = stamps
+    first, last = _window(index, start_date=start_date, end_date=end_date)
+
+    cols = lay.columns
+    step = chunksize or max(last - first, 1)
+    for row in range(first, last, step):
+        with _instrument.stage("decode"):
+            block = index[row : min(row + step, last)]
+            data = np.full((len(block), len(cols)), np.nan, order="F")
+            for key, offs in lay.offsets.items():
+                lo = np.searchsorted(dates[key], block[0])
+                hi = np.searchsorted(dates[key], block[-1], side="right")
+                if lo == hi:
+                    continue
+                positions = [j for j, col in enumerate(cols) if col[1] == key]
+                values = record_values(
+                    buf, offs[lo:hi], [cols[j][2] for j in positions]
+                )
+                rows = np.searchsorted(block, dates[key][lo:hi])
+                data[rows[:, None], positions] = values
+                _instrument.add("decode", records=hi - lo, bytes=values.nbytes)
+                if callback is not None:
+                    callback(len(buf), len(buf))
+            _instrument.add("decode", rows=len(block))
+        yield block, data
+
+
+def _decode_worker(hbnpath, name, shape, offsets, indices, positions, rows):
+    """Decode the records at offsets into rows and positions of shared memory."""
+    shm = _shared.attach(name)
+    try:
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, order="F")
+        with borrow_mmap(hbnpath) as buf:
+            data[rows[:, None], positions] = record_values(buf, offsets, indices)
+        del data
+    finally:
+        shm.close()
+
+
+def decode_parallel(
+    hbnpath,
+    lay,
+    workers,
+    start_date=None,
+    end_date=None,
+    period_starts=False,
+    callback=None,
+):
+    """Return (timestamps, values) with the values decoded by workers.
+
+    The records of each operation are split into about `workers` ranges
+    that are decoded by a process pool directly into a shared memory
+    array.  Takes the same keywords as `blocks`, the callback is called as
+    each range is finished.
+    """
+    with borrow_mmap(hbnpath) as buf:
+        dates, index = timestamps(buf, lay, period_starts=period_starts)
+    first, last = _window(index, start_date=start_date, end_date=end_date)
+    index = index[first:last]
+    cols = lay.columns
+    shape = (len(index), len(cols))
+    shm = _shared_memory.SharedMemory(create=True, size=max(1, 8 * shape[0] * shape[1]))
+    try:
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, order="F")
+        data[:] = np.nan
+        with _instrument.stage("decode"), _futures.ProcessPoolExecutor(
+            max_workers=workers
+        ) as executor:
+            tasks = []
+            for key, offs in lay.offsets.items():
+                if not len(index):
+                    break
+                lo = np.searchsorted(dates[key], index[0])
+                hi = np.searchsorted(dates[key], index[-1], side="right")
+                positions = [j for j, col in enumerate(cols) if col[1] == key]
+                indices = [cols[j][2] for j in positions]
+                rows = np.searchsorted(index, dates[key][lo:hi])
+                _instrument.add(
+                    "decode", records=hi - lo, bytes=4 * len(indices) * (hi - lo)
+                )
+                for part in np.array_split(np.arange(lo, hi), workers):
+                    if not len(part):
+                        continue
+                    tasks.append(
+                        executor.submit(
+                            _decode_worker,
+                            hbnpath,
+                            shm.name,
+                            shape,
+                            offs[part[0] : part[-1] + 1],
+                            indices,
+                            positions,
+                            rows[part[0] - lo : part[-1] - lo + 1],
+                        )
+                    )
+            try:
+                for task in tasks:
+                    task.result()
+                    if callback is not None:
+                        callback(lay.size, lay.size)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+        _instrument.add("decode", rows=len(index))
+        result = np.array(data, order="F")
+        del data
+    finally:
+        shm.close()
+        shm.unlink()
+    return index, result
+
+
+def read_blocks(
+    hbnpath,
+    interval,
+    *labels,
+    sort_columns=False,
+    callback=None,
+    lay=None,
+    workers=None,
+    **kwds,
+):
+    """Return the column names and a generator of (timestamps, values).
+
+    The file is scanned before returning, unless `lay` is a Layout from a
+    file with the same record layout, and the values are decoded as the
+    blocks are generated.  The scan uses `workers` processes if more than
+    one and there is more than one CPU.  The remaining keywords are passed to
+    `blocks`.
+    """
+    stack = contextlib.ExitStack()
+    buf = stack.enter_context(borrow_mmap(hbnpath))
+    try:
+        if lay is None or not same_layout(buf, lay):
+            lay = layout(
+                buf,
+                interval,
+                *labels,
+                sort_columns=sort_columns,
+                callback=callback,
+                workers=workers,
+                hbnpath=hbnpath,
+            )
+    except BaseException:
+        stack.close()
+        raise
+
+    def generate():
+        with stack:
+            yield from blocks(buf, lay, callback=callback, **kwds)
+
+    return [col[0] for col in lay.columns], generate()
+
+
+def read_arrays(hbnpath, interval, *labels, workers=None, **kwds):
+    """Return (timestamps, values, column names) for the matched labels.
+
+    Takes the same keywords as `read_blocks` except for `chunksize`.  If
+    `workers` is more than one and there is more than one CPU, both the scan
+    and the decoding of the values are split between that many processes.
+    """
+    if _parallel(workers):
+        lay = kwds.pop("lay", None)
+        sort_columns = kwds.pop("sort_columns", False)
+        callback = kwds.pop("callback", None)
+        with borrow_mmap(hbnpath) as buf:
+            if lay is None or not same_layout(buf, lay):
+                lay = layout(
+                    buf,
+                    interval,
+                    *labels,
+                    sort_columns=sort_columns,
+                    callback=callback,
+                    workers=workers,
+                    hbnpath=hbnpath,
+                )
+        index, data = decode_parallel(
+            hbnpath, lay, workers, callback=callback, **kwds
+        )
+        return index, data, [col[0] for col in lay.columns]
+
+    names, blocks = read_blocks(hbnpath, interval, *labels, **kwds)
+    parts = list(blocks)
+    if len(parts) == 1:
+        index, data = parts[0]
+    else:
+        index = np.array([], dtype="datetime64[ns]")
+        data = np.empty((0, len(names)), order="F")
+    return index, data, names
+
+
+def extract(
+    hbnpath,
+    interval,
+    *labels,
+    sort_columns=False,
+    callback=None,
+    workers=None,
+    lay=None,
+):
+    """Return a DataFrame of the matched labels from a hbn file."""
+    index, data, names = read_arrays(
+        hbnpath,
+        interval,
+        *labels,
+        sort_columns=sort_columns,
+        callback=callback,
+        workers=workers,
+        lay=lay,
+    )
+    return to_frame(index, data, names, interval.lower())
+
+
+class LazyVariable:
+    """Array like (time, operation) view of one variable in a hbn file.
+
+    Only the records needed for the requested rows and operations are
+    decoded when indexed, so it can back a dask array.  The memory map is
+    opened on first use in each process and is not pickled.
+
+    Parameters
+    ----------
+    hbnpath
+        Path of the hbn file.
+    ntimes
+        Length of the time axis.
+    sources
+        List with one (offsets, variable index, rows) tuple for each
+        operation, where rows are the sorted positions on the time axis of
+        the data records at offsets.
+    """
+
+    dtype = np.dtype("float64")
+    ndim = 2
+
+    def __init__(self, hbnpath, ntimes, sources):
+        self.hbnpath = hbnpath
+        self.shape = (ntimes, len(sources))
+        self.sources = sources
+        self._buf = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_buf"] = None
+        return state
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        tsel, osel = (np.arange(n)[k] for n, k in zip(self.shape, key))
+        out = np.full((np.size(tsel), np.size(osel)), np.nan)
+        if self._buf is None:
+            self._buf = open_mmap(self.hbnpath)
+        for col, num in enumerate(np.atleast_1d(osel)):
+            offs, index, rows = self.sources[num]
+            pos = np.searchsorted(rows, np.atleast_1d(tsel))
+            found = pos < len(rows)
+            found[found] = rows[pos[found]] == np.atleast_1d(tsel)[found]
+            if found.any():
+                out[found, col] = record_values(self._buf, offs[pos[found]], [index])[
+                    :, 0
+                ]
+        return out.reshape(np.shape(tsel) + np.shape(osel))
+
+
+def _stat(path):
+    """Return the (size, mtime_ns) of path used to notice a rewritten file."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def to_datetime64(date):
+    """Return a start_date or end_date as a numpy datetime64[ns] or None."""
+    if date is None:
+        return None
+    return np.datetime64(pd.Timestamp(tsutils.parsedate(date)), "ns")
+
+
+class HBNFile:
+    """Reusable, thread-safe reader of one hbn file.
+
+    The records of the file are indexed by a scan of every record the first
+    time they are needed and the index is kept, so each later extraction
+    only decodes the selected records.  The file is scanned again if its
+    size or modification time changes.  Each thread reads through its own
+    memory map, so one object can be shared by the threads of a server.
+    Pickling sends the path and the record index but not the memory maps,
+    so the object can be sent to process pool workers without another scan.
+
+    With `incremental` the decoded values are kept with the file size and
+    modification time, the `block_extent`, and the `block_digests` digest
+    of the records of each operation, group, and interval, and when the
+    file is rewritten, for example by another run of the model, only the
+    blocks that changed are decoded again.  A block is unchanged if the
+    file has the same size and modification time as when it was read, and
+    has changed if its extent, which includes its last record, is
+    different.  Only the other blocks are hashed, once for each version of
+    the file.  These are saved at each read in the `sidecar` file if one is
+    given, so `changed_labels` reports the labels that changed since the
+    last read by any process.  Values are decoded outside of the lock, so
+    threads read one object concurrently.
+
+    Parameters
+    ----------
+    hbnpath
+        Path of the hbn file.
+    incremental
+        [optional, default is False]
+
+        Keep the decoded values and the digests of the blocks.
+    sidecar
+        [optional, default is None]
+
+        The JSON file of the file sizes, modification times, extents, and
+        digests at the last read, written after each read.  By default they
+        are only kept in memory.
+    """
+
+    def __init__(self, hbnpath, incremental=False, sidecar=None):
+        self.path = os.fspath(hbnpath)
+        self.incremental = incremental
+        self.sidecar = None if sidecar is None else os.fspath(sidecar)
+        self._stat = None
+        self._scanned = None
+        self._digests = None
+        self._last = None
+        self._init_local()
+
+    def _init_local(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._bufs = []
+        self._generation = 0
+        self._values = {}
+
+    def __getstate__(self):
+        return {
+            "path": self.path,
+            "incremental": self.incremental,
+            "sidecar": self.sidecar,
+            "_stat": self._stat,
+            "_scanned": self._scanned,
+            "_digests": self._digests,
+            "_last": self._last,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def __repr__(self):
+        return f"HBNFile({self.path!r})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _buf(self):
+        """Return the memory map of the file for this thread."""
+        self.scanned()
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            old = getattr(local, "buf", None)
+            if old is not None:
+                old.close()
+            local.buf = open_mmap(self.path)
+            local.generation = self._generation
+            with self._lock:
+                self._bufs = [i for i in self._bufs if i is not old] + [local.buf]
+        return local.buf
+
+    def _snapshot(self):
+        """Return the memory map of this thread with the index, digests,
+        and (size, mtime_ns) of the same version of the file.
+        """
+        while True:
+            buf = self._buf()
+            with self._lock:
+                if self._local.generation == self._generation:
+                    return buf, self._scanned, self._digests, self._stat
+
+    def scanned(self):
+        """Return the `scan` of every record, scanning only when needed."""
+        with self._lock:
+            stat = _stat(self.path)
+            if self._scanned is None or stat != self._stat:
+                with open_mmap(self.path) as buf:
+                    self._scanned = scan(buf)
+                self._digests = {}
+                self._stat = stat
+                self._generation += 1
+            return self._scanned
+
+    def _labels(self, keys):
+        """Return the labels of the variables of keys and their intervals."""
+        vnames = self._scanned[0]
+        result = {}
+        for optype, lue, group, level in keys:
+            interval = _utils.code2intervalmap.get(level)
+            if interval is None or (optype, lue, group) not in vnames:
+                continue
+            for vname in vnames[(optype, lue, group)]:
+                result.setdefault(f"{optype},{lue},{group},{vname}", []).append(
+                    interval
+                )
+        return result
+
+    def labels(self):
+        """Return the "OPTYPE,ID,GROUP,VARIABLE" labels and their intervals.
+
+        Returns
+        -------
+        dict
+            Label to the list of intervals with output for that label.
+        """
+        return self._labels(self.scanned()[2])
+
+    def changed_labels(self):
+        """Return the labels with output that changed since the last read.
+
+        Only available with `incremental`.  Changes are found for each
+        block of one operation, group, and interval, so every variable of a
+        changed group is returned.  The labels of blocks that have not been
+        read before are returned too.
+
+        Returns
+        -------
+        dict
+            Label to the list of intervals that changed for that label.
+        """
+        if not self.incremental:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    """
+                    Changed labels are only tracked by an HBNFile made with
+                    incremental=True.
+                    """
+                )
+            )
+        buf, scanned, digests, stat = self._snapshot()
+        with self._lock:
+            last = dict(self._last_digests())
+        return self._labels(
+            key
+            for key, offs in scanned[2].items()
+            if self._changed(buf, key, offs, last.get(key), digests, stat)
+        )
+
+    @staticmethod
+    def _block_digest(buf, key, offs, digests):
+        """Return the digest of the block key, hashing it once per version.
+
+        digests is the dictionary of the version of the file in buf.
+        """
+        digest = digests.get(key)
+        if digest is None:
+            digest = block_digests(buf, {key: offs})[key]
+            digests[key] = digest
+        return digest
+
+    def _mark(self, buf, key, offs, digests, stat):
+        """Return the (stat, extent, digest) of the block key."""
+        return (
+            stat,
+            block_extent(buf, offs),
+            self._block_digest(buf, key, offs, digests),
+        )
+
+    def _changed(self, buf, key, offs, mark, digests, stat):
+        """Return True if the block key differs from its (stat, extent, digest)
+        mark at the last read.
+        """
+        if mark is None:
+            return True
+        if mark[0] == stat:
+            return False
+        if mark[1] != block_extent(buf, offs):
+            return True
+        return self._block_digest(buf, key, offs, digests) != mark[2]
+
+    def _last_digests(self):
+        """Return the (stat, extent, digest) at the last read of each block."""
+        if self._last is None:
+            self._last = {}
+            saved = {}
+            if self.sidecar is not None:
+                try:
+                    with open(self.sidecar, encoding="ascii") as fpointer:
+                        saved = json.load(fpointer)
+                except (OSError, ValueError):
+                    saved = {}
+            for key, block in saved.get("blocks", {}).items():
+                if not {"stat", "extent", "digest"} <= set(block):
+                    # Written by an older version, read the block again.
+                    continue
+                optype, lue, group, level = key.split(",")
+                self._last[(optype, int(lue), group, int(level))] = (
+                    tuple(block["stat"]),
+                    tuple(block["extent"]),
+                    block["digest"],
+                )
+        return self._last
+
+    def _save_digests(self):
+        """Write the extents and digests at the last read to the sidecar."""
+        if self.sidecar is None:
+            return
+        fdesc, tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.sidecar)), prefix=".tmp-"
+        )
+        try:
+            with os.fdopen(fdesc, "w", encoding="ascii") as fpointer:
+                json.dump(
+                    {
+                        "blocks": {
+                            ",".join(str(i) for i in key): {
+                                "stat": list(stat),
+                                "extent": list(extent),
+                                "digest": digest,
+                            }
+                            for key, (stat, extent, digest) in self._last.items()
+                        }
+                    },
+                    fpointer,
+                )
+            os.replace(tmpname, self.sidecar)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmpname)
+            raise
+
+    def _kept_arrays(self, buf, lay, digests, stat, start_date=None, end_date=None):
+        """Return (timestamps, values) from the kept values of each block.
+
+        The blocks of lay that are not kept or have changed, and the
+        variables not kept, are decoded outside of the lock and kept if the
+        file was not rescanned meanwhile.
+        """
+        with self._lock:
+            generation = self._generation
+            kept = {key: self._values.get(key) for key in lay.offsets}
+        entries = {}
+        for key, offs in lay.offsets.items():
+            entry = kept[key]
+            if entry is None or self._changed(buf, key, offs, entry[0], digests, stat):
+                entry = (
+                    self._mark(buf, key, offs, digests, stat),
+                    record_dates(buf, offs, bivl=lay.interval == "bivl"),
+                    {},
+                )
+            else:
+                entry = ((stat,) + entry[0][1:], entry[1], dict(entry[2]))
+            missing = [
+                i for _, ckey, i in lay.columns if ckey == key and i not in entry[2]
+            ]
+            if missing:
+                with _instrument.stage("decode"):
+                    values = record_values(buf, offs, missing)
+                _instrument.add("decode", records=len(offs), bytes=values.nbytes)
+                for num, i in enumerate(missing):
+                    entry[2][i] = values[:, num].copy()
+            entries[key] = entry
+        with self._lock:
+            if self._generation == generation:
+                last = self._last_digests()
+                for key, entry in entries.items():
+                    current = self._values.get(key)
+                    if current is not None and current[0][1:] == entry[0][1:]:
+                        # Keep the variables another thread decoded meanwhile.
+                        entry = (entry[0], entry[1], current[2] | entry[2])
+                    self._values[key] = entry
+                    last[key] = entry[0]
+                self._save_digests()
+        dates = {key: entry[1] for key, entry in entries.items()}
+        columns = [entries[key][2][i] for _, key, i in lay.columns]
+        index = next(iter(dates.values()))
+        if any(len(i) != len(index) or (i != index).any() for i in dates.values()):
+            index = np.unique(np.concatenate(list(dates.values())))
+        first, last = _window(index, start_date=start_date, end_date=end_date)
+        index = index[first:last]
+        data = np.full((len(index), len(lay.columns)), np.nan, order="F")
+        if len(index):
+            for num, (_, key, _) in enumerate(lay.columns):
+                lo = np.searchsorted(dates[key], index[0])
+                hi = np.searchsorted(dates[key], index[-1], side="right")
+                rows = np.searchsorted(index, dates[key][lo:hi])
+                data[rows, num] = columns[num][lo:hi]
+        return index, data
+
+    def layout(self, interval, *labels, sort_columns=False):
+        """Return the Layout of the records matched by labels."""
+        buf = self._buf()
+        return layout(
+            buf, interval, *labels, sort_columns=sort_columns, scanned=self._scanned
+        )
+
+    def read_arrays(
+        self, interval, *labels, start_date=None, end_date=None, sort_columns=False
+    ):
+        """Return (timestamps, values, column names) of the matched labels.
+
+        Same as `read_arrays`.
+        """
+        buf, scanned, digests, stat = self._snapshot()
+        lay = layout(buf, interval, *labels, sort_columns=sort_columns, scanned=scanned)
+        if self.incremental:
+            index, data = self._kept_arrays(
+                buf,
+                lay,
+                digests,
+                stat,
+                start_date=to_datetime64(start_date),
+                end_date=to_datetime64(end_date),
+            )
+            return index, data, [col[0] for col in lay.columns]
+        index, data = next(
+            blocks(
+                buf,
+                lay,
+                start_date=to_datetime64(start_date),
+                end_date=to_datetime64(end_date),
+            ),
+            (np.array([], dtype="datetime64[ns]"), np.empty((0, len(lay.columns)))),
+        )
+        return index, data, [col[0] for col in lay.columns]
+
+    def read(
+        self, interval, *labels, start_date=None, end_date=None, sort_columns=False
+    ):
+        """Return a DataFrame of the matched labels, the same as `extract`."""
+        index, data, names = self.read_arrays(
+            interval,
+            *labels,
+            start_date=start_date,
+            end_date=end_date,
+            sort_columns=sort_columns,
+        )
+        return to_frame(index, data, names, interval.lower())
+
+    def close(self):
+        """Close the memory maps of every thread and drop the kept values.
+
+        Only call when no thread is reading, a later read opens a new map.
+        """
+        with self._lock:
+            for buf in self._bufs:
+                buf.close()
+            self._bufs = []
+            self._values = {}
+            self._generation += 1
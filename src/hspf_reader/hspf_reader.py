@@ -1,27 +1,753 @@
 """Collection of functions for reading different time series from HSPF."""
 
+import asyncio as _asyncio
+import concurrent.futures as _futures
+import contextlib as _contextlib
+import contextvars as _contextvars
+import functools as _functools
+import itertools as _itertools
+import os as _os
 import os.path as _os_path
 import sys as _sys
+import threading as _threading
+import time as _time
 import warnings as _warnings
+import weakref as _weakref
 
+import numpy as np
 import pandas as pd
 
+from hspf_reader import cache as _cache
+from hspf_reader import catalog as _catalog
+from hspf_reader import ensemble as _ensemble
+from hspf_reader import hbnfile as _hbnfile
+from hspf_reader import instrument as _instrument
+from hspf_reader import metrics as _metrics
+from hspf_reader import plotgenfile as _plotgenfile
+from hspf_reader import shared as _shared
+from hspf_reader import spill as _spill
+from hspf_reader import wdmfile as _wdmfile
 from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
-from hspf_reader.toolbox_utils.src.toolbox_utils.readers.hbn import hbn_extract as _hbn
-from hspf_reader.toolbox_utils.src.toolbox_utils.readers.plotgen import (
-    plotgen_extract as _plotgen,
-)
-from hspf_reader.toolbox_utils.src.toolbox_utils.readers.wdm import wdm_extract as _wdm
 
 _warnings.filterwarnings("ignore")
 
+# Set by the async functions to a threading.Event that requests cancellation
+# of the extraction running in the executor.
+_CANCEL = _contextvars.ContextVar("_CANCEL", default=None)
+
+# Set by the progress keyword to the callback(bytes_done, total_bytes).
+_PROGRESS = _contextvars.ContextVar("_PROGRESS", default=None)
+
+# Per event loop {(file, limit): asyncio.Semaphore} used by the async
+# functions to limit the number of concurrent extractions from each file.
+_FILE_LIMITS = _weakref.WeakKeyDictionary()
+
+
+class _Cancelled(Exception):
+    """Raised at a batch boundary when an async extraction is cancelled."""
+
+
+def _checkpoint(done=None, total=None):
+    """Called between record batches, stops the extraction if cancelled.
+
+    Also reports the bytes done of the total to the progress callback, which
+    stops the extraction by raising an exception.
+    """
+    event = _CANCEL.get()
+    if event is not None and event.is_set():
+        raise _Cancelled(f"Extraction cancelled after {done} of {total}.")
+    progress = _PROGRESS.get()
+    if progress is not None and done is not None:
+        progress(done, total)
+
+
+def _with_progress(func):
+    """Decorate an extraction function to take the progress keyword."""
+
+    @_functools.wraps(func)
+    def wrapper(*args, **kwds):
+        progress = kwds.pop("progress", None)
+        if progress is None:
+            return func(*args, **kwds)
+        token = _PROGRESS.set(progress)
+        try:
+            return func(*args, **kwds)
+        finally:
+            _PROGRESS.reset(token)
+
+    return wrapper
+
+
+def _hbn_labels(labels):
+    """Normalize hbn label arguments to a list of four item labels."""
+    nlabels = []
+    for label in labels:
+        if isinstance(label, str):
+            nlabels.extend(i.split(",") for i in label.split())
+        elif all(isinstance(i, str) and "," in i for i in label):
+            nlabels.extend(_hbn_labels(label))
+        else:
+            nlabels.append(list(label))
+    return nlabels or [",,,".split(",")]
+
+
+_RETURN_TYPES = ("pandas", "numpy", "arrow", "arrow_stream", "shared")
+
+_DOCSTRINGS = dict(tsutils.docstrings)
+_DOCSTRINGS[
+    "return_type"
+] = """return_type : str
+        [optional, default is 'pandas']
+
+        One of 'pandas', 'numpy', 'arrow', 'arrow_stream', or 'shared'.
+
+        The 'numpy' option skips building the DataFrame and returns a tuple
+        of a datetime64[ns] array of the timestamps, a 2-D float64 array of
+        the values with one column for each time-series, and a list of the
+        column names.  Sub-daily timestamps are the start of each interval
+        and for 'yearly', 'monthly', and 'daily' hbn output the start of
+        each period.  The time-series are outer joined on the timestamps,
+        but there is no frequency inference or filling of missing
+        intervals.
+
+        The 'arrow' option returns a pyarrow.Table with a 'Datetime' column
+        followed by a column for each time-series that share memory with
+        the 'numpy' arrays.  The 'arrow_stream' option returns a
+        pyarrow.RecordBatchReader of `chunksize` rows at a time, and for hbn
+        files the values of each batch are only decoded as it is read.
+        Both require the "pyarrow" package.
+
+        The 'shared' option copies the 'numpy' arrays into a shared memory
+        block and returns a picklable hspf_reader.shared.SharedFrame handle.
+        Pass the handle to worker processes, which call `to_frame` or
+        `arrays` to use the values without a copy.  The calling process
+        owns the block and must `unlink` it, or use the handle in a `with`
+        statement."""
+_DOCSTRINGS[
+    "chunksize"
+] = """chunksize : int
+        [optional, default is 65536]
+
+        The number of rows in each record batch when `return_type` is
+        'arrow_stream'."""
+
+
+_DOCSTRINGS[
+    "progress"
+] = """progress : callable
+        [optional, default is None]
+
+        Called as progress(bytes_done, total_bytes) between batches of
+        records.  For hbn files the bytes are through the scan of the file,
+        then the call is repeated with bytes_done equal to total_bytes as
+        the values of each operation are decoded.  For WDM files the whole
+        file is read for each DSN, and plotgen files are read one file at a
+        time, so they report after each DSN or file.  An exception raised
+        by the callback stops the extraction, closes the file, and is
+        raised to the caller.  Not used by 'arrow_stream' results after
+        they are returned."""
+
+
+_DOCSTRINGS[
+    "cache_dir"
+] = """cache_dir : str
+        [optional, default is None]
+
+        Directory of an on-disk cache of results.  A repeated call with the
+        same arguments on unchanged files returns the stored result instead
+        of reading the files again.  The default is the
+        HSPF_READER_CACHE_DIR environment variable, and if neither is set
+        there is no caching.  The least recently used results are removed
+        when the cache is larger than HSPF_READER_CACHE_SIZE bytes, default
+        1 GiB.  Results with the 'arrow_stream' and 'shared' return types,
+        or with a `max_memory`, are not cached.
+
+        The results are pickles, so the directory is created readable only
+        by you, and a directory that other users can write to is refused.
+        Files are matched by path, size, and modification time, set the
+        HSPF_READER_CACHE_STRICT environment variable to also compare the
+        first 64 KiB of each file."""
+
+
+_DOCSTRINGS[
+    "aggregate"
+] = """aggregate : dict or str
+        [optional, default is None]
+
+        Aggregate each time-series to a new frequency while the data is
+        read instead of returning every time step.  A dictionary with the
+        pandas offset alias "freq" and a list of statistics "how" chosen
+        from 'sum', 'mean', 'min', 'max', 'count', 'first', and 'last'.  For
+        example::
+
+            {"freq": "MS", "how": ["sum", "max"]}
+
+        The string "MS:sum,max" is the same.  The default "how" is 'mean'.
+        The columns are named 'column_how' and the start_date and end_date
+        are applied before aggregation.  For hbn files the memory use
+        depends on the number of aggregated periods and not the number of
+        time steps."""
+
+
+_DOCSTRINGS[
+    "max_memory"
+] = """max_memory : int
+        [optional, default is None]
+
+        The most bytes of values to hold in memory.  If the values of the
+        'pandas' or 'numpy' result would be larger, they are written to a
+        temporary memory mapped store on disk instead and a
+        hspf_reader.spill.SpilledFrame is returned that reads the columns or
+        blocks of rows as they are used.  For the 'pandas' return type its
+        DataFrames have the same index as the DataFrame that would be
+        returned, and for the 'numpy' return type its `arrays` are the same
+        as the arrays that would be returned.  Call its `close` method, or
+        use it in a `with` statement, to remove the store.  Not used with
+        `aggregate`.  The default of None holds every value in memory."""
+
+# Statistics for each aggregate "how", and how to combine the partial
+# statistics of each block.
+_AGGREGATE_STATS = {
+    "sum": ["sum"],
+    "mean": ["sum", "count"],
+    "min": ["min"],
+    "max": ["max"],
+    "count": ["count"],
+    "first": ["first"],
+    "last": ["last"],
+}
+_AGGREGATE_COMBINE = {
+    "sum": "sum",
+    "count": "sum",
+    "min": "min",
+    "max": "max",
+    "first": "first",
+    "last": "last",
+}
+
+# Rows decoded at a time from hbn files when aggregating.
+_AGGREGATE_ROWS = 65536
+
+
+def _parse_aggregate(aggregate):
+    """Return (freq, how list) from the aggregate keyword."""
+    if isinstance(aggregate, str):
+        freq, _, how = aggregate.partition(":")
+        aggregate = {"freq": freq, "how": how.split(",") if how else ["mean"]}
+    try:
+        freq = aggregate["freq"]
+    except (KeyError, TypeError) as exc:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The "aggregate" keyword must be a dictionary with a "freq"
+                key, or a "freq:how,how" string.  You gave {aggregate}.
+                """
+            )
+        ) from exc
+    how = tsutils.make_list(aggregate.get("how", "mean"))
+    bad = [i for i in how if i not in _AGGREGATE_STATS]
+    if bad:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The aggregate "how" must be from {list(_AGGREGATE_STATS)}.
+                You gave {bad}.
+                """
+            )
+        )
+    return freq, how
+
+
+class _Aggregator:
+    """Incrementally aggregate blocks of time-series to a frequency.
+
+    Each block is reduced to partial statistics for each period, so only
+    the partial statistics are kept.  Blocks with the same columns must be
+    given in time order.
+    """
+
+    def __init__(self, freq, how):
+        self.freq = freq
+        self.how = how
+        self.stats = sorted({j for i in how for j in _AGGREGATE_STATS[i]})
+        self.partials = {}
+        self.anchors = {}
+
+    def update(self, index, data, names):
+        """Reduce the (timestamps, values) block of the columns names."""
+        if len(index) == 0:
+            return
+        with _instrument.stage("aggregate"):
+            names = tuple(names)
+            index = pd.DatetimeIndex(index)
+            frame = pd.DataFrame(data, index=index, columns=range(len(names)))
+            anchor, last = self.anchors.setdefault(names, (index[0], None))
+            if index[0] != anchor:
+                # A missing value at the first timestamp of the time-series
+                # makes the periods of every block the same as a single
+                # resample.
+                missing = pd.DataFrame(np.nan, index=[anchor], columns=frame.columns)
+                frame = pd.concat([missing, frame])
+            resampler = frame.resample(self.freq)
+            partial = pd.concat(
+                {i: getattr(resampler, i)() for i in self.stats}, axis=1
+            )
+            if last is not None:
+                partial = partial[partial.index >= last]
+            self.anchors[names] = (anchor, partial.index[-1])
+            self.partials.setdefault(names, []).append(partial)
+        _instrument.add("aggregate", rows=len(index))
+
+    def result(self):
+        """Return a DataFrame of the aggregated 'column_how' columns."""
+        result = pd.DataFrame()
+        for names, partials in self.partials.items():
+            grouped = pd.concat(partials).groupby(level=0, sort=False)
+            stats = {
+                i: getattr(grouped, _AGGREGATE_COMBINE[i])()[i] for i in self.stats
+            }
+            columns = {}
+            for num, name in enumerate(names):
+                for how in self.how:
+                    if how == "mean":
+                        values = stats["sum"][num] / stats["count"][num].where(
+                            stats["count"][num] > 0
+                        )
+                    else:
+                        values = stats[how][num]
+                    columns[f"{name}_{how}"] = values
+            result = result.join(pd.DataFrame(columns), how="outer")
+        result.index.name = "Datetime"
+        return result
+
+
+def _aggregated(result, return_type="pandas", chunksize=65536):
+    """Return the aggregated DataFrame result in the requested form."""
+    if return_type == "pandas":
+        return result
+    return _from_arrays(
+        np.asarray(result.index, dtype="datetime64[ns]"),
+        np.asfortranarray(result.to_numpy(dtype="float64", na_value=np.nan)),
+        list(result.columns),
+        return_type,
+        chunksize,
+    )
+
+
+def _check_return_type(return_type):
+    """Raise a ValueError if return_type is not supported."""
+    if return_type not in _RETURN_TYPES:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The "return_type" keyword must be one of {_RETURN_TYPES}.  You
+                gave "{return_type}".
+                """
+            )
+        )
+
+
+def _import_pyarrow():
+    """Return the pyarrow module or raise an ImportError with instructions."""
+    try:
+        import pyarrow
+    except ImportError as exc:
+        raise ImportError(
+            tsutils.error_wrapper(
+                """
+                The 'arrow' and 'arrow_stream' return types require the
+                "pyarrow" package.  Install with "pip install pyarrow".
+                """
+            )
+        ) from exc
+    return pyarrow
+
+
+def _arrow_schema(names):
+    """Return the pyarrow.Schema of a 'Datetime' column and float columns."""
+    pa = _import_pyarrow()
+    return pa.schema(
+        [pa.field("Datetime", pa.timestamp("ns"))]
+        + [pa.field(name, pa.float64()) for name in names]
+    )
+
+
+def _arrow_arrays(index, data):
+    """Return pyarrow arrays that share memory with index and data columns."""
+    pa = _import_pyarrow()
+    return [pa.array(index)] + [pa.array(data[:, i]) for i in range(data.shape[1])]
+
+
+def _arrow_stream(names, blocks):
+    """Return a pyarrow.RecordBatchReader of the (timestamps, values) blocks."""
+    pa = _import_pyarrow()
+    schema = _arrow_schema(names)
+    return pa.RecordBatchReader.from_batches(
+        schema,
+        (
+            pa.RecordBatch.from_arrays(_arrow_arrays(index, data), schema=schema)
+            for index, data in blocks
+        ),
+    )
+
+
+def _from_arrays(index, data, names, return_type="numpy", chunksize=65536):
+    """Return the timestamps, values, and names in the requested form."""
+    if return_type == "numpy":
+        return index, data, names
+    if return_type == "shared":
+        return _shared.SharedFrame.create(index, data, names)
+    if return_type == "arrow":
+        return _import_pyarrow().Table.from_arrays(
+            _arrow_arrays(index, data), schema=_arrow_schema(names)
+        )
+    return _arrow_stream(
+        names,
+        (
+            (index[row : row + chunksize], data[row : row + chunksize])
+            for row in range(0, len(index), chunksize)
+        ),
+    )
+
+
+def _frame_arrays(nts):
+    """Return the datetime64[ns] timestamps and float64 values of nts."""
+    index = nts.index
+    if isinstance(index, pd.PeriodIndex):
+        index = index.to_timestamp()
+    return (
+        np.asarray(index, dtype="datetime64[ns]"),
+        nts.to_numpy(dtype="float64", na_value=np.nan),
+    )
+
+
+def _align(parts):
+    """Outer join a list of (timestamps, values, names) on the timestamps.
+
+    The joined values are in column major order so that each column is
+    contiguous.
+    """
+    if not parts:
+        return np.array([], dtype="datetime64[ns]"), np.empty((0, 0)), []
+    index = parts[0][0]
+    same = all(
+        len(part[0]) == len(index) and (part[0] == index).all() for part in parts[1:]
+    )
+    if not same:
+        index = np.unique(np.concatenate([part[0] for part in parts]))
+    data = np.full(
+        (len(index), sum(part[1].shape[1] for part in parts)), np.nan, order="F"
+    )
+    col = 0
+    for dates, values, _ in parts:
+        rows = slice(None) if same else np.searchsorted(index, dates)
+        data[rows, col : col + values.shape[1]] = values
+        col += values.shape[1]
+    return index, data, [name for part in parts for name in part[2]]
+
+
+def _datetime64(date):
+    """Return the start_date or end_date as a numpy datetime64[ns] or None."""
+    if date is None:
+        return None
+    return np.datetime64(pd.Timestamp(tsutils.parsedate(date)), "ns")
+
+
+def _date_window(index, data, start_date=None, end_date=None):
+    """Slice the timestamps and values to start_date through end_date."""
+    start = 0
+    stop = len(index)
+    if start_date is not None:
+        start = np.searchsorted(index, _datetime64(start_date))
+    if end_date is not None:
+        stop = np.searchsorted(index, _datetime64(end_date), side="right")
+    return index[start:stop], data[start:stop]
+
+
+def _finish(
+    frames,
+    start_date=None,
+    end_date=None,
+    return_type="pandas",
+    chunksize=65536,
+    aggregate=None,
+):
+    """Join frames and apply the common keywords or return arrays."""
+    if aggregate is not None:
+        aggregator = _Aggregator(*_parse_aggregate(aggregate))
+        for nts in frames:
+            index, data = _date_window(*_frame_arrays(nts), start_date, end_date)
+            aggregator.update(index, data, list(nts.columns))
+        return _aggregated(aggregator.result(), return_type, chunksize)
+    if return_type == "pandas":
+        frames = list(frames)
+        columns = [col for nts in frames for col in nts.columns]
+        with _instrument.stage("join"):
+            if (
+                frames
+                and len(set(columns)) == len(columns)
+                and all(nts.index.is_unique for nts in frames)
+            ):
+                # One alignment of all of the columns.
+                result = pd.concat(frames, axis=1, sort=True)
+            else:
+                result = pd.DataFrame()
+                for nts in frames:
+                    result = result.join(nts, how="outer")
+        with _instrument.stage("common_kwds"):
+            result = tsutils.common_kwds(
+                result, start_date=start_date, end_date=end_date
+            )
+        with _instrument.stage("asbestfreq"):
+            result = tsutils.asbestfreq(result)
+        _instrument.add("asbestfreq", rows=len(result))
+        return result
+    parts = [_frame_arrays(nts) + (list(nts.columns),) for nts in frames]
+    with _instrument.stage("align"):
+        index, data, names = _align(parts)
+        index, data = _date_window(index, data, start_date, end_date)
+    _instrument.add("align", rows=len(index))
+    return _from_arrays(index, data, names, return_type, chunksize)
+
+
+def _spilled(make):
+    """Return the SpilledFrame from make() and count the bytes written."""
+    with _instrument.stage("spill"):
+        result = make()
+    _instrument.add(
+        "spill", rows=len(result), bytes=8 * len(result) * len(result.columns)
+    )
+    return result
+
+
+def _spill_index(start_date=None, end_date=None, return_type="pandas"):
+    """Return the SpilledFrame.from_frames reindex of `_finish`.
+
+    For the 'pandas' return type the common keywords and frequency
+    inference of `_finish` are applied to a column that has a value at the
+    timestamps where any time-series does, otherwise the timestamps are
+    sliced to start_date through end_date.
+    """
+
+    def reindex(index, valid):
+        if return_type != "pandas":
+            return _date_window(index, index, start_date, end_date)[0]
+        marker = pd.DataFrame(
+            {"marker": np.where(np.isin(index, valid), 1.0, np.nan)},
+            index=pd.DatetimeIndex(index, name="Datetime"),
+        )
+        marker = tsutils.common_kwds(marker, start_date=start_date, end_date=end_date)
+        return tsutils.asbestfreq(marker).index
+
+    return reindex
+
+
+def _spill_frames(
+    frames, max_memory, start_date=None, end_date=None, return_type="pandas"
+):
+    """Return the list of frames, or a SpilledFrame if larger than max_memory.
+
+    Frames are held until the estimated size of their values is more than
+    max_memory bytes, then the held and remaining frames are written to a
+    SpilledFrame one at a time, with the timestamps that `_finish` would
+    return.
+    """
+    frames = iter(frames)
+    held = []
+    size = 0
+    for nts in frames:
+        held.append(nts)
+        size += 8 * len(nts) * (len(nts.columns) + 1)
+        if size > max_memory:
+            break
+    else:
+        return held
+
+    def remaining():
+        while held:
+            yield held.pop(0)
+        yield from frames
+
+    reindex = _spill_index(start_date, end_date, return_type)
+    return _spilled(
+        lambda: _spill.SpilledFrame.from_frames(remaining(), reindex=reindex)
+    )
+
+
+def _plotgen_frames(plotgen_args, read=_plotgenfile.extract):
+    """Yield a DataFrame for each file or field in the plotgen arguments.
+
+    The plotgen files are read with read(pltpath, *fields), where fields are
+    the unique curve labels requested from the file, or empty for every
+    curve.
+    """
+    labels = tsutils.normalize_command_line_args(plotgen_args)
+    sizes = [_os_path.getsize(lab[0]) for lab in labels]
+    total = sum(sizes)
+    names = set()
+    cnt = 0
+    for num, lab in enumerate(labels):
+        _checkpoint(sum(sizes[:num]), total)
+        pltpath, *fields = lab
+        with _instrument.stage("plotgen_extract"):
+            pgdf = read(pltpath, *dict.fromkeys(fields))
+        _instrument.add(
+            "plotgen_extract",
+            bytes=_os_path.getsize(pltpath),
+            rows=len(pgdf),
+            matched=len(fields) or len(pgdf.columns),
+        )
+        if not fields:
+            columns = []
+            for label in pgdf.columns:
+                col_name = label
+                if col_name in names:
+                    col_name = f"{_os_path.basename(pltpath)}_{label}"
+                    if col_name in names:
+                        cnt = cnt + 1
+                        col_name = f"{col_name}_{cnt}"
+                columns.append(col_name)
+            names.update(columns)
+            yield pgdf.set_axis(columns, axis=1)
+            continue
+        for field in fields:
+            col_name = f"{_os_path.basename(pltpath)}_{field}"
+            if col_name in names:
+                cnt = cnt + 1
+                col_name = f"{col_name}_{cnt}"
+            names.add(col_name)
+            nts = pgdf[[field]]
+            nts.columns = [col_name]
+            yield nts
+    _checkpoint(total, total)
+
+
+@_contextlib.contextmanager
+def _plotgen_reader(plotgen_args, workers=None):
+    """Return a context manager of the read function for `_plotgen_frames`.
+
+    With two or more workers a single plotgen file is split into ranges
+    parsed by the workers, and several plotgen files are each parsed once,
+    with the union of the fields requested from it, by a process pool.
+    The read function waits for the file it is asked for, so the frames
+    are still made in the order of the arguments.
+    """
+    if workers is None or workers < 2:
+        yield _plotgenfile.extract
+        return
+    requested = {}
+    for pltpath, *fields in tsutils.normalize_command_line_args(plotgen_args):
+        requested.setdefault(pltpath, []).append(fields)
+    if len(requested) == 1:
+        yield _functools.partial(_plotgenfile.extract, workers=workers)
+        return
+    with _futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for pltpath, fields in requested.items():
+            union = []
+            if all(fields):
+                union = list(dict.fromkeys(i for j in fields for i in j))
+            futures[pltpath] = executor.submit(
+                _plotgenfile.extract, pltpath, *union
+            )
+
+        def read(pltpath, *_):
+            return futures[pltpath].result()
+
+        try:
+            yield read
+        except BaseException:
+            for future in futures.values():
+                future.cancel()
+            raise
+
+
+def _wdm_labels(wdmpath):
+    """Return a [wdmfile, dsn, ...] list for each file in the wdm arguments.
+
+    The arguments are WDM file names each followed by DSNs, separated by
+    commas, spaces, or given as separate arguments, for example
+    "a.wdm,101 b.wdm,104" or ("a.wdm", 101, 104).
+    """
+    if isinstance(wdmpath, (str, int)):
+        wdmpath = [wdmpath]
+    args = []
+    for arg in wdmpath:
+        items = str(arg).split()
+        if len(items) > 1 and _os_path.exists(items[0].split(",")[0]):
+            args.extend(items)
+        else:
+            args.append(str(arg))
+    if not args or not _os_path.exists(args[0].split(",")[0]):
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The first wdm argument must be an existing WDM file.  You gave
+                {args[:1]}.
+                """
+            )
+        )
+    return tsutils.normalize_command_line_args(args)
+
+
+def _wdm_frames(wdmpath, read=_wdmfile.extract):
+    """Yield a single column DataFrame for each DSN in the wdm arguments.
+
+    Each DSN is read with read(wdmname, dsn).
+    """
+    labels = _wdm_labels(wdmpath)
+    sizes = [_os_path.getsize(lab[0]) * (len(lab) - 1) for lab in labels]
+    total = sum(sizes)
+    names = set()
+    cnt = 0
+    for num, lab in enumerate(labels):
+        wdmname, *dsns = lab
+        size = _os_path.getsize(wdmname)
+        for dnum, dsn in enumerate(dsns):
+            _checkpoint(sum(sizes[:num]) + dnum * size, total)
+            with _instrument.stage("wdm_extract"):
+                nts = read(wdmname, int(dsn))
+            _instrument.add(
+                "wdm_extract",
+                bytes=size,
+                rows=len(nts),
+                matched=1,
+            )
+            col_name = f"{_os_path.basename(wdmname)}_{dsn}"
+            if col_name in names:
+                cnt = cnt + 1
+                col_name = f"{nts.columns[0]}_{cnt}"
+            names.add(col_name)
+            nts.columns = [col_name]
+            yield nts
+    _checkpoint(total, total)
+
+
+def _hbn_cache_args(args):
+    """Return the hbn file and normalized arguments for the cache key."""
+    hbnpath, interval, *labels = args
+    return [hbnpath], [str(interval).lower(), _hbn_labels(labels)]
+
+
+def _plotgen_cache_args(args):
+    """Return the plotgen files and normalized arguments for the cache key."""
+    return _plotgen_paths(args), [str(i) for i in args]
+
+
+def _wdm_cache_args(args):
+    """Return the WDM files and normalized arguments for the cache key."""
+    return _wdm_paths(args), [str(i) for i in args]
+
 
 def about():
     """Display version number and system information."""
     return tsutils.about("hspf_reader")
 
 
-@tsutils.doc(tsutils.docstrings)
+@tsutils.doc(_DOCSTRINGS)
+@_cache.cached("hbn", _hbn_cache_args, ignore=("progress", "workers"))
+@_with_progress
 def hbn(hbnpath, interval, *labels, **kwds):
     r"""
     Prints out data to the screen from a HSPF binary output file.
@@ -111,6 +837,20 @@ def hbn(hbnpath, interval, *labels, **kwds):
 
         If set to False will maintain the columns order of the labels.  If
         set to True will sort all columns by their columns names.
+    ${return_type}
+    ${chunksize}
+    ${aggregate}
+    ${cache_dir}
+    ${progress}
+    workers : int
+        [optional, default is None]
+
+        The number of processes used to read a large file.  The file is
+        split into ranges of whole records that are scanned in parallel,
+        then the values are decoded in parallel into shared memory.  The
+        default of None, or a machine with a single CPU, reads the file in
+        this process.
+    ${max_memory}
     """
     try:
         start_date = kwds.pop("start_date")
@@ -124,27 +864,179 @@ def hbn(hbnpath, interval, *labels, **kwds):
         sort_columns = kwds.pop("sort_columns")
     except KeyError:
         sort_columns = False
+    try:
+        return_type = kwds.pop("return_type")
+    except KeyError:
+        return_type = "pandas"
+    try:
+        chunksize = kwds.pop("chunksize")
+    except KeyError:
+        chunksize = 65536
+    try:
+        aggregate = kwds.pop("aggregate")
+    except KeyError:
+        aggregate = None
+    try:
+        workers = kwds.pop("workers")
+    except KeyError:
+        workers = None
+    try:
+        max_memory = kwds.pop("max_memory")
+    except KeyError:
+        max_memory = None
     if kwds:
         raise ValueError(
             tsutils.error_wrapper(
                 f"""
-                The only allowed keywords are start_date and end_date.  You
-                have given {kwds}.
+                The only allowed keywords are start_date, end_date,
+                sort_columns, return_type, chunksize, aggregate, workers,
+                and max_memory.  You have given {kwds}.
                 """
             )
         )
+    _check_return_type(return_type)
+
+    return _hbn_extract(
+        hbnpath,
+        interval,
+        _hbn_labels(labels),
+        start_date=start_date,
+        end_date=end_date,
+        sort_columns=sort_columns,
+        return_type=return_type,
+        chunksize=chunksize,
+        aggregate=aggregate,
+        workers=workers,
+        max_memory=max_memory,
+    )
+
+
+def _hbn_extract(
+    hbnpath,
+    interval,
+    labels,
+    start_date=None,
+    end_date=None,
+    sort_columns=False,
+    return_type="pandas",
+    chunksize=65536,
+    aggregate=None,
+    workers=None,
+    lay=None,
+    max_memory=None,
+):
+    """Extract the normalized labels from hbnpath, see `hbn`.
+
+    If `lay` is a Layout of hbnpath the file is not scanned.
+    """
+    if aggregate is not None:
+        aggregator = _Aggregator(*_parse_aggregate(aggregate))
+        names, blocks = _hbnfile.read_blocks(
+            hbnpath,
+            interval,
+            *labels,
+            sort_columns=sort_columns,
+            callback=_checkpoint,
+            workers=workers,
+            lay=lay,
+            chunksize=_AGGREGATE_ROWS,
+            start_date=_datetime64(start_date),
+            end_date=_datetime64(end_date),
+            period_starts=True,
+        )
+        for index, data in blocks:
+            aggregator.update(index, data, names)
+        return _aggregated(aggregator.result(), return_type, chunksize)
+
+    if return_type == "arrow_stream":
+        names, blocks = _hbnfile.read_blocks(
+            hbnpath,
+            interval,
+            *labels,
+            sort_columns=sort_columns,
+            callback=_checkpoint,
+            workers=workers,
+            lay=lay,
+            chunksize=chunksize,
+            start_date=_datetime64(start_date),
+            end_date=_datetime64(end_date),
+            period_starts=True,
+        )
+        return _arrow_stream(names, blocks)
 
-    labels = tsutils.make_list(labels)
+    if max_memory is not None and return_type in ("pandas", "numpy"):
+        with _hbnfile.borrow_mmap(hbnpath) as buf:
+            if lay is None or not _hbnfile.same_layout(buf, lay):
+                lay = _hbnfile.layout(
+                    buf,
+                    interval,
+                    *labels,
+                    sort_columns=sort_columns,
+                    callback=_checkpoint,
+                    workers=workers,
+                    hbnpath=hbnpath,
+                )
+            stamps = _hbnfile.timestamps(buf, lay, period_starts=True)
+        index = _hbnfile.window_index(
+            stamps[1],
+            start_date=_datetime64(start_date),
+            end_date=_datetime64(end_date),
+        )
+        ncolumns = max(len(lay.columns), 1)
+        if 8 * len(index) * ncolumns > max_memory:
+            # Decode blocks of rows that fit in max_memory straight into
+            # the store.
+            names, blocks = _hbnfile.read_blocks(
+                hbnpath,
+                interval,
+                *labels,
+                callback=_checkpoint,
+                lay=lay,
+                chunksize=max(int(max_memory) // (8 * ncolumns), 1),
+                start_date=_datetime64(start_date),
+                end_date=_datetime64(end_date),
+                period_starts=True,
+                stamps=stamps,
+            )
+            freq = None
+            if return_type == "pandas":
+                freq = _hbnfile.period_freq(stamps[1], lay.interval)
+            return _spilled(
+                lambda: _spill.SpilledFrame.from_blocks(
+                    index, names, blocks, freq=freq
+                )
+            )
+
+    if return_type != "pandas":
+        index, data, names = _hbnfile.read_arrays(
+            hbnpath,
+            interval,
+            *labels,
+            sort_columns=sort_columns,
+            callback=_checkpoint,
+            workers=workers,
+            lay=lay,
+            start_date=_datetime64(start_date),
+            end_date=_datetime64(end_date),
+            period_starts=True,
+        )
+        return _from_arrays(index, data, names, return_type)
 
-    result = pd.DataFrame()
-    for lab in [labels]:
-        nts = _hbn(hbnpath, interval, lab, sort_columns=sort_columns)
-        result = result.join(nts, how="outer")
-    result = tsutils.common_kwds(result, start_date=start_date, end_date=end_date)
-    return tsutils.asbestfreq(result)
+    result = _hbnfile.extract(
+        hbnpath,
+        interval,
+        *labels,
+        sort_columns=sort_columns,
+        callback=_checkpoint,
+        workers=workers,
+        lay=lay,
+    )
+    return _finish([result], start_date=start_date, end_date=end_date)
 
 
-@tsutils.doc(tsutils.docstrings)
+@tsutils.doc(_DOCSTRINGS)
+@_cache.cached("plotgen", _plotgen_cache_args, ignore=("progress", "workers"))
+@_with_progress
 def plotgen(*plotgen_args, **kwds):
     """Print out plotgen data to the screen with ISO-8601 dates.
 
@@ -161,8 +1053,27 @@ def plotgen(*plotgen_args, **kwds):
             `file.plt` can be space separated sets of 'plotgenpath,field'.
 
             'file.plt,FIELD1 file2.plt,FIELD2 file.plt,FIELD3'
+
+        Selected fields are named 'basename_field', where basename is the
+        file name of the plotgen file.  Every curve of a file given without
+        fields keeps its label, unless an earlier argument already has that
+        name, then it is named 'basename_label'.
     ${start_date}
     ${end_date}
+    ${return_type}
+    ${chunksize}
+    ${aggregate}
+    ${cache_dir}
+    ${progress}
+    workers : int
+        [optional, default is None]
+
+        The number of processes used to parse the plotgen files.  Several
+        files are parsed concurrently, each file once, and the data lines of
+        a single file are split into ranges of whole lines that are parsed
+        in parallel and joined in file order.  The default of None parses
+        the files in this process, one after another.
+    ${max_memory}
     """
     try:
         start_date = kwds.pop("start_date")
@@ -172,38 +1083,177 @@ def plotgen(*plotgen_args, **kwds):
         end_date = kwds.pop("end_date")
     except KeyError:
         end_date = None
+    try:
+        return_type = kwds.pop("return_type")
+    except KeyError:
+        return_type = "pandas"
+    try:
+        chunksize = kwds.pop("chunksize")
+    except KeyError:
+        chunksize = 65536
+    try:
+        aggregate = kwds.pop("aggregate")
+    except KeyError:
+        aggregate = None
+    try:
+        workers = kwds.pop("workers")
+    except KeyError:
+        workers = None
+    try:
+        max_memory = kwds.pop("max_memory")
+    except KeyError:
+        max_memory = None
     if kwds:
         raise ValueError(
             tsutils.error_wrapper(
                 f"""
-                The only allowed keywords are start_date and end_date.  You
-                have given {kwds}.
+                The only allowed keywords are start_date, end_date,
+                return_type, chunksize, aggregate, workers, and max_memory.
+                You have given {kwds}.
                 """
             )
         )
+    _check_return_type(return_type)
 
-    labels = tsutils.normalize_command_line_args(plotgen_args)
+    with _plotgen_reader(plotgen_args, workers=workers) as read:
+        frames = _plotgen_frames(plotgen_args, read=read)
+        if (
+            max_memory is not None
+            and aggregate is None
+            and return_type in ("pandas", "numpy")
+        ):
+            frames = _spill_frames(
+                frames,
+                max_memory,
+                start_date,
+                end_date,
+                return_type=return_type,
+            )
+            if isinstance(frames, _spill.SpilledFrame):
+                return frames
+        return _finish(
+            frames,
+            start_date=start_date,
+            end_date=end_date,
+            return_type=return_type,
+            chunksize=chunksize,
+            aggregate=aggregate,
+        )
 
-    result = pd.DataFrame()
+
+@tsutils.doc(_DOCSTRINGS)
+def _plotgen_iter_names(pltpath, fields):
+    """Return the column names of the DataFrames from `plotgen_iter`."""
+    if not fields:
+        return [curve["label"] for curve in _plotgenfile.header(pltpath)["curves"]]
+    names = []
     cnt = 0
-    for lab in labels:
-        pltpath, *fields = lab
+    for field in fields:
+        col_name = f"{_os_path.basename(pltpath)}_{field}"
+        if col_name in names:
+            cnt = cnt + 1
+            col_name = f"{col_name}_{cnt}"
+        names.append(col_name)
+    return names
+
+
+def plotgen_iter(pltpath, *fields, chunksize=65536, start_date=None, end_date=None):
+    """Yield DataFrames of a fixed number of rows from one plotgen file.
+
+    The file is read and parsed a chunk at a time, so long plotgen files of
+    short time intervals can be processed without holding all of the values
+    in memory.  The chunks joined together are the same as `plotgen` of a
+    regular plotgen file.
+
+    Parameters
+    ----------
+    pltpath : str
+        Path of the plotgen file.
+    fields : str
+        Any number of curve labels, every curve if none are given.  Selected
+        fields are named 'basename_field', where basename is the file name
+        of the plotgen file.
+    chunksize : int
+        [optional, default is 65536]
+
+        The number of rows of each DataFrame, the last may be shorter.
+    ${start_date}
+    ${end_date}
+
+    Returns
+    -------
+    generator
+        Of pandas.DataFrame with a "Datetime" index.
+    """
+    if int(chunksize) < 1:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The chunksize must be a positive integer, you gave
+                {chunksize}.
+                """
+            )
+        )
+    names = _plotgen_iter_names(pltpath, fields) if fields else []
+    for pgdf in _plotgenfile.iter_frames(
+        pltpath,
+        *fields,
+        chunksize=int(chunksize),
+        start_date=_datetime64(start_date),
+        end_date=_datetime64(end_date),
+    ):
+        _instrument.add("plotgen_iter", rows=len(pgdf))
         if fields:
-            for field in fields:
-                nts = _plotgen(pltpath)[field]
-                col_name = f"{_os_path.basename(pltpath)}_{field}"
-                if col_name in result.columns:
-                    cnt = cnt + 1
-                    col_name = f"{col_name}_{cnt}"
-                nts.columns = [col_name]
-                result = result.join(nts, how="outer")
-        else:
-            result = _plotgen(pltpath)
-        result = tsutils.common_kwds(result, start_date=start_date, end_date=end_date)
-    return tsutils.asbestfreq(result)
+            pgdf = pgdf[list(fields)].set_axis(names, axis=1)
+        yield pgdf
+
 
+def plotgen_catalog(*pltpaths):
+    """Return the curves of plotgen files from only the header lines.
 
-@tsutils.doc(tsutils.docstrings)
+    Parameters
+    ----------
+    pltpaths : str
+        Any number of plotgen file names.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each curve with the "path" of the file, the curve
+        "label", the "lintyp", "inteq", "colcod", "tran", and "trancod"
+        codes, the pandas frequency "interval", and the plot "title".
+    """
+    rows = []
+    for pltpath in pltpaths:
+        head = _plotgenfile.header(pltpath)
+        rows.extend(
+            {
+                "path": pltpath,
+                **{key: value for key, value in curve.items() if key != "columns"},
+                "interval": f"{head['interval']}min",
+                "title": head["title"],
+            }
+            for curve in head["curves"]
+        )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "path",
+            "label",
+            "lintyp",
+            "inteq",
+            "colcod",
+            "tran",
+            "trancod",
+            "interval",
+            "title",
+        ],
+    )
+
+
+@tsutils.doc(_DOCSTRINGS)
+@_cache.cached("wdm", _wdm_cache_args, ignore=("progress",))
+@_with_progress
 def wdm(*wdmpath, **kwds):
     """
     Extract DSN data from the WDM file.
@@ -223,6 +1273,12 @@ def wdm(*wdmpath, **kwds):
             'file.wdm,101 file2.wdm,104 file.wdm,227'
     ${start_date}
     ${end_date}
+    ${return_type}
+    ${chunksize}
+    ${aggregate}
+    ${cache_dir}
+    ${progress}
+    ${max_memory}
     """
     try:
         start_date = kwds.pop("start_date")
@@ -232,36 +1288,1398 @@ def wdm(*wdmpath, **kwds):
         end_date = kwds.pop("end_date")
     except KeyError:
         end_date = None
+    try:
+        return_type = kwds.pop("return_type")
+    except KeyError:
+        return_type = "pandas"
+    try:
+        chunksize = kwds.pop("chunksize")
+    except KeyError:
+        chunksize = 65536
+    try:
+        aggregate = kwds.pop("aggregate")
+    except KeyError:
+        aggregate = None
+    try:
+        max_memory = kwds.pop("max_memory")
+    except KeyError:
+        max_memory = None
     if kwds:
         raise ValueError(
             tsutils.error_wrapper(
                 f"""
-                The only allowed keywords are start_date and end_date.  You
-                have given {kwds}.
+                The only allowed keywords are start_date, end_date,
+                return_type, chunksize, aggregate, and max_memory.  You have
+                given {kwds}.
                 """
             )
         )
+    _check_return_type(return_type)
 
-    labels = tsutils.make_list(wdmpath)
+    frames = _wdm_frames(wdmpath)
+    if (
+        max_memory is not None
+        and aggregate is None
+        and return_type in ("pandas", "numpy")
+    ):
+        frames = _spill_frames(
+            frames,
+            max_memory,
+            start_date,
+            end_date,
+            return_type=return_type,
+        )
+        if isinstance(frames, _spill.SpilledFrame):
+            return frames
+    return _finish(
+        frames,
+        start_date=start_date,
+        end_date=end_date,
+        return_type=return_type,
+        chunksize=chunksize,
+        aggregate=aggregate,
+    )
 
-    result = pd.DataFrame()
-    cnt = 0
-    for lab in [labels]:
-        wdmname, *dsns = lab
-        for dsn in dsns:
-            nts = _wdm(wdmname, int(dsn))
-            col_name = f"{_os_path.basename(wdmname)}_{dsn}"
-            if col_name in result.columns:
-                cnt = cnt + 1
-                col_name = f"{nts.columns[0]}_{cnt}"
-            nts.columns = [col_name]
-            result = result.join(nts, how="outer")
-    result = tsutils.common_kwds(result, start_date=start_date, end_date=end_date)
-    return tsutils.asbestfreq(result)
 
+def _hbn_many_arrays(hbnpath, labels, lay, kwds):
+    """Return (timestamps, values, names) of hbnpath using the Layout lay."""
+    names, blocks = _hbnfile.read_blocks(
+        hbnpath, lay.interval, *labels, lay=lay, period_starts=True, **kwds
+    )
+    index, data = next(
+        blocks, (np.array([], dtype="datetime64[ns]"), np.empty((0, len(names))))
+    )
+    return index, data, names
 
-def main():
-    """Set debug, register *_cli functions, and run cltoolbox.main function."""
+
+@tsutils.doc(_DOCSTRINGS)
+def hbn_many(hbnpaths, interval, *labels, workers=None, **kwds):
+    """Extract the same labels from many HSPF binary output files.
+
+    Intended for Monte Carlo and scenario analysis where every file comes
+    from a run of the same model.  The record layout of the labels is found
+    by scanning the first file.  The other files are only checked for the
+    same size, header records, and first and last data records of each
+    matched operation before reusing the layout, otherwise they are scanned.
+
+    Parameters
+    ----------
+    hbnpaths : list
+        List of the HSPF binary output files, or a string of space separated
+        file names.  Each file is a scenario.
+    interval : str
+        See `hbn`.
+    labels : str
+        See `hbn`.
+    workers : int
+        [optional, default is None]
+
+        The number of worker processes that extract the files.  The default
+        of None extracts the files one after another in this process.
+    ${start_date}
+    ${end_date}
+    sort_columns:
+        [optional, default is False]
+
+        See `hbn`.
+    return_type : str
+        [optional, default is 'pandas']
+
+        If 'pandas', return a DataFrame with (scenario, label) MultiIndex
+        columns where the scenario is the file name as given in `hbnpaths`.
+        If 'numpy', return a tuple of a datetime64[ns] array of the start of
+        each interval, a 3-D float64 array of the values with dimensions
+        (scenario, time, label), the list of labels, and the list of
+        scenarios.
+    """
+    try:
+        start_date = kwds.pop("start_date")
+    except KeyError:
+        start_date = None
+    try:
+        end_date = kwds.pop("end_date")
+    except KeyError:
+        end_date = None
+    try:
+        sort_columns = kwds.pop("sort_columns")
+    except KeyError:
+        sort_columns = False
+    try:
+        return_type = kwds.pop("return_type")
+    except KeyError:
+        return_type = "pandas"
+    if kwds:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The only allowed keywords are start_date, end_date,
+                sort_columns, and return_type.  You have given {kwds}.
+                """
+            )
+        )
+    if return_type not in ("pandas", "numpy"):
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The "return_type" keyword must be 'pandas' or 'numpy'.  You
+                gave "{return_type}".
+                """
+            )
+        )
+
+    if isinstance(hbnpaths, str):
+        hbnpaths = hbnpaths.split()
+    hbnpaths = [str(i) for i in hbnpaths]
+    if not hbnpaths:
+        raise ValueError(
+            tsutils.error_wrapper(
+                """
+                The "hbnpaths" argument must name at least one HSPF binary
+                output file.
+                """
+            )
+        )
+    labels = _hbn_labels(labels)
+    window = {
+        "start_date": _datetime64(start_date),
+        "end_date": _datetime64(end_date),
+    }
+
+    with _hbnfile.borrow_mmap(hbnpaths[0]) as buf:
+        lay = _hbnfile.layout(
+            buf, interval, *labels, sort_columns=sort_columns, callback=_checkpoint
+        )
+    if workers is None or workers < 2:
+        results = [_hbn_many_arrays(i, labels, lay, window) for i in hbnpaths]
+    else:
+        with _futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    _hbn_many_arrays,
+                    hbnpaths,
+                    [labels] * len(hbnpaths),
+                    [lay] * len(hbnpaths),
+                    [window] * len(hbnpaths),
+                )
+            )
+
+    if return_type == "pandas":
+        return pd.concat(
+            {
+                path: _hbnfile.to_frame(index, data, names, lay.interval)
+                for path, (index, data, names) in zip(hbnpaths, results)
+            },
+            axis=1,
+            names=["Scenario", None],
+        )
+
+    names = results[0][2]
+    for path, (_, _, snames) in zip(hbnpaths, results):
+        if snames != names:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The labels matched in {path} are different from the labels
+                    matched in {hbnpaths[0]}, so can't be returned as a 3-D
+                    array.  Use return_type='pandas' instead.
+                    """
+                )
+            )
+    index = results[0][0]
+    if any(not np.array_equal(i[0], index) for i in results[1:]):
+        index = np.unique(np.concatenate([i[0] for i in results]))
+    panel = np.full((len(results), len(index), len(names)), np.nan)
+    for num, (sindex, data, _) in enumerate(results):
+        panel[num, np.searchsorted(index, sindex)] = data
+    return index, panel, names, hbnpaths
+
+
+def _ensemble_plan(hbnpath, buf, lay, label):
+    """Return the column name and the (offsets, index, dates) of label."""
+    cols = _hbnfile.label_columns(lay, label)
+    if len(cols) != 1:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The label must match one time-series in each binary file.
+                The label "{label}" matched
+                {[lay.columns[i][0] for i in cols]} in {hbnpath}.
+                """
+            )
+        )
+    name, key, index = lay.columns[cols[0]]
+    offsets = lay.offsets[key]
+    dates = _hbnfile.period_start(
+        _hbnfile.record_dates(buf, offsets, bivl=lay.interval == "bivl"),
+        lay.interval,
+    )
+    return name, (offsets, index, dates)
+
+
+@tsutils.doc(_DOCSTRINGS)
+def hbn_ensemble(
+    hbnpaths,
+    interval,
+    label,
+    stats=None,
+    workers=None,
+    chunksize=4096,
+    start_date=None,
+    end_date=None,
+):
+    """Statistics at each time of one label across many hbn files.
+
+    Intended for uncertainty analysis of hundreds or thousands of scenario
+    runs of the same model.  The time axis is split into blocks of
+    `chunksize` rows and for each block the files are read one after
+    another, updating running statistics, so memory use depends on the
+    block size and the number of statistics but not on the number of
+    files.  Percentiles are estimated with the P-square algorithm, which is
+    exact for five or fewer files.
+
+    As with `hbn_many` the record layout is found by scanning the first
+    file and reused for the other files that have the same size, header
+    records, first and last data records, and period of record, the other
+    files are scanned.
+
+    Parameters
+    ----------
+    hbnpaths : list
+        List of the HSPF binary output files, or a string of space separated
+        file names.
+    interval : str
+        See `hbn`.
+    label : str
+        A label that matches one time-series in each file, for example
+        'RCHRES,412,HYDR,RO'.  See `hbn`.
+    stats : list
+        [optional, default is 'mean std min p5 p50 p95 max']
+
+        The statistics to compute as a list or a string of space or comma
+        separated names, from "count", "mean", "std" (sample standard
+        deviation), "min", "max", and percentiles as "p" followed by the
+        percent, for example "p5" or "p97.5".
+    workers : int
+        [optional, default is None]
+
+        The number of worker processes that compute the blocks.  The
+        default of None computes the blocks one after another in this
+        process.
+    chunksize : int
+        [optional, default is 4096]
+
+        The number of rows in each block.
+    ${start_date}
+    ${end_date}
+
+    Returns
+    -------
+    pandas.DataFrame
+        A column for each statistic, with the same index as `hbn`.  Files
+        without a value at a time are skipped at that time.
+    """
+    names, probs = _ensemble.parse_stats(stats)
+    if isinstance(hbnpaths, str):
+        hbnpaths = hbnpaths.split()
+    hbnpaths = [str(i) for i in hbnpaths]
+    if not hbnpaths:
+        raise ValueError(
+            tsutils.error_wrapper(
+                """
+                At least one binary file is required.
+                """
+            )
+        )
+    chunksize = int(chunksize)
+
+    plans = []
+    plan_ids = []
+    with _instrument.stage("plan"):
+        for num, hbnpath in enumerate(hbnpaths):
+            _checkpoint()
+            with _hbnfile.borrow_mmap(hbnpath) as buf:
+                if num == 0:
+                    lay = _hbnfile.layout(buf, interval, label, callback=_checkpoint)
+                    column, plan = _ensemble_plan(hbnpath, buf, lay, label)
+                    plans.append(plan)
+                    plan_ids.append(0)
+                    continue
+                offsets, _, dates = plans[0]
+                if _hbnfile.same_layout(buf, lay) and np.array_equal(
+                    _hbnfile.period_start(
+                        _hbnfile.record_dates(
+                            buf, offsets[[0, -1]], bivl=lay.interval == "bivl"
+                        ),
+                        lay.interval,
+                    ),
+                    dates[[0, -1]],
+                ):
+                    plan_ids.append(0)
+                    continue
+                flay = _hbnfile.layout(buf, interval, label, callback=_checkpoint)
+                plans.append(_ensemble_plan(hbnpath, buf, flay, label)[1])
+                plan_ids.append(len(plans) - 1)
+    _instrument.add("plan", matched=len(hbnpaths))
+
+    index = plans[0][2]
+    if len(plans) > 1:
+        index = np.unique(np.concatenate([i[2] for i in plans]))
+    start_date = _datetime64(start_date)
+    end_date = _datetime64(end_date)
+    if start_date is not None:
+        index = index[index >= start_date]
+    if end_date is not None:
+        index = index[index <= end_date]
+
+    def tasks():
+        for row in range(0, len(index), chunksize):
+            block = index[row : row + chunksize]
+            bplans = []
+            for offsets, varindex, dates in plans:
+                lo = np.searchsorted(dates, block[0])
+                hi = np.searchsorted(dates, block[-1], side="right")
+                bplans.append(
+                    (offsets[lo:hi], varindex, np.searchsorted(block, dates[lo:hi]))
+                )
+            yield (hbnpaths, plan_ids, bplans, len(block), names, probs)
+
+    parts = []
+    with _instrument.stage("ensemble"):
+        if workers is None or workers < 2:
+            for task in tasks():
+                _checkpoint()
+                parts.append(_ensemble.block_worker(*task))
+        else:
+            with _futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_ensemble.block_worker, *i) for i in tasks()]
+                try:
+                    for future in futures:
+                        _checkpoint()
+                        parts.append(future.result())
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+    _instrument.add("ensemble", rows=len(index))
+
+    data = np.concatenate(parts) if parts else np.empty((0, len(names)))
+    result = _hbnfile.to_frame(index, data, names, lay.interval)
+    result.columns.name = column
+    return result
+
+
+def _import_xarray():
+    """Return the xarray, dask.array, and dask.base modules or raise."""
+    try:
+        import dask.array
+        import dask.base
+        import xarray
+    except ImportError as exc:
+        raise ImportError(
+            tsutils.error_wrapper(
+                """
+                The "open_hbn_dataset" function requires the "xarray" and
+                "dask" packages.  Install with "pip install xarray dask".
+                """
+            )
+        ) from exc
+    return xarray, dask.array, dask.base
+
+
+def open_hbn_dataset(hbnpath, interval, *labels, chunks=None):
+    """Open a HSPF binary output file as a lazy xarray.Dataset.
+
+    The file is scanned once to index the data records, but no values are
+    read until the dask backed variables are computed.  Selecting operations,
+    variables, or a time slice only reads the matching records, and the
+    local dask schedulers can compute reductions in parallel without loading
+    the whole file.
+
+    Each variable is named "OPTYPE_VARIABLE", for example "PERLND_AGWS", and
+    has the dimensions ("time", OPTYPE) where the OPTYPE coordinate is the
+    operation id.  If the same variable name is in more than one group of
+    an operation type the name is "OPTYPE_GROUP_VARIABLE".  Variables of one
+    operation type can be combined into a (variable, time, operation) array
+    with `Dataset.to_array`.
+
+    Parameters
+    ----------
+    hbnpath : str
+        The HSPF binary output file.
+    interval : str
+        See `hbn`.
+    labels : str
+        [optional, default is every operation and variable]
+
+        See `hbn`.
+    chunks : dict
+        [optional, default is None]
+
+        Dask chunk sizes by dimension name.  The default is the dask "auto"
+        size along "time" and a chunk for each operation.
+
+    Returns
+    -------
+    xarray.Dataset
+        The "time" coordinate is the start of each interval.
+    """
+    xarray, dask_array, dask_base = _import_xarray()
+    labels = _hbn_labels(labels)
+    hbnpath = str(hbnpath)
+
+    with _hbnfile.borrow_mmap(hbnpath) as buf:
+        lay = _hbnfile.layout(
+            buf, interval, *labels, sort_columns=True, callback=_checkpoint
+        )
+        dates = {
+            key: _hbnfile.period_start(
+                _hbnfile.record_dates(buf, offs, bivl=lay.interval == "bivl"),
+                lay.interval,
+            )
+            for key, offs in lay.offsets.items()
+        }
+    times = np.unique(np.concatenate(list(dates.values())))
+    token = dask_base.tokenize(
+        hbnpath, _os_path.getmtime(hbnpath), lay.size, lay.digest
+    )
+    rows = {key: np.searchsorted(times, i) for key, i in dates.items()}
+
+    variables = {}
+    for _, key, index in lay.columns:
+        optype, lue, group, _ = key
+        vname = lay.vnames[key[:3]][index].replace(" ", "-")
+        variables.setdefault((optype, vname), {}).setdefault(group, {})[lue] = (
+            lay.offsets[key],
+            index,
+            rows[key],
+        )
+
+    data_vars = {}
+    for (optype, vname), groups in variables.items():
+        for group, sources in groups.items():
+            name = f"{optype}_{vname}"
+            if len(groups) > 1:
+                name = f"{optype}_{group}_{vname}"
+            ids = sorted(sources)
+            lazy = _hbnfile.LazyVariable(hbnpath, len(times), [sources[i] for i in ids])
+            dims = ("time", optype)
+            chunk = {"time": "auto", optype: 1}
+            chunk.update({k: v for k, v in (chunks or {}).items() if k in dims})
+            data_vars[name] = xarray.DataArray(
+                dask_array.from_array(
+                    lazy,
+                    chunks=tuple(chunk[i] for i in dims),
+                    name=f"hbn-{name}-{token}",
+                    meta=np.empty((0, 0)),
+                ),
+                dims=dims,
+                coords={optype: ids},
+                attrs={"operation_type": optype, "group": group, "variable": vname},
+            )
+    dataset = xarray.Dataset(data_vars, coords={"time": times})
+    dataset.attrs = {"source": hbnpath, "interval": lay.interval}
+    return dataset
+
+
+def _metric_pairs(pairs):
+    """Normalize the pairs to a list of (hbn label, DSN) tuples."""
+    npairs = []
+    for pair in pairs:
+        if not isinstance(pair, str):
+            label, dsn = pair
+            if not isinstance(label, str):
+                label = ",".join(str(i) for i in label)
+            npairs.append((label, int(dsn)))
+            continue
+        for item in pair.split():
+            label, sep, dsn = item.rpartition(":")
+            if not sep or not dsn.strip().isdigit():
+                raise ValueError(
+                    tsutils.error_wrapper(
+                        f"""
+                        Each pair must be 'OPERATIONTYPE,ID,VARIABLEGROUP,
+                        VARIABLE:DSN', for example 'RCHRES,412,HYDR,RO:101'.
+                        You gave "{item}".
+                        """
+                    )
+                )
+            npairs.append((label, int(dsn)))
+    return npairs
+
+
+class _Observed:
+    """Blocks of the observed values of one DSN read as they are needed.
+
+    The blocks are read in time order, and only the values from the start
+    of the last requested window on are kept.
+    """
+
+    def __init__(self, wdmpath, dsn):
+        self.blocks = _wdmfile.iter_arrays(wdmpath, dsn, chunksize=_AGGREGATE_ROWS)
+        self.index = np.array([], dtype="datetime64[ns]")
+        self.values = np.array([], dtype=np.float32)
+        self.done = False
+        if not self._read():
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    There is no data for DSN {dsn} in {wdmpath}.
+                    """
+                )
+            )
+
+    def _read(self):
+        """Append the next block, False if there are no more."""
+        with _instrument.stage("wdm_extract"):
+            try:
+                _, index, values = next(self.blocks)
+            except StopIteration:
+                self.done = True
+                return False
+        _instrument.add("wdm_extract", rows=len(index))
+        self.index = np.concatenate(
+            [self.index, np.asarray(index, dtype="datetime64[ns]")]
+        )
+        self.values = np.concatenate([self.values, values])
+        return True
+
+    def window(self, first, last):
+        """Return the timestamps and values from first to last."""
+        while not self.done and (not len(self.index) or self.index[-1] < last):
+            self._read()
+        start = np.searchsorted(self.index, first)
+        self.index = self.index[start:]
+        self.values = self.values[start:]
+        stop = np.searchsorted(self.index, last, side="right")
+        return self.index[:stop], self.values[:stop]
+
+
+def calibration_metrics(
+    hbnpath, interval, wdmpath, *pairs, start_date=None, end_date=None
+):
+    """Goodness of fit of simulated hbn series to observed WDM series.
+
+    The simulated values are decoded from the binary output file, and the
+    observed values from the WDM file, a block at a time and matched by
+    timestamp, and the statistics are accumulated as the blocks are read.
+    No DataFrame of either series is made and there is no join, so memory
+    use does not depend on the length of either series.  Timestamps are the start of
+    each interval, as with return_type='numpy', and only the timestamps
+    where both the simulated and observed values are not missing are used.
+
+    Parameters
+    ----------
+    hbnpath : str
+        The HSPF binary output file.
+    interval : str
+        One of 'yearly', 'monthly', 'daily', or 'bivl'.  See `hbn`.
+    wdmpath : str
+        The WDM file with the observed DSNs.
+    pairs : str
+        Any number of 'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE:DSN' strings,
+        or (label, DSN) tuples in the Python API, where each label matches
+        one time-series in the binary file.  For example::
+
+            'RCHRES,412,HYDR,RO:101 RCHRES,500,HYDR,RO:102'
+    ${start_date}
+    ${end_date}
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each pair with the "simulated" column name, the
+        "observed" column name, the "count" of matched values,
+        "mean_sim", "mean_obs", the Nash-Sutcliffe efficiency "nse", the
+        Kling-Gupta efficiency "kge", the percent bias "pbias" as 100 *
+        sum(obs - sim) / sum(obs), the root mean square error "rmse", and
+        the correlation coefficient "r".
+    """
+    pairs = _metric_pairs(pairs)
+    if not pairs:
+        raise ValueError(
+            tsutils.error_wrapper(
+                """
+                At least one 'label:DSN' pair is required.
+                """
+            )
+        )
+
+    observed = {}
+    for dsn in sorted({dsn for _, dsn in pairs}):
+        _checkpoint()
+        observed[dsn] = _Observed(wdmpath, dsn)
+        _instrument.add("wdm_extract", bytes=_os_path.getsize(wdmpath))
+
+    with _hbnfile.borrow_mmap(hbnpath) as buf:
+        lay = _hbnfile.layout(
+            buf, interval, *[i[0] for i in pairs], callback=_checkpoint
+        )
+        positions = []
+        for label, _ in pairs:
+            cols = _hbnfile.label_columns(lay, label)
+            if len(cols) != 1:
+                raise ValueError(
+                    tsutils.error_wrapper(
+                        f"""
+                        Each label must match one time-series in the binary
+                        file.  The label "{label}" matched
+                        {[lay.columns[i][0] for i in cols]}.
+                        """
+                    )
+                )
+            positions.append(cols[0])
+        moments = [_metrics.Moments() for _ in pairs]
+        for index, data in _hbnfile.blocks(
+            buf,
+            lay,
+            chunksize=_AGGREGATE_ROWS,
+            start_date=_datetime64(start_date),
+            end_date=_datetime64(end_date),
+            period_starts=True,
+            callback=_checkpoint,
+        ):
+            if not len(index):
+                continue
+            windows = {
+                dsn: obs.window(index.min(), index.max())
+                for dsn, obs in observed.items()
+            }
+            with _instrument.stage("metrics"):
+                for moment, pos, (_, dsn) in zip(moments, positions, pairs):
+                    oindex, ovalues = windows[dsn]
+                    if not len(oindex):
+                        continue
+                    rows = np.searchsorted(oindex, index)
+                    rows[rows == len(oindex)] = 0
+                    hit = oindex[rows] == index
+                    moment.update(data[hit, pos], ovalues[rows[hit]])
+            _instrument.add("metrics", rows=len(index))
+
+    return pd.DataFrame(
+        [
+            {
+                "simulated": lay.columns[pos][0],
+                "observed": f"{_os_path.basename(wdmpath)}_{dsn}",
+                **moment.result(),
+            }
+            for moment, pos, (_, dsn) in zip(moments, positions, pairs)
+        ],
+        columns=["simulated", "observed"] + list(_metrics.STATISTICS),
+    )
+
+
+# Bytes of values decoded at a time by series_stats.
+_STATS_BYTES = 1 << 26
+
+
+@tsutils.doc(_DOCSTRINGS)
+def series_stats(path, *labels, interval=None, start_date=None, end_date=None):
+    """Summary statistics of each hbn label or WDM DSN without the series.
+
+    The values are decoded a block at a time and the statistics accumulated
+    as the blocks are read, so no DataFrame of the series is made and
+    memory use does not depend on the length of the file.  The values of
+    hbn files are decoded in blocks of a fixed number of bytes whatever the
+    number of matched labels, and WDM DSNs one DSN at a time.  Timestamps
+    are the start of each interval, as with return_type='numpy'.
+
+    Parameters
+    ----------
+    path : str
+        An HSPF binary output file or a WDM file, found by the contents of
+        the file.
+    labels : str
+        For an hbn file, any number of 'OPERATIONTYPE,ID,VARIABLEGROUP,
+        VARIABLE' labels, see `hbn`.  For a WDM file, any number of DSNs,
+        every DSN with data by default.
+    interval : str
+        [optional, default is None]
+
+        Required for hbn files.  One of 'yearly', 'monthly', 'daily', or
+        'bivl'.
+    ${start_date}
+    ${end_date}
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each matched time-series with the column name of `hbn`
+        or `wdm` as "label", the "count" of values that are not missing,
+        "min", "max", "mean", "sum", and the "start_date" and "end_date" of
+        the first and last values that are not missing.
+    """
+    ftype = _catalog.kind(path)
+    start_date = _datetime64(start_date)
+    end_date = _datetime64(end_date)
+    if ftype == "hbn":
+        if interval is None:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The interval is required for the HSPF binary output
+                    file "{path}".
+                    """
+                )
+            )
+        with _hbnfile.borrow_mmap(path) as buf:
+            lay = _hbnfile.layout(
+                buf, interval, *_hbn_labels(labels), callback=_checkpoint
+            )
+            names = [col[0] for col in lay.columns]
+            summary = _metrics.Summary(len(names))
+            for index, data in _hbnfile.blocks(
+                buf,
+                lay,
+                chunksize=max(1, _STATS_BYTES // (8 * max(1, len(names)))),
+                start_date=start_date,
+                end_date=end_date,
+                period_starts=True,
+                callback=_checkpoint,
+            ):
+                with _instrument.stage("stats"):
+                    summary.update(index, data)
+                _instrument.add("stats", rows=len(index))
+        results = [summary.result()]
+    elif ftype == "wdm":
+        dsns = labels or [i for i, j in _wdmfile.directory(path).items() if j["groups"]]
+        dsns = [int(i) for label in dsns for i in str(label).replace(",", " ").split()]
+        base = _os_path.basename(path)
+        names = []
+        results = []
+        for dsn, index, values in _wdmfile.iter_arrays(path, *dsns):
+            _checkpoint()
+            index = np.asarray(index, dtype="datetime64[ns]")
+            index, values = _date_window(index, values[:, None], start_date, end_date)
+            summary = _metrics.Summary(1)
+            with _instrument.stage("stats"):
+                summary.update(index, values)
+            _instrument.add("stats", rows=len(index))
+            names.append(f"{base}_{dsn}")
+            results.append(summary.result())
+    else:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                "{path}" is not an HSPF binary output file or a WDM file.
+                """
+            )
+        )
+    result = pd.DataFrame({"label": names})
+    for stat in _metrics.SUMMARY:
+        result[stat] = np.concatenate([i[stat] for i in results]) if results else []
+    return result
+
+
+def index_tree(directory, database=None):
+    """Crawl a directory tree and catalog every series in a SQLite database.
+
+    Every hbn label, WDM DSN with its attributes, and plotgen curve in the
+    files under `directory` is recorded with the file name, the byte offset
+    of its first record, and its period of record.  The files are found by
+    their contents, not the file name extension.  Running again only reads
+    the files that are new or have a different size or modification time,
+    and removes the files that are gone.
+
+    Parameters
+    ----------
+    directory : str
+        The root of the tree to crawl.  Hidden directories are skipped.
+    database : str
+        [optional, default is "hspf_reader_index.sqlite" in `directory`]
+
+        The SQLite database file.
+
+    Returns
+    -------
+    dict
+        The number of files "added", "updated", "removed", and "unchanged",
+        and the number of "series" in the added and updated files.
+    """
+    return _catalog.update(directory, database=database)
+
+
+def lookup(database, *labels, file_type=None):
+    """Find the files that hold series in a catalog made by `index_tree`.
+
+    Parameters
+    ----------
+    database : str
+        The SQLite database file.
+    labels : str
+        Any number of an hbn label "OPTYPE,ID,GROUP,VARIABLE" where empty
+        parts match anything, for example "RCHRES,412,HYDR,RO" or
+        ",412,,RO", a WDM DSN number, or a plotgen curve label.  With no
+        labels every series is returned.
+    file_type : str
+        [optional, default is None]
+
+        Only return series of 'hbn', 'wdm', or 'plotgen' files.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each matched series with the "path" and "kind" of the
+        file, the "label", the hbn "interval" or the pandas frequency of WDM
+        and plotgen series, the byte "offset" of the first record,
+        "nrecords", "start_date", "end_date", and the WDM and plotgen
+        "attributes" as JSON.  The "args" column is the argument to pass to
+        `hbn`, `wdm`, or `plotgen` to extract the series from "path".
+    """
+    result = pd.DataFrame(
+        _catalog.find(database, *labels, file_type=file_type),
+        columns=_catalog.COLUMNS,
+    )
+    result["args"] = [
+        row.label if row.kind == "hbn" else f"{row.path},{row.label}"
+        for row in result.itertuples()
+    ]
+    return result[
+        [
+            "path",
+            "kind",
+            "label",
+            "args",
+            "interval",
+            "offset",
+            "nrecords",
+            "start_date",
+            "end_date",
+            "attributes",
+        ]
+    ]
+
+
+# Keywords of each type of batch job, and of every batch job.
+_BATCH_KEYWORDS = {
+    "hbn": ("interval", "labels", "sort_columns"),
+    "wdm": ("dsns",),
+    "plotgen": ("fields",),
+}
+_BATCH_COMMON = (
+    "type",
+    "file",
+    "output",
+    "start_date",
+    "end_date",
+    "aggregate",
+    "float_format",
+)
+
+
+def _load_toml(path):
+    """Return the dictionary of the TOML file at path."""
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    with open(path, "rb") as fpointer:
+        return tomllib.load(fpointer)
+
+
+def _batch_jobs(spec):
+    """Return the validated list of job dictionaries of a batch spec."""
+    root = ""
+    if not isinstance(spec, dict):
+        root = _os_path.dirname(_os_path.abspath(spec))
+        spec = _load_toml(spec)
+    defaults = spec.get("defaults", {})
+    jobs = []
+    for num, job in enumerate(spec.get("job", []), start=1):
+        jtype = job.get("type", defaults.get("type"))
+        if jtype not in _BATCH_KEYWORDS:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The "type" of batch job {num} must be 'hbn', 'wdm', or
+                    'plotgen'.  You gave "{jtype}".
+                    """
+                )
+            )
+        allowed = _BATCH_COMMON + _BATCH_KEYWORDS[jtype]
+        if unknown := sorted(set(job) - set(allowed)):
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The keys of a '{jtype}' batch job are {allowed}.  Job
+                    {num} also has {unknown}.
+                    """
+                )
+            )
+        job = {
+            **{k: v for k, v in defaults.items() if k in allowed},
+            **job,
+            "type": jtype,
+            "job": num,
+        }
+        for key in ("file", "output") + (("interval",) if jtype == "hbn" else ()):
+            if key not in job:
+                raise ValueError(
+                    tsutils.error_wrapper(
+                        f"""
+                        Batch job {num} has no "{key}".
+                        """
+                    )
+                )
+        job["file"] = _os_path.join(root, _os_path.expanduser(str(job["file"])))
+        if job["output"] != "-":
+            job["output"] = _os_path.join(
+                root, _os_path.expanduser(str(job["output"]))
+            )
+        jobs.append(job)
+    return jobs
+
+
+def _batch_hbn(hbnpath, jobs):
+    """Yield (job, result) of the hbn jobs of hbnpath from one scan."""
+    with _hbnfile.borrow_mmap(hbnpath) as buf:
+        with _instrument.stage("scan"):
+            scanned = _hbnfile.scan(buf, callback=_checkpoint)
+        work = []
+        for job in jobs:
+            labels = job.get("labels", [])
+            labels = _hbn_labels([labels] if isinstance(labels, str) else labels)
+            sort_columns = job.get("sort_columns", False)
+            lay = _hbnfile.layout(
+                buf,
+                job["interval"],
+                *labels,
+                sort_columns=sort_columns,
+                scanned=scanned,
+            )
+            work.append((job, labels, sort_columns, lay))
+    for job, labels, sort_columns, lay in work:
+        yield job, _hbn_extract(
+            hbnpath,
+            job["interval"],
+            labels,
+            start_date=job.get("start_date"),
+            end_date=job.get("end_date"),
+            sort_columns=sort_columns,
+            aggregate=job.get("aggregate"),
+            lay=lay,
+        )
+
+
+def _batch_wdm(wdmpath, jobs):
+    """Yield (job, result) of the wdm jobs of wdmpath from one read."""
+    dsns = {
+        job["job"]: [int(i) for i in tsutils.make_list(job.get("dsns", []))]
+        for job in jobs
+    }
+    with _instrument.stage("wdm_extract"):
+        arrays = {
+            dsn: (index, values)
+            for dsn, index, values in _wdmfile.iter_arrays(
+                wdmpath, *sorted({i for j in dsns.values() for i in j})
+            )
+        }
+
+    def read(wdmname, dsn):
+        # The same frame as _wdmfile.extract(wdmname, dsn), NaN rows kept.
+        try:
+            index, values = arrays[dsn]
+        except KeyError:
+            return pd.DataFrame(
+                index=pd.DatetimeIndex([], dtype="datetime64[ns]"),
+                columns=[f"{wdmname}_{dsn}"],
+                dtype="float32",
+            )
+        return pd.DataFrame(values, index=index, columns=[f"{wdmname}_{dsn}"])
+
+    for job in jobs:
+        yield job, _finish(
+            _wdm_frames([wdmpath] + dsns[job["job"]], read=read),
+            start_date=job.get("start_date"),
+            end_date=job.get("end_date"),
+            aggregate=job.get("aggregate"),
+        )
+
+
+def _batch_plotgen(pltpath, jobs):
+    """Yield (job, result) of the plotgen jobs of pltpath from one read."""
+    fields = {}
+    for job in jobs:
+        jfields = job.get("fields", [])
+        fields[job["job"]] = (
+            [jfields] if isinstance(jfields, str) else list(jfields)
+        )
+    union = []
+    if all(fields.values()):
+        union = list(dict.fromkeys(i for j in fields.values() for i in j))
+    with _instrument.stage("plotgen_extract"):
+        pgdf = _plotgenfile.extract(pltpath, *union)
+
+    def read(*_):
+        return pgdf
+
+    for job in jobs:
+        yield job, _finish(
+            _plotgen_frames([",".join([pltpath] + fields[job["job"]])], read=read),
+            start_date=job.get("start_date"),
+            end_date=job.get("end_date"),
+            aggregate=job.get("aggregate"),
+        )
+
+
+_BATCH_READERS = {"hbn": _batch_hbn, "wdm": _batch_wdm, "plotgen": _batch_plotgen}
+
+_STDOUT_LOCK = _threading.Lock()
+
+
+def _write_output(result, output, float_format="g"):
+    """Write the result DataFrame to output, the format is by file extension.
+
+    The extensions ".parquet", ".pkl" or ".pickle", and ".tsv" are parquet,
+    pickle, and tab separated files, anything else is a CSV file.  The
+    output "-" prints to stdout.
+    """
+    if output == "-":
+        with _STDOUT_LOCK:
+            _printiso(result, float_format=float_format)
+        return
+    directory = _os_path.dirname(output)
+    if directory:
+        _os.makedirs(directory, exist_ok=True)
+    if not result.index.name:
+        result = result.rename_axis("Datetime")
+    suffix = _os_path.splitext(output)[1].lower()
+    if suffix == ".parquet":
+        result.to_parquet(output)
+    elif suffix in (".pkl", ".pickle"):
+        result.to_pickle(output)
+    else:
+        result.to_csv(
+            output,
+            sep="\t" if suffix == ".tsv" else ",",
+            float_format=f"%{float_format}",
+        )
+
+
+def _batch_group(jtype, path, jobs):
+    """Run the jobs of one source file and return their summaries."""
+    summary = []
+    for job, result in _BATCH_READERS[jtype](path, jobs):
+        with _instrument.stage("write"):
+            _write_output(result, job["output"], job.get("float_format", "g"))
+        summary.append(
+            {
+                "job": job["job"],
+                "type": jtype,
+                "file": job["file"],
+                "output": job["output"],
+                "rows": len(result),
+                "columns": len(result.columns),
+            }
+        )
+    return summary
+
+
+def batch(spec, workers=None):
+    """Run the extraction jobs of a TOML batch specification.
+
+    Jobs are grouped by source file so that each file is opened and read
+    once, each hbn file is scanned once for all of its jobs, and the groups
+    are run concurrently in threads.
+
+    The specification is a list of "[[job]]" tables with a "type" of 'hbn',
+    'wdm', or 'plotgen', the source "file", and the "output" file.  A hbn
+    job has an "interval" and a list of "labels" and optionally
+    "sort_columns", a wdm job has a list of "dsns", and a plotgen job has
+    an optional list of "fields".  Every job can have "start_date",
+    "end_date", "aggregate" (see `hbn`), and "float_format".  Values in an
+    optional "[defaults]" table apply to every job that takes them::
+
+        [defaults]
+        start_date = "2000-01-01"
+
+        [[job]]
+        type = "hbn"
+        file = "model.hbn"
+        interval = "daily"
+        labels = ["PERLND,101,PWATER,AGWS", "RCHRES,412,HYDR,RO"]
+        output = "out/daily.csv"
+
+        [[job]]
+        type = "wdm"
+        file = "met.wdm"
+        dsns = [101, 104]
+        output = "out/met.parquet"
+
+    Relative file names are relative to the directory of the specification.
+    The output format is by extension, ".parquet", ".pkl" or ".pickle",
+    ".tsv", and anything else is CSV.  An output of "-" prints to stdout.
+
+    Parameters
+    ----------
+    spec : str
+        The TOML batch specification file, or the equivalent dictionary.
+    workers : int
+        [optional, default is None]
+
+        The number of source files read at the same time.  The default of
+        None uses the default number of threads of
+        concurrent.futures.ThreadPoolExecutor.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each job with the "job" number, "type", source "file",
+        "output", and the number of "rows" and "columns" written.
+    """
+    groups = {}
+    for job in _batch_jobs(spec):
+        groups.setdefault(
+            (job["type"], _os_path.realpath(job["file"])), (job["file"], [])
+        )[1].append(job)
+    if workers == 1:
+        summaries = [
+            _batch_group(jtype, path, jobs)
+            for (jtype, _), (path, jobs) in groups.items()
+        ]
+    else:
+        with _futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # Each group runs in a copy of this context to see the progress
+            # callback and profile.
+            futures = [
+                executor.submit(
+                    _contextvars.copy_context().run, _batch_group, jtype, path, jobs
+                )
+                for (jtype, _), (path, jobs) in groups.items()
+            ]
+            summaries = [i.result() for i in futures]
+    return pd.DataFrame(
+        sorted((i for j in summaries for i in j), key=lambda x: x["job"]),
+        columns=["job", "type", "file", "output", "rows", "columns"],
+    )
+
+
+async def _arun(func, paths, args, kwds, executor=None, per_file_limit=1):
+    """Run func(*args, **kwds) in executor while holding the file limits."""
+    loop = _asyncio.get_running_loop()
+    limits = _FILE_LIMITS.setdefault(loop, {})
+    semaphores = [
+        limits.setdefault(
+            (_os_path.realpath(path), per_file_limit),
+            _asyncio.Semaphore(per_file_limit),
+        )
+        for path in sorted({str(i) for i in paths})
+    ]
+    acquired = []
+    try:
+        for semaphore in semaphores:
+            await semaphore.acquire()
+            acquired.append(semaphore)
+        if isinstance(executor, _futures.ProcessPoolExecutor):
+            # A process can't see the cancel event, so the extraction is
+            # only abandoned, not stopped.
+            return await loop.run_in_executor(
+                executor, _functools.partial(func, *args, **kwds)
+            )
+        event = _threading.Event()
+        context = _contextvars.copy_context()
+        context.run(_CANCEL.set, event)
+        future = loop.run_in_executor(
+            executor, _functools.partial(context.run, func, *args, **kwds)
+        )
+        try:
+            return await _asyncio.shield(future)
+        except _asyncio.CancelledError:
+            # Ask the worker to stop at the next batch boundary and wait for
+            # it to release the file before giving up the file limit.
+            event.set()
+            try:
+                await future
+            except _Cancelled:
+                pass
+            raise
+    finally:
+        for semaphore in acquired:
+            semaphore.release()
+
+
+def _wdm_paths(wdmpath):
+    """Return the WDM file names referenced by the wdm arguments."""
+    return list(dict.fromkeys(lab[0] for lab in _wdm_labels(wdmpath)))
+
+
+def _plotgen_paths(plotgen_args):
+    """Return the plotgen file names referenced by the plotgen arguments."""
+    return [i[0] for i in tsutils.normalize_command_line_args(plotgen_args)]
+
+
+async def ahbn(hbnpath, interval, *labels, executor=None, per_file_limit=1, **kwds):
+    """Asyncio version of `hbn`.
+
+    Runs `hbn` in `executor` without blocking the event loop.  Cancelling the
+    awaiting task stops the scan of the binary file at the next record batch
+    boundary.
+
+    Parameters
+    ----------
+    hbnpath, interval, labels, kwds
+        See `hbn`.
+    executor : concurrent.futures.Executor
+        [optional, default is None]
+
+        The executor that runs the extraction.  The default of None uses the
+        event loop's default thread pool executor.  Cancellation is
+        cooperative only for thread pool executors, a task cancelled while
+        running in a process pool returns immediately, but the worker
+        process finishes the extraction.
+    per_file_limit : int
+        [optional, default is 1]
+
+        The maximum number of concurrent extractions from the same file
+        among the async calls that use the same `per_file_limit`.
+    """
+    return await _arun(
+        hbn,
+        [hbnpath],
+        (hbnpath, interval) + labels,
+        kwds,
+        executor=executor,
+        per_file_limit=per_file_limit,
+    )
+
+
+async def aplotgen(*plotgen_args, executor=None, per_file_limit=1, **kwds):
+    """Asyncio version of `plotgen`.
+
+    Cancelling the awaiting task stops the extraction before the next
+    plotgen file is read.
+
+    Parameters
+    ----------
+    plotgen_args, kwds
+        See `plotgen`.
+    executor, per_file_limit
+        See `ahbn`.
+    """
+    return await _arun(
+        plotgen,
+        _plotgen_paths(plotgen_args),
+        plotgen_args,
+        kwds,
+        executor=executor,
+        per_file_limit=per_file_limit,
+    )
+
+
+async def awdm(*wdmpath, executor=None, per_file_limit=1, **kwds):
+    """Asyncio version of `wdm`.
+
+    Cancelling the awaiting task stops the extraction before the next DSN
+    is read.
+
+    Parameters
+    ----------
+    wdmpath, kwds
+        See `wdm`.
+    executor, per_file_limit
+        See `ahbn`.
+    """
+    return await _arun(
+        wdm,
+        _wdm_paths(wdmpath),
+        wdmpath,
+        kwds,
+        executor=executor,
+        per_file_limit=per_file_limit,
+    )
+
+
+def _printiso(result, **kwds):
+    """Print the result with tsutils.printiso as the 'printiso' stage."""
+    with _instrument.stage("printiso"):
+        tsutils.printiso(result, **kwds)
+    _instrument.add("printiso", rows=len(result))
+
+
+# Table formats that can be printed a chunk at a time, and their separators.
+_STREAM_FORMATS = {"csv": ",", "tsv": "\t", "csv_nos": ",", "tsv_nos": "\t"}
+
+
+def _print_chunks(chunks, tablefmt="csv_nos", float_format="g", columns=None):
+    """Print each DataFrame of chunks as it is made, the header only once.
+
+    If there are no chunks and columns is given, the header line of the
+    column names returned by columns() is printed.
+    """
+    rows = 0
+    num = -1
+    for num, chunk in enumerate(chunks):
+        chunk.to_csv(
+            _sys.stdout,
+            header=num == 0,
+            sep=_STREAM_FORMATS[tablefmt],
+            float_format=f"%{float_format}",
+        )
+        rows += len(chunk)
+    if num < 0 and columns is not None:
+        pd.DataFrame(
+            columns=columns(), index=pd.DatetimeIndex([], name="Datetime")
+        ).to_csv(_sys.stdout, sep=_STREAM_FORMATS[tablefmt])
+    _instrument.add("printiso", rows=rows)
+
+
+def _print_result(result, tablefmt="csv_nos", float_format="g"):
+    """Print a DataFrame, or stream a SpilledFrame from disk and close it."""
+    if not isinstance(result, _spill.SpilledFrame):
+        _printiso(result, tablefmt=tablefmt, float_format=float_format)
+        return
+    with result:
+        if tablefmt in _STREAM_FORMATS:
+            _print_chunks(
+                result.iter_frames(), tablefmt=tablefmt, float_format=float_format
+            )
+        else:
+            # The dtypes of the 'pandas' return type.
+            _printiso(
+                tsutils.asbestfreq(tsutils.common_kwds(result.to_frame())),
+                tablefmt=tablefmt,
+                float_format=float_format,
+            )
+
+
+class _ProgressBar:
+    """Progress callback that draws a bar on stderr."""
+
+    def __init__(self, stream=None, width=30, interval=0.1):
+        self.stream = _sys.stderr if stream is None else stream
+        self.width = width
+        self.interval = interval
+        self.start = _time.monotonic()
+        self.last = None
+
+    def __call__(self, done, total):
+        now = _time.monotonic()
+        if self.last is not None and now - self.last < self.interval and done < total:
+            return
+        self.last = now
+        fraction = done / total if total else 1.0
+        filled = int(self.width * fraction)
+        rate = done / max(now - self.start, 1e-9) / 1e6
+        self.stream.write(
+            f"\r{100 * fraction:5.1f}% |{'#' * filled}{' ' * (self.width - filled)}| "
+            f"{done / 1e6:.1f}/{total / 1e6:.1f} MB {rate:.1f} MB/s"
+        )
+        self.stream.flush()
+
+    def close(self):
+        """End the line of the bar, if one was drawn."""
+        if self.last is not None:
+            self.last = None
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+def main():
+    """Set debug, register *_cli functions, and run cltoolbox.main function.
+
+    The global "--profile" option, anywhere on the command line, prints the
+    time and counts of each stage of the extraction to stderr.  The global
+    "--progress" option draws a progress bar of the bytes read on stderr.
+    """
     from argparse import RawTextHelpFormatter
 
     import cltoolbox
@@ -269,6 +2687,11 @@ def main():
     if not _os_path.exists("debug_hspf_reader"):
         _sys.tracebacklimit = 0
 
+    profiling = "--profile" in _sys.argv[1:]
+    progress = _ProgressBar() if "--progress" in _sys.argv[1:] else None
+    _sys.argv[1:] = [i for i in _sys.argv[1:] if i not in ("--profile", "--progress")]
+    token = _PROGRESS.set(progress)
+
     tablefmt_docstring = r"""[optional, default is 'cvs_nos']
 
 The table format.  Can be one of 'csv', 'tsv', 'csv_nos', 'tsv_nos',
@@ -286,6 +2709,114 @@ The format for floating point numbers in the output table."""
         for key in about_dict:
             print(f"{key}: {about_dict[key]}")
 
+    @cltoolbox.command("index", formatter_class=RawTextHelpFormatter)
+    @tsutils.copy_doc(index_tree)
+    def _index_cli(directory, database=None):
+        for key, value in index_tree(directory, database=database).items():
+            print(f"{key}: {value}")
+
+    @cltoolbox.command("lookup", formatter_class=RawTextHelpFormatter)
+    @cltoolbox.arg("tablefmt", help=tablefmt_docstring)
+    @tsutils.copy_doc(lookup)
+    def _lookup_cli(database, file_type=None, tablefmt="csv_nos", *labels):
+        tsutils.printiso(
+            lookup(database, *labels, file_type=file_type),
+            tablefmt=tablefmt,
+            showindex=False,
+        )
+
+    @cltoolbox.command("batch", formatter_class=RawTextHelpFormatter)
+    @tsutils.copy_doc(batch)
+    def _batch_cli(spec, workers: int = None):
+        tsutils.printiso(
+            batch(spec, workers=workers), tablefmt="plain", showindex=False
+        )
+
+    @cltoolbox.command("metrics", formatter_class=RawTextHelpFormatter)
+    @cltoolbox.arg("tablefmt", help=tablefmt_docstring)
+    @cltoolbox.arg("float_format", help=float_format_docstring)
+    @tsutils.copy_doc(calibration_metrics)
+    def _metrics_cli(
+        hbnpath,
+        interval,
+        wdmpath,
+        start_date=None,
+        end_date=None,
+        tablefmt="csv_nos",
+        float_format="g",
+        *pairs,
+    ):
+        tsutils.printiso(
+            calibration_metrics(
+                hbnpath,
+                interval,
+                wdmpath,
+                *pairs,
+                start_date=start_date,
+                end_date=end_date,
+            ),
+            tablefmt=tablefmt,
+            float_format=float_format,
+            showindex=False,
+        )
+
+    @cltoolbox.command("stats", formatter_class=RawTextHelpFormatter)
+    @cltoolbox.arg("tablefmt", help=tablefmt_docstring)
+    @cltoolbox.arg("float_format", help=float_format_docstring)
+    @tsutils.copy_doc(series_stats)
+    def _stats_cli(
+        path,
+        interval=None,
+        start_date=None,
+        end_date=None,
+        tablefmt="csv_nos",
+        float_format="g",
+        *labels,
+    ):
+        tsutils.printiso(
+            series_stats(
+                path,
+                *labels,
+                interval=interval,
+                start_date=start_date,
+                end_date=end_date,
+            ),
+            tablefmt=tablefmt,
+            float_format=float_format,
+            showindex=False,
+        )
+
+    @cltoolbox.command("ensemble", formatter_class=RawTextHelpFormatter)
+    @cltoolbox.arg("tablefmt", help=tablefmt_docstring)
+    @cltoolbox.arg("float_format", help=float_format_docstring)
+    @tsutils.copy_doc(hbn_ensemble)
+    def _ensemble_cli(
+        interval,
+        label,
+        stats=None,
+        workers: int = None,
+        chunksize: int = 4096,
+        start_date=None,
+        end_date=None,
+        tablefmt="csv_nos",
+        float_format="g",
+        *hbnpaths,
+    ):
+        _printiso(
+            hbn_ensemble(
+                hbnpaths,
+                interval,
+                label,
+                stats=stats,
+                workers=workers,
+                chunksize=chunksize,
+                start_date=start_date,
+                end_date=end_date,
+            ),
+            tablefmt=tablefmt,
+            float_format=float_format,
+        )
+
     @cltoolbox.command("hbn", formatter_class=RawTextHelpFormatter)
     @cltoolbox.arg("tablefmt", help=tablefmt_docstring)
     @cltoolbox.arg("float_format", help=float_format_docstring)
@@ -296,11 +2827,15 @@ The format for floating point numbers in the output table."""
         start_date=None,
         end_date=None,
         sort_columns=False,
+        aggregate=None,
+        workers: int = None,
+        cache_dir=None,
+        max_memory: int = None,
         tablefmt="csv_nos",
         float_format="g",
         *labels,
     ):
-        tsutils.printiso(
+        _print_result(
             hbn(
                 hbnpath,
                 interval,
@@ -308,6 +2843,10 @@ The format for floating point numbers in the output table."""
                 start_date=start_date,
                 end_date=end_date,
                 sort_columns=sort_columns,
+                aggregate=aggregate,
+                workers=workers,
+                cache_dir=cache_dir,
+                max_memory=max_memory,
             ),
             tablefmt=tablefmt,
             float_format=float_format,
@@ -320,30 +2859,94 @@ The format for floating point numbers in the output table."""
     def _plotgen_cli(
         start_date=None,
         end_date=None,
+        aggregate=None,
+        cache_dir=None,
+        workers: int = None,
+        max_memory: int = None,
         tablefmt="csv_nos",
         float_format="g",
         *plotgen_args,
     ):
-        tsutils.printiso(
-            plotgen(*plotgen_args, start_date=start_date, end_date=end_date),
+        labels = tsutils.normalize_command_line_args(plotgen_args)
+        if (
+            len(labels) == 1
+            and aggregate is None
+            and cache_dir is None
+            and workers is None
+            and tablefmt in _STREAM_FORMATS
+        ):
+            _print_chunks(
+                plotgen_iter(*labels[0], start_date=start_date, end_date=end_date),
+                tablefmt=tablefmt,
+                float_format=float_format,
+                columns=lambda: _plotgen_iter_names(labels[0][0], labels[0][1:]),
+            )
+            return
+        _print_result(
+            plotgen(
+                *plotgen_args,
+                start_date=start_date,
+                end_date=end_date,
+                aggregate=aggregate,
+                cache_dir=cache_dir,
+                workers=workers,
+                max_memory=max_memory,
+            ),
             tablefmt=tablefmt,
             float_format=float_format,
         )
 
+    @cltoolbox.command("plotgen_catalog", formatter_class=RawTextHelpFormatter)
+    @cltoolbox.arg("tablefmt", help=tablefmt_docstring)
+    @tsutils.copy_doc(plotgen_catalog)
+    def _plotgen_catalog_cli(tablefmt="csv_nos", *pltpaths):
+        tsutils.printiso(
+            plotgen_catalog(*pltpaths), tablefmt=tablefmt, showindex=False
+        )
+
     @cltoolbox.command("wdm", formatter_class=RawTextHelpFormatter)
     @cltoolbox.arg("tablefmt", help=tablefmt_docstring)
     @cltoolbox.arg("float_format", help=float_format_docstring)
     @tsutils.copy_doc(wdm)
     def _wdm_cli(
-        start_date=None, end_date=None, tablefmt="csv_nos", float_format="g", *wdmpath
+        start_date=None,
+        end_date=None,
+        aggregate=None,
+        cache_dir=None,
+        max_memory: int = None,
+        tablefmt="csv_nos",
+        float_format="g",
+        *wdmpath,
     ):
-        tsutils.printiso(
-            wdm(*wdmpath, start_date=start_date, end_date=end_date),
+        _print_result(
+            wdm(
+                *wdmpath,
+                start_date=start_date,
+                end_date=end_date,
+                aggregate=aggregate,
+                cache_dir=cache_dir,
+                max_memory=max_memory,
+            ),
             tablefmt=tablefmt,
             float_format=float_format,
         )
 
-    cltoolbox.main()
+    try:
+        if not profiling:
+            cltoolbox.main()
+            return
+        with _instrument.profile() as stats:
+            try:
+                cltoolbox.main()
+            finally:
+                # End the progress bar line before the report.
+                if progress is not None:
+                    progress.close()
+                _sys.stderr.write(stats.report() + "\n")
+    finally:
+        _PROGRESS.reset(token)
+        if progress is not None:
+            progress.close()
 
 
 if __name__ == "__main__":
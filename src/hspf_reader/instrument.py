@@ -0,0 +1,147 @@
+"""Per stage timing and counts of the work done by an extraction.
+
+Instrumentation is off unless a `Stats` object is activated for the current
+context with `profile`, so the readers only pay for a context variable
+lookup at each stage::
+
+    with hspf_reader.profile() as stats:
+        hspf_reader.hbn("model.hbn", "daily", ",,,AGWS")
+    print(stats.report())
+
+Stages can nest, for example "decode" runs inside "read", so the times are
+not additive.
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+
+_STATS = contextvars.ContextVar("_STATS", default=None)
+_NULL = contextlib.nullcontext()
+
+COUNTS = ("bytes", "records", "matched", "rows")
+
+
+class Stage:
+    """Elapsed seconds, number of calls, and counts of one stage."""
+
+    __slots__ = ("seconds", "calls") + COUNTS
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        for name in COUNTS:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        """Return the stage as a dictionary."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Stats:
+    """Collects the `Stage` of each named stage of one or more extractions.
+
+    Attributes
+    ----------
+    stages : dict
+        Stage name to `Stage` in the order each stage was first seen.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        try:
+            return self.stages[name]
+        except KeyError:
+            return self.stages.setdefault(name, Stage())
+
+    @contextlib.contextmanager
+    def time(self, name):
+        """Context manager that adds the elapsed time to the stage name."""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self._stage(name)
+                stage.seconds += elapsed
+                stage.calls += 1
+
+    def add(self, name, **counts):
+        """Add the bytes, records, matched, and rows counts to stage name."""
+        with self._lock:
+            stage = self._stage(name)
+            for key, value in counts.items():
+                setattr(stage, key, getattr(stage, key) + int(value))
+
+    def as_dict(self):
+        """Return {stage name: {seconds, calls, bytes, ...}}."""
+        with self._lock:
+            return {name: stage.as_dict() for name, stage in self.stages.items()}
+
+    def report(self):
+        """Return a table of the stages as a string."""
+        header = ("stage", "seconds", "calls") + COUNTS
+        rows = [
+            [name, f"{i['seconds']:.4f}"] + [str(i[j]) for j in header[2:]]
+            for name, i in self.as_dict().items()
+        ]
+        widths = [max(len(str(j)) for j in col) for col in zip(header, *rows)]
+        lines = [
+            "  ".join(
+                str(cell).ljust(width) if num == 0 else str(cell).rjust(width)
+                for num, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in [header] + rows
+        ]
+        return "\n".join(lines)
+
+    __str__ = report
+
+
+@contextlib.contextmanager
+def profile(stats=None):
+    """Collect the stages of extractions run in this context into stats.
+
+    Parameters
+    ----------
+    stats : Stats
+        [optional, default is a new Stats]
+
+        Pass an existing `Stats` to accumulate several blocks.
+
+    Yields
+    ------
+    Stats
+        The stats that are filled in as the extractions run.
+    """
+    stats = Stats() if stats is None else stats
+    token = _STATS.set(stats)
+    try:
+        yield stats
+    finally:
+        _STATS.reset(token)
+
+
+def stage(name):
+    """Return a context manager that times stage name if profiling."""
+    stats = _STATS.get()
+    if stats is None:
+        return _NULL
+    return stats.time(name)
+
+
+def add(name, **counts):
+    """Add counts to stage name if profiling."""
+    stats = _STATS.get()
+    if stats is not None:
+        stats.add(name, **counts)
+
+
+def enabled():
+    """Return True if profiling in this context."""
+    return _STATS.get() is not None
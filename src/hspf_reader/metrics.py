@@ -0,0 +1,150 @@
+"""Streaming goodness of fit statistics of simulated and observed series.
+
+`Moments` accumulates the count, means, and centered sums of squares and
+products of pairs of simulated and observed values one block at a time,
+merging blocks with the pairwise update of Chan, Golub, and LeVeque so that
+the statistics are as accurate as a single pass over all of the values.
+`Moments.result` computes the statistics from the accumulated moments.
+`Summary` accumulates the count, minimum, maximum, sum, and first and last
+dates of the values of many columns the same way.
+"""
+
+import numpy as np
+
+# Statistics returned by Moments.result.
+STATISTICS = (
+    "count",
+    "mean_sim",
+    "mean_obs",
+    "nse",
+    "kge",
+    "pbias",
+    "rmse",
+    "r",
+)
+
+# Statistics returned by Summary.result.
+SUMMARY = ("count", "min", "max", "mean", "sum", "start_date", "end_date")
+
+
+class Moments:
+    """Running moments of (simulated, observed) value pairs."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean_sim = 0.0
+        self.mean_obs = 0.0
+        self.m2_sim = 0.0
+        self.m2_obs = 0.0
+        self.cov = 0.0
+        self.sse = 0.0
+
+    def update(self, sim, obs):
+        """Add the pairs of sim and obs where neither is NaN."""
+        sim = np.asarray(sim, dtype="float64")
+        obs = np.asarray(obs, dtype="float64")
+        mask = ~(np.isnan(sim) | np.isnan(obs))
+        sim = sim[mask]
+        obs = obs[mask]
+        count = len(sim)
+        if count == 0:
+            return
+        mean_sim = sim.mean()
+        mean_obs = obs.mean()
+        dsim = sim - mean_sim
+        dobs = obs - mean_obs
+        total = self.count + count
+        delta_sim = mean_sim - self.mean_sim
+        delta_obs = mean_obs - self.mean_obs
+        weight = self.count * count / total
+        self.m2_sim += dsim @ dsim + delta_sim**2 * weight
+        self.m2_obs += dobs @ dobs + delta_obs**2 * weight
+        self.cov += dsim @ dobs + delta_sim * delta_obs * weight
+        self.mean_sim += delta_sim * count / total
+        self.mean_obs += delta_obs * count / total
+        self.count = total
+        error = sim - obs
+        self.sse += error @ error
+
+    def result(self):
+        """Return the dictionary of the STATISTICS.
+
+        nse
+            Nash-Sutcliffe efficiency, 1 - SSE / sum((obs - mean_obs)**2).
+        kge
+            Kling-Gupta efficiency, 1 - sqrt((r - 1)**2 + (alpha - 1)**2 +
+            (beta - 1)**2) where alpha is std_sim / std_obs and beta is
+            mean_sim / mean_obs.
+        pbias
+            Percent bias, 100 * sum(obs - sim) / sum(obs).
+        rmse
+            Root mean square error.
+        r
+            Pearson correlation coefficient.
+        """
+        nan = float("nan")
+        if self.count == 0:
+            return dict.fromkeys(STATISTICS, nan) | {"count": 0}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.float64(self.cov) / np.sqrt(self.m2_sim * self.m2_obs)
+            alpha = np.sqrt(np.float64(self.m2_sim) / self.m2_obs)
+            beta = np.float64(self.mean_sim) / self.mean_obs
+            nse = 1 - np.float64(self.sse) / self.m2_obs
+            pbias = 100 * (self.mean_obs - self.mean_sim) / np.float64(self.mean_obs)
+            kge = 1 - np.sqrt((r - 1) ** 2 + (alpha - 1) ** 2 + (beta - 1) ** 2)
+        return {
+            "count": self.count,
+            "mean_sim": float(self.mean_sim),
+            "mean_obs": float(self.mean_obs),
+            "nse": float(nse),
+            "kge": float(kge),
+            "pbias": float(pbias),
+            "rmse": float(np.sqrt(self.sse / self.count)),
+            "r": float(r),
+        }
+
+
+class Summary:
+    """Running summary of the values of `ncolumns` columns."""
+
+    def __init__(self, ncolumns):
+        self.count = np.zeros(ncolumns, dtype=np.int64)
+        self.sum = np.zeros(ncolumns)
+        self.min = np.full(ncolumns, np.nan)
+        self.max = np.full(ncolumns, np.nan)
+        self.start_date = np.full(ncolumns, np.datetime64("NaT", "ns"))
+        self.end_date = np.full(ncolumns, np.datetime64("NaT", "ns"))
+
+    def update(self, index, data):
+        """Add a block of timestamps and 2-D values, NaN values are skipped.
+
+        The blocks must be added in order of the timestamps.
+        """
+        if not len(index):
+            return
+        index = np.asarray(index, dtype="datetime64[ns]")
+        data = np.asarray(data, dtype="float64")
+        valid = ~np.isnan(data)
+        found = valid.any(axis=0)
+        self.count += valid.sum(axis=0)
+        self.sum += np.where(valid, data, 0).sum(axis=0)
+        self.min = np.fmin(self.min, np.fmin.reduce(data, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(data, axis=0))
+        new = found & np.isnat(self.start_date)
+        self.start_date[new] = index[valid.argmax(axis=0)[new]]
+        last = len(index) - 1 - valid[::-1].argmax(axis=0)
+        self.end_date[found] = index[last[found]]
+
+    def result(self):
+        """Return the dictionary of the SUMMARY arrays."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(self.count > 0, self.sum / self.count, np.nan)
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": mean,
+            "sum": self.sum,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+        }
@@ -0,0 +1,554 @@
+"""Header level reader for HSPF plotgen files.
+
+A plotgen file has a header of "SIMU" lines that describe the curves,
+followed by one fixed width line for each interval with the date and a 14
+character column for each curve.
+"""
+
+import concurrent.futures as _futures
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from hspf_reader import pool as _pool
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+
+# Character columns of the date fields and of the first curve.
+DATE_COLUMNS = ((5, 10), (10, 13), (13, 16), (16, 19), (19, 22))
+FIRST_COLUMN = 22
+COLUMN_WIDTH = 14
+
+# Value written for missing data.
+FILL = -1e30
+
+# Bytes read from the end of the file to find the last line.
+_TAIL_BYTES = 1 << 12
+
+# Bytes read at a time by `_lines`.
+_BLOCK_BYTES = 1 << 16
+
+
+def curve_columns(ncurves):
+    """Return the (start, stop) character columns of each curve."""
+    return [
+        (FIRST_COLUMN + i * COLUMN_WIDTH, FIRST_COLUMN + (i + 1) * COLUMN_WIDTH)
+        for i in range(ncurves)
+    ]
+
+
+def _pread(fpointer, size, offset):
+    """Read size bytes at offset without moving the file position."""
+    if not hasattr(os, "pread"):
+        # Windows
+        with open(fpointer.name, "rb") as fpread:
+            fpread.seek(offset)
+            return fpread.read(size)
+    parts = []
+    while size > 0:
+        part = os.pread(fpointer.fileno(), size, offset)
+        if not part:
+            break
+        parts.append(part)
+        size -= len(part)
+        offset += len(part)
+    return b"".join(parts)
+
+
+def _open_binary(pltpath):
+    return open(pltpath, "rb")
+
+
+def borrow_file(pltpath):
+    """Return a context manager of the binary file object of pltpath.
+
+    The file object is borrowed from the file pool and shared, so only read
+    it with `_pread`.
+    """
+    return _pool.borrow(pltpath, _open_binary)
+
+
+def _lines(fpointer, offset=0):
+    """Yield each (line, offset of the next line) from offset with `_pread`."""
+    pending = b""
+    while True:
+        block = _pread(fpointer, _BLOCK_BYTES, offset + len(pending))
+        if not block:
+            if pending:
+                yield pending, offset + len(pending)
+            return
+        pending += block
+        lines = pending.splitlines(keepends=True)
+        if not lines[-1].endswith(b"\n"):
+            pending = lines.pop()
+        else:
+            pending = b""
+        for line in lines:
+            offset += len(line)
+            yield line, offset
+
+
+def header(pltpath):
+    """Return the curves and layout described by the header of pltpath.
+
+    Only the header lines are read.
+
+    Returns
+    -------
+    dict
+        With the "interval" in minutes, the "title", the "curves" as a list
+        of dictionaries of "label", "lintyp", "inteq", "colcod", "tran",
+        "trancod", and character "columns", and the byte "offset" of the
+        first data line.
+    """
+    interval = None
+    title = ""
+    curves = []
+    in_curves = False
+    offset = 0
+    with borrow_file(pltpath) as fpointer:
+        lines = _lines(fpointer)
+        for raw, offset in lines:
+            line = raw.decode("ascii", errors="replace").rstrip("\r\n")
+            if not line.startswith("SIMU"):
+                break
+            text = line[5:]
+            if text.startswith("Time interval:"):
+                interval = int(text.split(":")[1].split()[0])
+            elif text.startswith("Plot title:"):
+                title = text.split(":", 1)[1].strip()
+            elif "LINTYP" in line:
+                in_curves = True
+            elif text.startswith("Time series"):
+                # A blank, the column titles, and a blank line follow.
+                for _, (_, offset) in zip(range(3), lines):
+                    pass
+                break
+            elif in_curves and (label := line[4:30].strip()):
+                fields = line[30:].split()
+                curves.append(
+                    {
+                        "label": label,
+                        "lintyp": int(fields[0]),
+                        "inteq": int(fields[1]),
+                        "colcod": int(fields[2]),
+                        "tran": fields[3],
+                        "trancod": int(fields[4]),
+                    }
+                )
+            elif in_curves:
+                in_curves = False
+        else:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    {pltpath} is not a valid plotgen file, there is no "Time
+                    series" line at the end of the header.
+                    """
+                )
+            )
+    for curve, columns in zip(curves, curve_columns(len(curves))):
+        curve["columns"] = columns
+    return {"interval": interval, "title": title, "curves": curves, "offset": offset}
+
+
+def line_date(line):
+    """Return the Timestamp of a plotgen data line, hour 24 is the next day."""
+    year, month, day, hour, minute = (int(line[i:j]) for i, j in DATE_COLUMNS)
+    return pd.Timestamp(year, month, day) + pd.Timedelta(hours=hour, minutes=minute)
+
+
+def _is_missing(line, ncurves):
+    """Return True if every value of the data line is missing."""
+    values = [float(line[i:j]) for i, j in curve_columns(ncurves)]
+    return bool(np.all(np.asarray(values) == FILL))
+
+
+def period(pltpath, head=None):
+    """Return the first and last Timestamp of the data lines of pltpath.
+
+    Leading lines where every curve is missing are skipped, as they are by
+    `plotgen`.  Only the header, the first data lines, and the end of the
+    file are read.
+    """
+    if head is None:
+        head = header(pltpath)
+    ncurves = len(head["curves"])
+    first = None
+    with borrow_file(pltpath) as fpointer:
+        for raw, _ in _lines(fpointer, head["offset"]):
+            line = raw.decode("ascii").rstrip("\r\n")
+            if line.strip() and not _is_missing(line, ncurves):
+                first = line_date(line)
+                break
+        if first is None:
+            return None, None
+        size = os.fstat(fpointer.fileno()).st_size
+        start = max(head["offset"], size - _TAIL_BYTES)
+        tail = _pread(fpointer, size - start, start).decode("ascii")
+    lines = [i for i in tail.splitlines() if i.strip()]
+    return first, line_date(lines[-1])
+
+
+def curve_positions(head, fields=None):
+    """Return the positions in head["curves"] of the curve labels fields.
+
+    Every curve if fields is empty or None.
+    """
+    labels = [curve["label"] for curve in head["curves"]]
+    if not fields:
+        return list(range(len(labels)))
+    positions = []
+    for field in fields:
+        if field not in labels:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The curve "{field}" is not in the plotgen file.  The
+                    curves are {labels}.
+                    """
+                )
+            )
+        positions.append(labels.index(field))
+    return positions
+
+
+def _fixed_columns(data, specs):
+    """Return the character columns specs of the data lines as arrays.
+
+    Used when every line has the same length, so the lines can be viewed
+    as a 2-D array of characters and only the requested columns converted.
+    Returns None if the lines are not the same length or a field is blank.
+    """
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    width = data.find(b"\n") + 1
+    if not data or len(data) % width or width <= max(i[1] for i in specs):
+        return None
+    lines = np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+    if (lines[:, -1] != ord("\n")).any():
+        return None
+    columns = []
+    try:
+        for num, (start, stop) in enumerate(specs):
+            chars = np.ascontiguousarray(lines[:, start:stop]).view(f"S{stop - start}")
+            columns.append(
+                chars[:, 0].astype("int64" if num < len(DATE_COLUMNS) else "float64")
+            )
+    except ValueError:
+        return None
+    return columns
+
+
+def _columns(data, specs):
+    """Return the character columns specs of the data lines as arrays.
+
+    The first column is the year, lines without one are skipped.
+    """
+    columns = _fixed_columns(data, specs)
+    if columns is None:
+        pgdf = pd.read_fwf(
+            io.BytesIO(data),
+            colspecs=specs,
+            names=list(range(len(specs))),
+            header=None,
+            dtype=dict.fromkeys(range(len(DATE_COLUMNS), len(specs)), "float64"),
+        ).dropna(subset=[0])
+        columns = [pgdf[i].to_numpy() for i in range(len(specs))]
+    return columns
+
+
+def valid_rows(data, head, positions, values):
+    """Return the mask of the rows with a value in any curve of the file.
+
+    values are the parsed curves at `positions`.  The other curves are
+    parsed only for the rows where every one of those is missing, so the
+    rows kept do not depend on the curves that were requested.
+    """
+    mask = ~np.isnan(values).all(axis=1)
+    others = [
+        curve["columns"]
+        for num, curve in enumerate(head["curves"])
+        if num not in positions
+    ]
+    rows = np.flatnonzero(~mask)
+    if not others or not len(rows):
+        return mask
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    width = data.find(b"\n") + 1
+    lines = [data[i * width : (i + 1) * width] for i in rows]
+    if len(data) != width * len(values) or any(
+        i.find(b"\n") != width - 1 for i in lines
+    ):
+        # Not one line of the same length for each row, find the lines.
+        ystart, ystop = DATE_COLUMNS[0]
+        lines = [i for i in data.splitlines(True) if i[ystart:ystop].strip()]
+        lines = [lines[i] for i in rows]
+    columns = _columns(b"".join(lines), [DATE_COLUMNS[0]] + others)
+    extra = np.column_stack(columns[1:])
+    extra[extra == FILL] = np.nan
+    mask[rows] = ~np.isnan(extra).all(axis=1)
+    return mask
+
+
+def parse(data, head, positions=None, dropna=True):
+    """Return a DataFrame of the data lines in the bytes data.
+
+    Only the date fields and the character columns of the curves at
+    `positions` in head["curves"] are parsed.  Missing values are NaN and,
+    if dropna, rows where every curve of the file is missing are dropped,
+    as by the toolbox plotgen reader.  Hour 24 is the start of the next day.
+    """
+    curves = head["curves"]
+    if positions is None:
+        positions = list(range(len(curves)))
+    names = [curves[i]["label"] for i in positions]
+    columns = _columns(
+        data, list(DATE_COLUMNS) + [curves[i]["columns"] for i in positions]
+    )
+    ndates = len(DATE_COLUMNS)
+    values = np.empty((len(columns[0]), len(names)))
+    for num, column in enumerate(columns[ndates:]):
+        values[:, num] = column
+    values[values == FILL] = np.nan
+    keep = valid_rows(data, head, positions, values) if dropna else slice(None)
+    year, month, day, hour, minute = (
+        np.asarray(i, dtype="int64")[keep] for i in columns[:ndates]
+    )
+    index = pd.DatetimeIndex(
+        pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": day}))
+        + pd.to_timedelta(hour, unit="h")
+        + pd.to_timedelta(minute, unit="m"),
+        name="Datetime",
+    )
+    return pd.DataFrame(values[keep], index=index, columns=names)
+
+
+def split_points(pltpath, head, parts):
+    """Return line aligned offsets that split the data lines into `parts` ranges.
+
+    The first offset is the first data line and the last is the size of
+    the file.  There are fewer ranges if the file has fewer lines.
+    """
+    with borrow_file(pltpath) as fpointer:
+        size = os.fstat(fpointer.fileno()).st_size
+        points = [head["offset"]]
+        for num in range(1, parts):
+            pos = max(
+                points[-1] + 1,
+                head["offset"] + (size - head["offset"]) * num // parts,
+            )
+            # Move to the start of the line that follows pos - 1.
+            while pos < size:
+                block = _pread(fpointer, _TAIL_BYTES, pos - 1)
+                newline = block.find(b"\n")
+                if newline >= 0:
+                    pos += newline
+                    break
+                pos += len(block)
+            if pos < size:
+                points.append(pos)
+    points.append(size)
+    return points
+
+
+def _parse_worker(pltpath, head, start, stop, positions):
+    """Parse the data lines from start to stop of pltpath in a worker process."""
+    with borrow_file(pltpath) as fpointer:
+        data = _pread(fpointer, stop - start, start)
+    return parse(data, head, positions)
+
+
+def extract(pltpath, *fields, workers=None):
+    """Return a DataFrame of the curves fields of pltpath, every curve by default.
+
+    The same as the toolbox plotgen reader, but the file is read through
+    the file pool and only the columns of the requested curves are parsed.
+    Rows where every curve of the file is missing are dropped.  With two
+    or more workers the data lines are split into line aligned ranges
+    that are parsed by a process pool and joined in file order.
+    """
+    head = header(pltpath)
+    positions = curve_positions(head, fields)
+    if workers is not None and workers > 1:
+        points = split_points(pltpath, head, workers)
+        nranges = len(points) - 1
+        with _futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = list(
+                executor.map(
+                    _parse_worker,
+                    [pltpath] * nranges,
+                    [head] * nranges,
+                    points[:-1],
+                    points[1:],
+                    [positions] * nranges,
+                )
+            )
+        return pd.concat(frames)
+    with borrow_file(pltpath) as fpointer:
+        size = os.fstat(fpointer.fileno()).st_size
+        data = _pread(fpointer, size - head["offset"], head["offset"])
+    return parse(data, head, positions)
+
+
+def iter_frames(pltpath, *fields, chunksize=65536, start_date=None, end_date=None):
+    """Yield DataFrames of chunksize rows of the curves fields of pltpath.
+
+    The data lines are read and parsed about chunksize lines at a time, so
+    memory use depends on chunksize and not on the length of the file.
+    Each line has the whole date, so hour 24 rolls over to the next day the
+    same way at the edges of the chunks as inside them.  As in `plotgen`,
+    the rows before the first and after the last row with a value in any
+    curve of the file are dropped and the rows between where every curve
+    is missing are NaN.
+    Blocks of lines before start_date are not parsed and reading stops
+    after end_date.
+    """
+    head = header(pltpath)
+    positions = list(dict.fromkeys(curve_positions(head, fields)))
+    start = None if start_date is None else pd.Timestamp(start_date)
+    end = None if end_date is None else pd.Timestamp(end_date)
+    held = []
+    nheld = 0
+    nready = 0
+    with borrow_file(pltpath) as fpointer:
+        size = os.fstat(fpointer.fileno()).st_size
+        offset = head["offset"]
+        width = len(_pread(fpointer, _TAIL_BYTES, offset).split(b"\n", 1)[0]) + 1
+        nbytes = max(chunksize * width, _BLOCK_BYTES)
+        while offset < size:
+            data = _pread(fpointer, min(nbytes, size - offset), offset)
+            if offset + len(data) < size:
+                cut = data.rfind(b"\n") + 1
+                if not cut:
+                    nbytes *= 2
+                    continue
+                data = data[:cut]
+            offset += len(data)
+            lines = data.rstrip().rsplit(b"\n", 1)
+            if not lines[-1].strip():
+                continue
+            last = line_date(lines[-1].decode("ascii"))
+            if start is not None and last < start:
+                continue
+            pgdf = parse(data, head, positions, dropna=False)
+            mask = valid_rows(data, head, positions, pgdf.to_numpy())
+            if start is not None or end is not None:
+                window = pgdf.index.slice_indexer(start, end)
+                pgdf = pgdf.iloc[window]
+                mask = mask[window]
+            valid = np.flatnonzero(mask)
+            if not nheld and len(valid):
+                pgdf = pgdf.iloc[valid[0] :]
+                valid = valid - valid[0]
+            if nheld or len(valid):
+                held.append(pgdf)
+                nheld += len(pgdf)
+            if len(valid):
+                nready = nheld - len(pgdf) + valid[-1] + 1
+            while nready >= chunksize:
+                pgdf = pd.concat(held) if len(held) > 1 else held[0]
+                yield pgdf.iloc[:chunksize]
+                held = [pgdf.iloc[chunksize:]]
+                nheld -= chunksize
+                nready -= chunksize
+            if end is not None and last >= end:
+                break
+    if nready:
+        yield (pd.concat(held) if len(held) > 1 else held[0]).iloc[:nready]
+
+
+class PlotgenFile:
+    """Reusable, thread-safe reader of one plotgen file.
+
+    The header is read the first time it is needed and kept, and read again
+    if the size or modification time of the file changes.  The data lines
+    are read with positioned reads (`os.pread`) of the one open file, so
+    there is no shared file position and one object can be shared by the
+    threads of a server.  Pickling sends the path and the header.
+
+    Parameters
+    ----------
+    pltpath
+        Path of the plotgen file.
+    """
+
+    def __init__(self, pltpath):
+        self.path = os.fspath(pltpath)
+        self._stat = None
+        self._header = None
+        self._init_local()
+
+    def _init_local(self):
+        self._lock = threading.Lock()
+        self._fpointer = None
+
+    def __getstate__(self):
+        return {"path": self.path, "_stat": self._stat, "_header": self._header}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def __repr__(self):
+        return f"PlotgenFile({self.path!r})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _refresh(self):
+        """Read the header again if the file changed, called with the lock."""
+        stat = os.stat(self.path)
+        stat = (stat.st_size, stat.st_mtime_ns)
+        if self._header is None or stat != self._stat:
+            self._header = header(self.path)
+            self._stat = stat
+            if self._fpointer is not None:
+                self._fpointer.close()
+                self._fpointer = None
+        if self._fpointer is None:
+            self._fpointer = open(self.path, "rb")
+        return self._header
+
+    def header(self):
+        """Return the `header` of the file, reading it only when needed."""
+        with self._lock:
+            return self._refresh()
+
+    def labels(self):
+        """Return the list of curve labels."""
+        return [curve["label"] for curve in self.header()["curves"]]
+
+    def read(self, *fields, start_date=None, end_date=None):
+        """Return a DataFrame of the curves fields, every curve by default.
+
+        Only the columns of the requested curves are parsed, and rows where
+        every curve of the file is missing are dropped.
+        """
+        # The header, size, and open file must agree, so the data lines are
+        # read under the lock and parsed outside of it.
+        with self._lock:
+            head = self._refresh()
+            data = _pread(
+                self._fpointer, self._stat[0] - head["offset"], head["offset"]
+            )
+        positions = curve_positions(head, fields)
+        pgdf = parse(data, head, positions)
+        if start_date is not None:
+            pgdf = pgdf.loc[pd.Timestamp(tsutils.parsedate(start_date)) :]
+        if end_date is not None:
+            pgdf = pgdf.loc[: pd.Timestamp(tsutils.parsedate(end_date))]
+        return pgdf
+
+    def close(self):
+        """Close the file, a later read opens it again."""
+        with self._lock:
+            if self._fpointer is not None:
+                self._fpointer.close()
+                self._fpointer = None
@@ -0,0 +1,185 @@
+"""Process wide pool of open files and memory maps.
+
+The hbn, WDM, and plotgen readers borrow their memory maps and file objects
+from `POOL` instead of opening and closing the file for every call, so
+repeated reads of the same files only cost a `stat`.  At most `maxsize`
+files are kept open, the least recently used are closed first, and an entry
+is opened again if the size or modification time of the file changes.
+
+The default size of 64 can be set with the HSPF_READER_MAX_OPEN_FILES
+environment variable or with `configure`, and a size of 0 opens and closes
+the file for every borrow.  The default is 0 on Windows, where an open file
+can't be rewritten by HSPF.  The counters returned by `stats` show how well
+the size fits the workload::
+
+    hspf_reader.pool.configure(256)
+    ...
+    print(hspf_reader.pool.stats())
+"""
+
+import contextlib
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_SIZE = 0 if os.name == "nt" else 64
+
+
+class _Entry:
+    """An open handle, the stat it was opened with, and its borrowers."""
+
+    __slots__ = ("handle", "stat", "users", "retired")
+
+    def __init__(self, handle, stat):
+        self.handle = handle
+        self.stat = stat
+        self.users = 0
+        self.retired = False
+
+
+def _close(handle):
+    try:
+        handle.close()
+    except BufferError:
+        # Arrays still reference the memory map, it is closed when they are
+        # garbage collected.
+        pass
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FilePool:
+    """Bounded least recently used pool of open files.
+
+    Entries are keyed by the absolute path and the function that opens
+    them, so the same file can be pooled as a memory map and as a file
+    object.  An entry that is closed by the pool while borrowed stays open
+    until it is returned, so the number of open files can be more than
+    `maxsize` while that many are in use.
+
+    Parameters
+    ----------
+    maxsize : int
+        The number of files kept open.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return f"FilePool(maxsize={self.maxsize}, open={len(self._entries)})"
+
+    @contextlib.contextmanager
+    def borrow(self, path, opener):
+        """Return a context manager of opener(path) from the pool.
+
+        The handle must not be closed by the caller and is only valid in the
+        `with` block.
+        """
+        entry = self._acquire(path, opener)
+        try:
+            yield entry.handle
+        finally:
+            self._release(entry)
+
+    def _acquire(self, path, opener):
+        key = (os.path.abspath(path), opener)
+        stat = _file_stat(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stat != stat:
+                self._retire(key)
+                self.invalidations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.users += 1
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = _Entry(opener(path), stat)
+        entry.users = 1
+        with self._lock:
+            if self.maxsize <= 0:
+                entry.retired = True
+                return entry
+            if key in self._entries:
+                # Another thread opened the file at the same time.
+                self._retire(key)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._retire(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def _retire(self, key):
+        """Remove key from the pool and close it when it is not borrowed."""
+        entry = self._entries.pop(key)
+        entry.retired = True
+        if entry.users == 0:
+            _close(entry.handle)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.retired and entry.users == 0:
+                _close(entry.handle)
+
+    def configure(self, maxsize):
+        """Set the number of files kept open, closing the extra files."""
+        with self._lock:
+            self.maxsize = int(maxsize)
+            while len(self._entries) > max(self.maxsize, 0):
+                self._retire(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """Close every file that is not borrowed and reset the counters."""
+        with self._lock:
+            for key in list(self._entries):
+                self._retire(key)
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self):
+        """Return a dictionary of the counters and the number of open files."""
+        with self._lock:
+            return {
+                "maxsize": self.maxsize,
+                "open": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+POOL = FilePool(int(os.environ.get("HSPF_READER_MAX_OPEN_FILES", DEFAULT_SIZE)))
+
+
+def borrow(path, opener):
+    """Borrow opener(path) from POOL, see `FilePool.borrow`."""
+    return POOL.borrow(path, opener)
+
+
+def configure(maxsize):
+    """Set the number of files kept open by POOL."""
+    POOL.configure(maxsize)
+
+
+def clear():
+    """Close the files of POOL and reset the counters."""
+    POOL.clear()
+
+
+def stats():
+    """Return the counters of POOL, see `FilePool.stats`."""
+    return POOL.stats()
@@ -0,0 +1,211 @@
+"""Extracted time-series in shared memory for multiprocessing workers.
+
+An extraction is copied once into a `multiprocessing.shared_memory` block and
+the small picklable `SharedFrame` handle is passed to worker processes,
+which attach to the block and get read-only arrays or a DataFrame without
+copying the values::
+
+    with hspf_reader.share(hspf_reader.wdm("met.wdm", 101, 104)) as handle:
+        with ProcessPoolExecutor(32) as executor:
+            results = list(executor.map(run_model, [handle] * 32))
+
+    def run_model(handle):
+        forcing = handle.to_frame()
+        ...
+
+The process that creates the handle owns the block and removes it when the
+`with` block ends or `unlink` is called.
+"""
+
+import multiprocessing.shared_memory as _shared_memory
+
+import numpy as np
+import pandas as pd
+
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+
+
+def attach(name):
+    """Attach to the SharedMemory name without tracking it in this process."""
+    try:
+        return _shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13
+        return _shared_memory.SharedMemory(name=name)
+
+
+class SharedFrame:
+    """Handle to timestamps and float64 values in a shared memory block.
+
+    The block holds the int64 nanosecond timestamps followed by the values
+    in column major order, so each column is contiguous.  Pickling sends
+    only the name of the block, the shape, the column names, and the type
+    of index.
+
+    Attributes
+    ----------
+    name : str
+        Name of the shared memory block.
+    nrows : int
+        Number of timestamps.
+    columns : list
+        Column names.
+    index_type : str
+        'datetime' or 'period', the type of the index of `to_frame`.
+    freq : str
+        Frequency of the index, or None.
+    """
+
+    def __init__(self, name, nrows, columns, index_type="datetime", freq=None):
+        self.name = name
+        self.nrows = nrows
+        self.columns = list(columns)
+        self.index_type = index_type
+        self.freq = freq
+        self._shm = None
+        self._owner = False
+
+    @classmethod
+    def create(cls, index, data, columns, index_type="datetime", freq=None):
+        """Copy the timestamps and the 2-D values into a new block."""
+        index = np.asarray(index, dtype="datetime64[ns]")
+        data = np.asarray(data, dtype="float64")
+        if data.shape != (len(index), len(columns)):
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The values have the shape {data.shape} but there are
+                    {len(index)} timestamps and {len(columns)} columns.
+                    """
+                )
+            )
+        shm = _shared_memory.SharedMemory(
+            create=True, size=max(1, 8 * len(index) * (1 + len(columns)))
+        )
+        handle = cls(shm.name, len(index), columns, index_type, freq)
+        handle._shm = shm
+        handle._owner = True
+        try:
+            sindex, sdata = handle._arrays(writeable=True)
+            sindex[:] = index
+            sdata[:] = data
+        except BaseException:
+            handle.unlink()
+            raise
+        return handle
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shm"] = None
+        state["_owner"] = False
+        return state
+
+    def __repr__(self):
+        return (
+            f"SharedFrame(name={self.name!r}, nrows={self.nrows}, "
+            f"ncolumns={len(self.columns)})"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._owner:
+            self.unlink()
+        else:
+            self.close()
+
+    def _arrays(self, writeable=False):
+        if self._shm is None:
+            self._shm = attach(self.name)
+        buf = self._shm.buf
+        index = np.ndarray((self.nrows,), dtype="datetime64[ns]", buffer=buf)
+        data = np.ndarray(
+            (self.nrows, len(self.columns)),
+            dtype="float64",
+            buffer=buf,
+            offset=8 * self.nrows,
+            order="F",
+        )
+        index.flags.writeable = writeable
+        data.flags.writeable = writeable
+        return index, data
+
+    def arrays(self):
+        """Return read-only (timestamps, values) arrays of the block.
+
+        Same as the 'numpy' return type without the column names.  The
+        arrays are only valid until `close` or `unlink`.
+        """
+        return self._arrays()
+
+    def to_frame(self):
+        """Return a DataFrame that uses the values in the block.
+
+        The values are not copied, but operations that change the values
+        return a copy.  The DataFrame is only valid until `close` or
+        `unlink`.
+        """
+        index, data = self.arrays()
+        if self.index_type == "period":
+            index = pd.DatetimeIndex(index).to_period(self.freq)
+        else:
+            index = pd.DatetimeIndex(index, freq=self.freq)
+        index.name = "Datetime"
+        return pd.DataFrame(data, index=index, columns=self.columns, copy=False)
+
+    def close(self):
+        """Close the mapping of the block in this process."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        """Close and remove the block, only in the process that created it."""
+        if not self._owner:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    """
+                    Only the process that created the shared memory block
+                    can unlink it.
+                    """
+                )
+            )
+        shm = self._shm
+        self._shm = None
+        self._owner = False
+        shm.close()
+        shm.unlink()
+
+
+def share(result):
+    """Copy an extracted result into shared memory and return the handle.
+
+    Parameters
+    ----------
+    result
+        A DataFrame returned by `hbn`, `wdm`, or `plotgen`, or the tuple of
+        timestamps, values, and names of the 'numpy' return type.
+
+    Returns
+    -------
+    SharedFrame
+        The handle that owns the block.
+    """
+    if isinstance(result, pd.Series):
+        result = result.to_frame()
+    if isinstance(result, pd.DataFrame):
+        index = result.index
+        index_type, freq = "datetime", getattr(index, "freqstr", None)
+        if isinstance(index, pd.PeriodIndex):
+            index_type = "period"
+            index = index.to_timestamp()
+        return SharedFrame.create(
+            index,
+            result.to_numpy(dtype="float64", na_value=np.nan),
+            list(result.columns),
+            index_type=index_type,
+            freq=freq,
+        )
+    index, data, columns = result[:3]
+    return SharedFrame.create(index, data, columns)
@@ -0,0 +1,261 @@
+"""Extracted time-series spilled to a temporary memory mapped store on disk.
+
+When the values of an extraction would be larger than the `max_memory`
+given to `hbn`, `wdm`, or `plotgen`, they are written to a temporary
+directory instead of being held in memory, and a `SpilledFrame` that loads
+them lazily is returned::
+
+    with hspf_reader.hbn("run.hbn", "bivl", "RCHRES,,,", max_memory=2**30) as out:
+        flow = out["RCHRES_412_RO"]
+        for chunk in out.iter_frames(100000):
+            ...
+
+The directory holds "index.npy", the datetime64[ns] timestamps, and
+"values.npy", the float64 values in column major order so that each column
+is contiguous and only the pages of the columns that are used are read.
+The directory is removed by `close`, at the end of a `with` block, or when
+the SpilledFrame is garbage collected.
+"""
+
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+
+
+def _directory():
+    return tempfile.mkdtemp(prefix="hspf_reader_spill_")
+
+
+def _dtype(dtype):
+    """Return the dtype to cast a float64 column back to, or None."""
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) or dtype == np.float32:
+        return str(dtype)
+    return None
+
+
+def _load(path):
+    """Return a read-only memory map of the array in the .npy file path."""
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # An empty array can't be memory mapped.
+        return np.load(path)
+
+
+class SpilledFrame:
+    """Handle to timestamps and float64 values in a temporary directory.
+
+    The time-series are outer joined on the timestamps, and missing
+    intervals are only added when the store is written for the 'pandas'
+    return type.  The stored timestamps of hbn output are the start of each
+    period and `freq` is the frequency of the periods, so the DataFrames
+    have the same PeriodIndex as the 'pandas' return type.
+
+    Attributes
+    ----------
+    directory : str
+        The temporary directory of the store.
+    columns : list
+        Column names.
+    nrows : int
+        Number of timestamps.
+    freq
+        The frequency of the PeriodIndex of the DataFrames, or None for a
+        DatetimeIndex.
+    dtypes : list
+        The dtype of each column of the DataFrames, or None for float64.
+    """
+
+    def __init__(self, directory, columns, freq=None, dtypes=None):
+        self.directory = directory
+        self.columns = list(columns)
+        self.freq = freq
+        self.dtypes = list(dtypes or [None] * len(self.columns))
+        self._index = _load(os.path.join(directory, "index.npy"))
+        self._values = _load(os.path.join(directory, "values.npy"))
+        self.nrows = len(self._index)
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, directory, ignore_errors=True
+        )
+
+    @classmethod
+    def from_blocks(cls, index, names, blocks, freq=None):
+        """Write the (timestamps, values) blocks that together cover index.
+
+        Only one block is held in memory at a time.
+        """
+        directory = _directory()
+        try:
+            np.save(
+                os.path.join(directory, "index.npy"),
+                np.asarray(index, dtype="datetime64[ns]"),
+            )
+            values = np.lib.format.open_memmap(
+                os.path.join(directory, "values.npy"),
+                mode="w+",
+                dtype="float64",
+                shape=(len(index), len(names)),
+                fortran_order=True,
+            )
+            row = 0
+            for bindex, data in blocks:
+                values[row : row + len(bindex)] = data
+                row += len(bindex)
+            values.flush()
+            del values
+            return cls(directory, names, freq=freq)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+    @classmethod
+    def from_frames(cls, frames, reindex=None):
+        """Write the DataFrames of frames outer joined on their indexes.
+
+        The timestamps and values of each frame are saved while the union
+        of the timestamps is built, then the frames are aligned one at a
+        time, so only one frame is held in memory at a time.  If `reindex`
+        is given it is called with the union of the timestamps and the
+        timestamps that have at least one value, and returns the timestamps
+        of the store.  Rows of the frames that are not in them are dropped.
+        Float32 and extension dtype columns are cast back to their dtype in
+        the DataFrames of the store.
+        """
+        directory = _directory()
+        try:
+            index = np.array([], dtype="datetime64[ns]")
+            valid = index
+            names = []
+            dtypes = []
+            widths = []
+            for num, nts in enumerate(frames):
+                nindex = np.asarray(nts.index, dtype="datetime64[ns]")
+                index = np.union1d(index, nindex)
+                np.save(os.path.join(directory, f"index_{num}.npy"), nindex)
+                data = nts.to_numpy(dtype="float64", na_value=np.nan)
+                np.save(os.path.join(directory, f"frame_{num}.npy"), data)
+                valid = np.union1d(valid, nindex[~np.isnan(data).all(axis=1)])
+                del data
+                names.extend(nts.columns)
+                dtypes.extend(_dtype(i) for i in nts.dtypes)
+                widths.append(len(nts.columns))
+            if reindex is not None:
+                index = np.asarray(reindex(index, valid), dtype="datetime64[ns]")
+            np.save(os.path.join(directory, "index.npy"), index)
+            values = np.lib.format.open_memmap(
+                os.path.join(directory, "values.npy"),
+                mode="w+",
+                dtype="float64",
+                shape=(len(index), len(names)),
+                fortran_order=True,
+            )
+            values[:] = np.nan
+            col = 0
+            for num, width in enumerate(widths):
+                ipath = os.path.join(directory, f"index_{num}.npy")
+                fpath = os.path.join(directory, f"frame_{num}.npy")
+                nindex = np.load(ipath)
+                rows = np.searchsorted(index, nindex)
+                keep = rows < len(index)
+                keep[keep] = index[rows[keep]] == nindex[keep]
+                values[rows[keep], col : col + width] = np.load(fpath)[keep]
+                col += width
+                os.remove(ipath)
+                os.remove(fpath)
+            values.flush()
+            del values
+            return cls(directory, names, dtypes=dtypes)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+    def __repr__(self):
+        return (
+            f"SpilledFrame(directory={self.directory!r}, nrows={self.nrows}, "
+            f"ncolumns={len(self.columns)})"
+        )
+
+    def __len__(self):
+        return self.nrows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check(self):
+        if not self._finalizer.alive:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The spilled store "{self.directory}" has been closed.
+                    """
+                )
+            )
+
+    def _make_index(self, stamps):
+        index = pd.DatetimeIndex(np.asarray(stamps), name="Datetime")
+        if self.freq is not None:
+            index = index.to_period(self.freq)
+        return index
+
+    @property
+    def index(self):
+        """Return the DatetimeIndex, or PeriodIndex, of the timestamps."""
+        self._check()
+        return self._make_index(self._index)
+
+    def arrays(self):
+        """Return read-only memory maps of the (timestamps, values).
+
+        Same as the 'numpy' return type without the column names.  The
+        arrays are only valid until `close`.
+        """
+        self._check()
+        return self._index, self._values
+
+    def _frame(self, stamps, values):
+        frame = pd.DataFrame(values, index=self._make_index(stamps))
+        frame = frame.astype(
+            {num: dtype for num, dtype in enumerate(self.dtypes) if dtype}
+        )
+        frame.columns = self.columns
+        return frame
+
+    def __getitem__(self, column):
+        """Return the pandas.Series of one column."""
+        self._check()
+        num = self.columns.index(column)
+        series = pd.Series(
+            np.array(self._values[:, num]), index=self.index, name=column
+        )
+        if self.dtypes[num]:
+            series = series.astype(self.dtypes[num])
+        return series
+
+    def iter_frames(self, chunksize=65536):
+        """Yield DataFrames of chunksize rows in order of the timestamps."""
+        self._check()
+        for row in range(0, self.nrows, chunksize):
+            yield self._frame(
+                self._index[row : row + chunksize],
+                np.array(self._values[row : row + chunksize]),
+            )
+
+    def to_frame(self):
+        """Return a DataFrame of every value, read into memory."""
+        self._check()
+        return self._frame(self._index, np.array(self._values))
+
+    def close(self):
+        """Remove the directory, the SpilledFrame can't be used after."""
+        self._index = None
+        self._values = None
+        self._finalizer()
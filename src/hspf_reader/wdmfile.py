@@ -0,0 +1,401 @@
+"""Directory level reader for WDM files.
+
+The WDM file is a sequence of 512 word (2048 byte) records.  The first is
+the file definition record and each time-series data set (DSN) has a label
+record with the attributes and pointers to the data groups.  The files are
+read through a memory map borrowed from the file pool, so only the label
+records and the data records of the requested DSNs are read, and the
+values are decoded with the helpers of the toolbox WDM reader.
+"""
+
+import contextlib
+import mmap
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from hspf_reader import pool as _pool
+from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
+from hspf_reader.toolbox_utils.src.toolbox_utils.readers import wdm as _wdm
+
+RECORD_WORDS = 512
+RECORD_BYTES = 4 * RECORD_WORDS
+
+_MAGIC = -998
+
+# Units of the fixed time steps by TCODE, monthly and yearly steps vary.
+_STEP_UNITS = {1: "s", 2: "min", 3: "h", 4: "D"}
+
+
+def _check(wdmpath, iarray):
+    """Raise a ValueError if the words iarray are not a WDM file."""
+    if len(iarray) < RECORD_WORDS or iarray[0] != _MAGIC:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                {wdmpath} is not a valid WDM file.  The first word must be
+                {_MAGIC}.
+                """
+            )
+        )
+
+
+def read_words(wdmpath):
+    """Return the int32 words of wdmpath after checking the magic number."""
+    iarray = np.fromfile(wdmpath, dtype=np.int32)
+    _check(wdmpath, iarray)
+    return iarray
+
+
+def _open_mmap(wdmpath):
+    with open(wdmpath, "rb") as fpointer:
+        return mmap.mmap(fpointer.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextlib.contextmanager
+def borrow_words(wdmpath):
+    """Return a context manager of the int32 words of wdmpath from the pool.
+
+    The words are a read only view of the pooled memory map, and are only
+    valid in the `with` block.
+    """
+    with _pool.borrow(wdmpath, _open_mmap) as buf:
+        iarray = np.frombuffer(buf, dtype=np.int32)
+        _check(wdmpath, iarray)
+        yield iarray
+
+
+def _label_records(iarray):
+    """Return the word index of the label record of each time-series DSN."""
+    nrecords = min(int(iarray[28]), len(iarray) // RECORD_WORDS)
+    return [
+        index
+        for index in range(RECORD_WORDS, nrecords * RECORD_WORDS, RECORD_WORDS)
+        if not (
+            iarray[index] == iarray[index + 1] == iarray[index + 2] == 0
+            and iarray[index + 3]
+        )
+        and iarray[index + 5] == 1
+    ]
+
+
+def _attributes(iarray, index):
+    """Return the dictionary of the known search attributes of a label."""
+    farray = iarray.view(np.float32)
+    psa = int(iarray[index + 9])
+    attributes = {}
+    if psa <= 0:
+        return attributes
+    sacnt = int(iarray[index + psa - 1])
+    for i in range(psa + 1, psa + 1 + 2 * sacnt, 2):
+        try:
+            name, atype, length = _wdm.attrinfo[int(iarray[index + i])]
+        except KeyError:
+            continue
+        ptr = int(iarray[index + i + 1]) - 1 + index
+        if atype == "I":
+            attributes[name] = int(iarray[ptr])
+        elif atype == "R":
+            attributes[name] = float(farray[ptr])
+        else:
+            attributes[name] = "".join(
+                _wdm.itostr(int(k)) for k in iarray[ptr : ptr + length // 4]
+            ).strip()
+    return attributes
+
+
+def interval(attributes):
+    """Return the pandas frequency string of the TCODE and TSSTEP attributes."""
+    try:
+        return f"{attributes.get('TSSTEP', 1)}{_wdm.freq[attributes['TCODE']]}"
+    except KeyError:
+        return None
+
+
+def directory(wdmpath, iarray=None):
+    """Return the label of each time-series DSN in a WDM file.
+
+    Parameters
+    ----------
+    wdmpath
+        The WDM file.
+    iarray
+        [optional] The words of the file from `read_words`.
+
+    Returns
+    -------
+    dict
+        DSN to a dictionary with the byte "offset" of the label record, the
+        "attributes", the number of data "groups", and the "start" Timestamp
+        of the first group, or None for a DSN without data.
+    """
+    if iarray is None:
+        with borrow_words(wdmpath) as iarray:
+            return directory(wdmpath, iarray=iarray)
+    result = {}
+    for index in _label_records(iarray):
+        pdat = int(iarray[index + 10])
+        pdatv = int(iarray[index + 11])
+        groups = [
+            _wdm.splitposition(int(i))
+            for i in iarray[index + pdat + 1 : index + pdatv - 1]
+            if i
+        ]
+        start = None
+        if groups:
+            rec, offset = groups[0]
+            start = pd.Timestamp(
+                _wdm.splitdate(int(iarray[rec * RECORD_WORDS + offset]))
+            ).tz_localize(None)
+        result[int(iarray[index + 4])] = {
+            "offset": 4 * index,
+            "attributes": _attributes(iarray, index),
+            "groups": len(groups),
+            "start": start,
+        }
+    return result
+
+
+def _blocks(iarray, farray, index, chunksize=None):
+    """Yield the timestamps and float32 values of the DSN with label at index.
+
+    Values equal to the TFILL attribute are removed.  With a chunksize the
+    data groups are decoded a few at a time, in blocks of about chunksize
+    values, and the timestamps of each block are made from the time step
+    without the timestamps of the whole DSN.  Nothing is yielded if the
+    DSN has no data.
+    """
+    attributes = {
+        "TSBDY": 1,
+        "TSBHR": 1,
+        "TSBMO": 1,
+        "TSBYR": 1900,
+        "TFILL": -999.0,
+    } | _attributes(iarray, index)
+    pdat = int(iarray[index + 10])
+    pdatv = int(iarray[index + 11])
+    records = [
+        _wdm.splitposition(int(i))
+        for i in iarray[index + pdat + 1 : index + pdatv - 1]
+        if i
+    ]
+    if not records:
+        return
+    srec, soffset = records[0]
+    start = _wdm.splitdate(int(iarray[srec * RECORD_WORDS + soffset]))
+    cindex = pd.date_range(
+        start=start,
+        periods=len(records) + 1,
+        freq=_wdm.freq[attributes["TGROUP"]],
+        tz="UTC",
+    )
+    tcode = attributes["TCODE"]
+    if chunksize is None or tcode not in _STEP_UNITS:
+        # Monthly and yearly steps have few values, so keep every timestamp.
+        tindex = (
+            pd.date_range(
+                start=start,
+                end=cindex[-1],
+                freq=f"{attributes['TSSTEP']}{_wdm.freq[tcode]}",
+            )
+            .tz_localize(None)
+            .astype("datetime64[ns]")
+        )
+        cindex = cindex.tz_localize(None).astype("datetime64[ns]")
+        bounds = np.searchsorted(tindex, cindex)
+        total = len(tindex)
+
+        def stamps(lo, hi):
+            return tindex[lo:hi]
+
+    else:
+        first = np.datetime64(pd.Timestamp(start).replace(tzinfo=None), "ns")
+        delta = np.timedelta64(
+            pd.Timedelta(attributes["TSSTEP"], unit=_STEP_UNITS[tcode]).value, "ns"
+        )
+        cindex = cindex.tz_localize(None).values.astype("datetime64[ns]")
+        total = int((cindex[-1] - first) // delta) + 1
+        bounds = np.clip(-((first - cindex) // delta), 0, total)
+
+        def stamps(lo, hi):
+            return pd.DatetimeIndex(first + np.arange(lo, hi) * delta)
+
+    counts = np.diff(bounds)
+    size = int(bounds[-1] - bounds[0])
+    chunksize = size if chunksize is None else chunksize
+    done = 0
+    group = 0
+    while group < len(records) and done < size:
+        stop = group + 1
+        while stop < len(records) and counts[group:stop].sum() < chunksize:
+            stop += 1
+        # A compressed run can end past its group, as in one pass.
+        floats = np.zeros(
+            min(size - done, int(counts[group:stop].sum()) + (1 << 16)),
+            dtype=np.float32,
+        )
+        findex = 0
+        for (rec, roffset), count in zip(records[group:stop], counts[group:stop]):
+            findex = _wdm.getfloats(
+                iarray, farray, floats, findex, rec, roffset, count
+            )
+        keep = floats[:findex] != attributes["TFILL"]
+        yield stamps(done, done + findex)[keep], floats[:findex][keep]
+        done += findex
+        group = stop
+
+
+def _arrays(iarray, farray, index):
+    """Return the timestamps and float32 values of the DSN with label at index.
+
+    Values equal to the TFILL attribute are removed, None if the DSN has no
+    data.
+    """
+    return next(_blocks(iarray, farray, index), None)
+
+
+def _values(iarray, farray, index):
+    """Return the single column DataFrame of the DSN with label at index.
+
+    The same as the toolbox WDM reader, None if the DSN has no data.
+    """
+    arrays = _arrays(iarray, farray, index)
+    if arrays is None:
+        return None
+    return pd.DataFrame(arrays[1], index=arrays[0])
+
+
+def iter_arrays(wdmpath, *dsns, chunksize=None):
+    """Yield (DSN, timestamps, values) of each DSN of wdmpath with data.
+
+    The DSNs are decoded one at a time in the order of the label records,
+    so only the values of one DSN are held at a time.  With a chunksize
+    each DSN is yielded in time order as several blocks of about chunksize
+    values, so only one block is held at a time.
+    """
+    dsns = {int(i) for i in dsns}
+    with borrow_words(wdmpath) as iarray:
+        farray = iarray.view(np.float32)
+        for index in _label_records(iarray):
+            dsn = int(iarray[index + 4])
+            if dsn not in dsns:
+                continue
+            for arrays in _blocks(iarray, farray, index, chunksize=chunksize):
+                yield (dsn,) + arrays
+
+
+def extract(wdmpath, *dsns):
+    """Return a DataFrame of the DSNs of wdmpath.
+
+    The same as the toolbox WDM reader, with a "{wdmpath}_{DSN}" column for
+    each DSN with data in the order of the label records, but only the label
+    and data records of the DSNs are read.
+    """
+    dsns = {int(i) for i in dsns}
+    result = pd.DataFrame()
+    with borrow_words(wdmpath) as iarray:
+        farray = iarray.view(np.float32)
+        for index in _label_records(iarray):
+            dsn = int(iarray[index + 4])
+            if dsn not in dsns:
+                continue
+            series = _values(iarray, farray, index)
+            if series is None:
+                continue
+            series.columns = [f"{wdmpath}_{dsn}"]
+            result = result.join(series, how="outer")
+    return result
+
+
+class WDMFile:
+    """Reusable, thread-safe reader of one WDM file.
+
+    The label of each DSN is decoded the first time it is needed and kept,
+    and decoded again if the size or modification time of the file changes.
+    The values are read from a memory map borrowed from the file pool, so
+    there is no shared file position and one object can be shared by the
+    threads of a server.  Pickling sends the path and the
+    labels.
+
+    Parameters
+    ----------
+    wdmpath
+        Path of the WDM file.
+    """
+
+    def __init__(self, wdmpath):
+        self.path = os.fspath(wdmpath)
+        self._stat = None
+        self._directory = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"path": self.path, "_stat": self._stat, "_directory": self._directory}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"WDMFile({self.path!r})"
+
+    def directory(self):
+        """Return the `directory` of the file, reading it only when needed."""
+        with self._lock:
+            stat = os.stat(self.path)
+            stat = (stat.st_size, stat.st_mtime_ns)
+            if self._directory is None or stat != self._stat:
+                self._directory = directory(self.path)
+                self._stat = stat
+            return self._directory
+
+    def dsns(self):
+        """Return the sorted list of the time-series DSNs."""
+        return sorted(self.directory())
+
+    def read(self, *dsns, start_date=None, end_date=None):
+        """Return a DataFrame of the DSNs, every DSN with data by default.
+
+        The columns are named "{basename of the file}_{DSN}" as by `wdm`.  The
+        values of each DSN are decoded from the label record at the offset
+        kept by `directory`, without reading the other label records.
+        """
+        known = self.directory()
+        dsns = [int(i) for i in dsns] or [
+            i for i in sorted(known) if known[i]["groups"]
+        ]
+        missing = [i for i in dsns if i not in known]
+        if missing:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The DSNs {missing} are not in {self.path}.
+                    """
+                )
+            )
+        base = os.path.basename(self.path)
+        columns = []
+        with borrow_words(self.path) as iarray:
+            farray = iarray.view(np.float32)
+            for dsn in dsns:
+                arrays = _arrays(iarray, farray, known[dsn]["offset"] // 4)
+                if arrays is None:
+                    arrays = (
+                        np.array([], dtype="datetime64[ns]"),
+                        np.array([], dtype=np.float32),
+                    )
+                columns.append(
+                    pd.Series(arrays[1], index=arrays[0], name=f"{base}_{dsn}")
+                )
+        if columns:
+            nts = pd.concat(columns, axis=1, sort=True)
+        else:
+            nts = pd.DataFrame(index=pd.DatetimeIndex([], dtype="datetime64[ns]"))
+        nts.index.name = "Datetime"
+        if start_date is not None:
+            nts = nts.loc[pd.Timestamp(tsutils.parsedate(start_date)) :]
+        if end_date is not None:
+            nts = nts.loc[: pd.Timestamp(tsutils.parsedate(end_date))]
+        return nts
@@ -0,0 +1,102 @@
+"""
+catalog
+----------------------------------
+
+Tests for `hspf_reader batch` module.
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from hspf_reader.hspf_reader import batch, hbn, plotgen, wdm
+
+SPEC = """
+[defaults]
+float_format = ".6g"
+
+[[job]]
+type = "hbn"
+file = "{tests}/data_yearly.hbn"
+interval = "yearly"
+labels = [",905,,AGWS", ",411,,AGWS"]
+output = "hbn.pkl"
+
+[[job]]
+type = "hbn"
+file = "{tests}/data_yearly.hbn"
+interval = "yearly"
+labels = ",905,,AGWS"
+output = "out/hbn.csv"
+
+[[job]]
+type = "wdm"
+file = "{tests}/data.wdm"
+dsns = [1, 2]
+output = "wdm.pkl"
+
+[[job]]
+type = "plotgen"
+file = "{tests}/data_plotgen.plt"
+fields = ["TOTAL OUTFLOW"]
+output = "plotgen.pkl"
+"""
+
+
+class TestBatch(TestCase):
+    def test_batch_api(self):
+        tests = os.path.abspath("tests")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spec = os.path.join(tmpdir, "spec.toml")
+            with open(spec, "w") as fpointer:
+                fpointer.write(SPEC.format(tests=tests))
+            summary = batch(spec, workers=2)
+            assert list(summary["job"]) == [1, 2, 3, 4]
+            assert list(summary["rows"]) == [51, 51, 14790, 732]
+            assert_frame_equal(
+                pd.read_pickle(os.path.join(tmpdir, "hbn.pkl")),
+                hbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS", ",411,,AGWS"),
+            )
+            out = pd.read_csv(os.path.join(tmpdir, "out", "hbn.csv"), index_col=0)
+            assert list(out.columns) == ["PERLND_905_AGWS"]
+            assert_frame_equal(
+                pd.read_pickle(os.path.join(tmpdir, "wdm.pkl")),
+                wdm(os.path.join(tests, "data.wdm"), 1, 2),
+            )
+            assert_frame_equal(
+                pd.read_pickle(os.path.join(tmpdir, "plotgen.pkl")),
+                plotgen(os.path.join(tests, "data_plotgen.plt"), "TOTAL OUTFLOW"),
+            )
+
+    def test_batch_wdm_nan_api(self):
+        # A NaN last value of DSN 2 is kept, as by wdm.
+        words = np.fromfile("tests/data.wdm", dtype=np.float32)
+        last = wdm("tests/data.wdm", 2).iloc[-3:, 0].to_numpy(dtype=np.float32)
+        windows = np.lib.stride_tricks.sliding_window_view(words, 3)
+        words[np.flatnonzero((windows == last).all(axis=1))[0] + 2] = np.nan
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "nan.wdm")
+            words.tofile(path)
+            batch(
+                {
+                    "job": [
+                        {
+                            "type": "wdm",
+                            "file": path,
+                            "dsns": 2,
+                            "output": os.path.join(tmpdir, "wdm.pkl"),
+                        }
+                    ]
+                }
+            )
+            out = pd.read_pickle(os.path.join(tmpdir, "wdm.pkl"))
+            assert out.iloc[-1].isna().all()
+            assert_frame_equal(out, wdm(path, 2))
+
+    def test_batch_bad_key_api(self):
+        with self.assertRaises(ValueError):
+            batch({"job": [{"type": "wdm", "file": "a.wdm", "labels": "x"}]})
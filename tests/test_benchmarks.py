@@ -0,0 +1,44 @@
+"""
+catalog
+----------------------------------
+
+Tests for the synthetic file generators of the benchmarks.
+"""
+
+import importlib.util
+import os
+import tempfile
+from unittest import TestCase, skipUnless
+
+from benchmarks.generators import make_hbn, make_plotgen, make_wdm
+from hspf_reader.hspf_reader import hbn, plotgen, wdm
+
+
+class TestGenerators(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_make_hbn(self):
+        path = os.path.join(self.tmpdir.name, "test.hbn")
+        for interval, rows in [("bivl", 17544), ("daily", 731), ("monthly", 24)]:
+            make_hbn(path, operations=3, variables=4, years=2, interval=interval)
+            out = hbn(path, interval, ",,,")
+            assert out.shape == (rows, 12)
+            assert out.columns[0] == "PERLND_1_V000"
+
+    def test_make_plotgen(self):
+        path = os.path.join(self.tmpdir.name, "test.plt")
+        make_plotgen(path, curves=3, years=1, timestep=1440)
+        out = plotgen(path)
+        assert out.shape == (366, 3)
+        assert str(out.index[-1]) == "2001-01-01 00:00:00"
+
+    @skipUnless(importlib.util.find_spec("wdmtoolbox"), "requires wdmtoolbox")
+    def test_make_wdm(self):
+        path = os.path.join(self.tmpdir.name, "test.wdm")
+        make_wdm(path, dsns=2, years=1, freq="D")
+        out = wdm(path, 1, 2)
+        assert out.shape == (366, 2)
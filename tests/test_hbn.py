@@ -5,16 +5,37 @@ catalog
 Tests for `hspf_reader hbn` module.
 """
 
+import asyncio
+import concurrent.futures
+import importlib.util
+import os
+import pickle
 import shlex
 import subprocess
 import sys
+import tempfile
+import time
 from io import BytesIO, StringIO
-from unittest import TestCase
+from unittest import TestCase, mock, skipUnless
 
+import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
-from hspf_reader.hspf_reader import hbn
+from benchmarks.generators import make_hbn
+from hspf_reader.ensemble import P2Quantile
+from hspf_reader.hbnfile import HBNFile, open_mmap, record_values, scan
+from hspf_reader.hspf_reader import (
+    _FILE_LIMITS,
+    ahbn,
+    hbn,
+    hbn_ensemble,
+    hbn_many,
+    open_hbn_dataset,
+)
+from hspf_reader.instrument import profile
+from hspf_reader.shared import share
+from hspf_reader.spill import SpilledFrame
 from hspf_reader.toolbox_utils.src.toolbox_utils import tsutils
 
 
@@ -29,6 +50,11 @@ def capture(func, *args, **kwds):
     return out
 
 
+def shared_sum(handle):
+    with handle:
+        return handle.to_frame().sum().tolist()
+
+
 class TestDescribe(TestCase):
     def setUp(self):
         self.extract = b"""Datetime,PERLND_905_AGWS
@@ -112,3 +138,349 @@ class TestDescribe(TestCase):
     def test_extract_one_label_labelstr_api(self):
         out = hbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS")
         assert_frame_equal(out, self.extract, check_dtype=False)
+
+    def test_extract_two_labels_api(self):
+        out = hbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS", ",411,,AGWS")
+        assert list(out.columns) == ["PERLND_411_AGWS", "PERLND_905_AGWS"]
+        assert_frame_equal(out[["PERLND_905_AGWS"]], self.extract, check_dtype=False)
+
+    def test_extract_one_label_async_api(self):
+        out = asyncio.run(ahbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS"))
+        assert_frame_equal(out, self.extract, check_dtype=False)
+
+    def test_extract_async_cancel_api(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "big.hbn")
+            make_hbn(path, operations=10, variables=10, years=5)
+            calls = []
+
+            async def run():
+                loop = asyncio.get_running_loop()
+                started = asyncio.Event()
+
+                def progress(done, total):
+                    calls.append((done, total))
+                    loop.call_soon_threadsafe(started.set)
+                    time.sleep(0.05)
+
+                task = asyncio.create_task(
+                    ahbn(path, "bivl", ",1,,V000", progress=progress)
+                )
+                await started.wait()
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                semaphore = _FILE_LIMITS[loop][(os.path.realpath(path), 1)]
+                assert not semaphore.locked()
+                return await asyncio.wait_for(
+                    ahbn(path, "bivl", ",1,,V000"), timeout=60
+                )
+
+            out = asyncio.run(run())
+            assert calls[-1][0] < calls[-1][1]
+            assert list(out.columns) == ["PERLND_1_V000"]
+
+    def test_extract_one_label_numpy_api(self):
+        index, values, columns = hbn(
+            "tests/data_yearly.hbn", "yearly", ",905,,AGWS", return_type="numpy"
+        )
+        assert columns == ["PERLND_905_AGWS"]
+        assert (index == self.extract.index.to_timestamp().values).all()
+        assert abs(values[:, 0] - self.extract["PERLND_905_AGWS"].values).max() < 1e-5
+
+    @skipUnless(importlib.util.find_spec("pyarrow"), "requires pyarrow")
+    def test_extract_one_label_arrow_api(self):
+        table = hbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS", return_type="arrow")
+        assert table.column_names == ["Datetime", "PERLND_905_AGWS"]
+        reader = hbn(
+            "tests/data_yearly.hbn",
+            "yearly",
+            ",905,,AGWS",
+            return_type="arrow_stream",
+            chunksize=10,
+        )
+        batches = list(reader)
+        assert len(batches) == 6
+        assert reader.schema.equals(table.schema)
+        assert table.equals(type(table).from_batches(batches))
+
+    def test_extract_many_api(self):
+        paths = ["tests/data_yearly.hbn", "tests/data_6b_np1.hbn"]
+        out = hbn_many(paths, "yearly", ",905,,AGWS")
+        assert list(out.columns) == [(i, "PERLND_905_AGWS") for i in paths]
+        assert_frame_equal(out[paths[1]], self.extract, check_dtype=False)
+        index, values, columns, scenarios = hbn_many(
+            paths, "yearly", ",905,,AGWS", return_type="numpy"
+        )
+        assert values.shape == (2, 51, 1)
+        assert scenarios == paths
+        for empty in ([], ""):
+            with self.assertRaises(ValueError):
+                hbn_many(empty, "yearly", ",905,,AGWS")
+
+    def test_extract_ensemble_api(self):
+        paths = ["tests/data_yearly.hbn", "tests/data_6b_np1.hbn"] * 2
+        with profile() as stats:
+            out = hbn_ensemble(
+                paths, "yearly", ",905,,AGWS", stats="count mean std p50"
+            )
+        assert stats.as_dict()["ensemble"]["rows"] == 51
+        assert list(out.columns) == ["count", "mean", "std", "p50"]
+        assert (out.index == self.extract.index).all()
+        assert (out["count"] == 4).all()
+        assert (out["std"] == 0).all()
+        expected = self.extract["PERLND_905_AGWS"].to_numpy(dtype="float64")
+        assert abs(out["mean"].values - expected).max() < 1e-5
+        assert abs(out["p50"].values - expected).max() < 1e-5
+        assert_frame_equal(
+            hbn_ensemble(
+                paths,
+                "yearly",
+                ",905,,AGWS",
+                stats="count mean std p50",
+                workers=2,
+                chunksize=10,
+            ),
+            out,
+        )
+        with self.assertRaises(ValueError):
+            hbn_ensemble(paths, "yearly", ",905,,", stats="mean")
+        with self.assertRaises(ValueError):
+            hbn_ensemble(paths, "yearly", ",905,,AGWS", stats="median")
+
+        values = np.random.default_rng(1).normal(size=(1000, 3))
+        quantile = P2Quantile(3, 0.9)
+        for row in values:
+            quantile.update(row)
+        assert abs(quantile.result() - np.quantile(values, 0.9, axis=0)).max() < 0.1
+
+    def test_extract_aggregate_api(self):
+        out = hbn(
+            "tests/data_yearly.hbn",
+            "yearly",
+            ",905,,AGWS",
+            aggregate={"freq": "10YS", "how": ["mean", "max"]},
+        )
+        expected = self.extract.to_timestamp().resample("10YS").agg(["mean", "max"])
+        expected.columns = ["PERLND_905_AGWS_mean", "PERLND_905_AGWS_max"]
+        assert (out.index == expected.index).all()
+        assert_frame_equal(
+            out.reset_index(drop=True),
+            expected.reset_index(drop=True),
+            check_dtype=False,
+        )
+
+    @skipUnless(
+        importlib.util.find_spec("xarray") and importlib.util.find_spec("dask"),
+        "requires xarray and dask",
+    )
+    def test_open_dataset_api(self):
+        ds = open_hbn_dataset("tests/data_yearly.hbn", "yearly")
+        assert ds["PERLND_AGWS"].dims == ("time", "PERLND")
+        agws = ds["PERLND_AGWS"].sel(PERLND=905, time=slice("1950", "1953"))
+        assert (
+            abs(agws.values - self.extract["PERLND_905_AGWS"].values[:4]).max() < 1e-5
+        )
+
+    def test_extract_workers_api(self):
+        with mock.patch("os.cpu_count", return_value=2):
+            out = hbn("tests/data_yearly.hbn", "yearly", ",,,AGWS", workers=2)
+        assert_frame_equal(out, hbn("tests/data_yearly.hbn", "yearly", ",,,AGWS"))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "test.hbn")
+            make_hbn(path, operations=5, variables=6, years=5, interval="daily")
+            expected = hbn(path, "daily", ",,,")
+            with mock.patch("os.cpu_count", return_value=2):
+                assert_frame_equal(hbn(path, "daily", ",,,", workers=2), expected)
+            with mock.patch("os.cpu_count", return_value=1), mock.patch(
+                "hspf_reader.hbnfile.scan_parallel", side_effect=AssertionError
+            ):
+                assert_frame_equal(hbn(path, "daily", ",,,", workers=2), expected)
+
+    def test_extract_cache_api(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first = hbn(
+                "tests/data_yearly.hbn", "yearly", ",905,,AGWS", cache_dir=cache_dir
+            )
+            assert len(os.listdir(cache_dir)) == 1
+            second = hbn(
+                "tests/data_yearly.hbn", "yearly", ",905,,AGWS", cache_dir=cache_dir
+            )
+            assert_frame_equal(first, second)
+            assert_frame_equal(second, self.extract, check_dtype=False)
+            third = hbn(
+                "tests/data_yearly.hbn",
+                "yearly",
+                ",905,,AGWS",
+                cache_dir=cache_dir,
+                workers=2,
+            )
+            assert len(os.listdir(cache_dir)) == 1
+            assert_frame_equal(first, third)
+
+    def test_extract_profile_api(self):
+        with profile() as stats:
+            hbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS")
+        stages = stats.as_dict()
+        assert stages["scan"]["bytes"] == 822320
+        assert stages["match"]["matched"] == 1
+        assert stages["decode"]["rows"] == 51
+        assert "asbestfreq" in stats.report()
+
+    def test_extract_profile_progress_cli(self):
+        args = "hspf_reader hbn tests/data_yearly.hbn yearly ,905,,AGWS"
+        err = subprocess.run(
+            shlex.split(f"{args} --profile --progress"), capture_output=True
+        ).stderr.decode()
+        bar, report = err.split("\nstage", 1)
+        assert bar.startswith("\r")
+        assert "\r" not in report
+
+    def test_extract_progress_api(self):
+        calls = []
+        hbn(
+            "tests/data_yearly.hbn",
+            "yearly",
+            ",905,,AGWS",
+            progress=lambda done, total: calls.append((done, total)),
+        )
+        size = os.path.getsize("tests/data_yearly.hbn")
+        assert calls[-1] == (size, size)
+        assert all(i[0] <= j[0] for i, j in zip(calls, calls[1:]))
+
+        def stop(done, total):
+            raise RuntimeError("stop")
+
+        with self.assertRaises(RuntimeError):
+            hbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS", progress=stop)
+
+    def test_extract_shared_api(self):
+        out = hbn("tests/data_yearly.hbn", "yearly", ",905,,AGWS", ",411,,AGWS")
+        with share(out) as handle:
+            assert_frame_equal(handle.to_frame(), out, check_dtype=False)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+                sums = list(executor.map(shared_sum, [handle] * 2))
+            assert sums == [out.sum().tolist()] * 2
+        with hbn(
+            "tests/data_yearly.hbn", "yearly", ",905,,AGWS", return_type="shared"
+        ) as handle:
+            _, values = handle.arrays()
+            assert not values.flags.writeable
+            expected = self.extract["PERLND_905_AGWS"].values
+            assert abs(values[:, 0] - expected).max() < 1e-5
+
+    def test_extract_spill_api(self):
+        args = ("tests/data_yearly.hbn", "yearly", "PERLND,,,")
+        index, values, names = hbn(
+            *args, return_type="numpy", start_date="1990-01-01"
+        )
+        with hbn(*args, max_memory=1000, start_date="1990-01-01") as out:
+            assert isinstance(out, SpilledFrame)
+            assert out.columns == names
+            assert np.array_equal(out.arrays()[0], index)
+            assert np.array_equal(out.arrays()[1], values, equal_nan=True)
+            assert pd.concat(list(out.iter_frames(4))).equals(out.to_frame())
+            assert np.array_equal(
+                out[names[0]].values, values[:, 0], equal_nan=True
+            )
+            directory = out.directory
+        assert not os.path.exists(directory)
+        with hbn(*args, max_memory=1000) as out:
+            assert out.index.equals(hbn(*args).index)
+        assert_frame_equal(hbn(*args, max_memory=2**30), hbn(*args))
+
+    def test_extract_spill_cli(self):
+        args = "hspf_reader hbn tests/data_yearly.hbn yearly ,905,,AGWS ,411,,"
+        for tablefmt in ("csv_nos", "plain"):
+            out = [
+                subprocess.Popen(
+                    shlex.split(f"{args} --tablefmt {tablefmt} {extra}"),
+                    stdout=subprocess.PIPE,
+                    stdin=subprocess.PIPE,
+                ).communicate()[0]
+                for extra in ("", "--max_memory 0")
+            ]
+            assert out[0] == out[1]
+            assert b"\n1950" in out[1]
+
+    def test_hbnfile(self):
+        with HBNFile("tests/data_yearly.hbn") as hbnfile:
+            assert hbnfile.labels()["PERLND,905,PWATER,AGWS"] == ["yearly"]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                outs = list(
+                    executor.map(
+                        lambda label: hbnfile.read("yearly", label),
+                        [",905,,AGWS", ",411,,AGWS"] * 4,
+                    )
+                )
+            assert_frame_equal(outs[0], self.extract, check_dtype=False)
+            assert all(i.equals(j) for i, j in zip(outs, outs[2:]))
+            copy = pickle.loads(pickle.dumps(hbnfile))
+            assert copy._scanned is not None
+            assert copy.read("yearly", ",905,,AGWS").equals(outs[0])
+            copy.close()
+
+    def test_hbnfile_incremental(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "run.hbn")
+            with open("tests/data_yearly.hbn", "rb") as fpointer:
+                data = bytearray(fpointer.read())
+            with open(path, "wb") as fpointer:
+                fpointer.write(data)
+            sidecar = os.path.join(tmpdir, "run.hbn.digests")
+            with HBNFile(path, incremental=True, sidecar=sidecar) as hbnfile:
+                assert len(hbnfile.changed_labels()) == len(hbnfile.labels())
+
+                # The values are decoded without holding the lock.
+                def decode(*args):
+                    assert not hbnfile._lock.locked()
+                    return record_values(*args)
+
+                with mock.patch(
+                    "hspf_reader.hbnfile.record_values", side_effect=decode
+                ):
+                    first = hbnfile.read("yearly", "PERLND,,,")
+                assert sorted(os.listdir(tmpdir)) == ["run.hbn", "run.hbn.digests"]
+
+                # An unchanged file is not hashed, a touched one only once.
+                with profile() as stats:
+                    changed = HBNFile(
+                        path, incremental=True, sidecar=sidecar
+                    ).changed_labels()
+                assert not any(i.startswith("PERLND,") for i in changed)
+                assert "digest" not in stats.as_dict()
+                os.utime(path, ns=(0, 1))
+                with profile() as stats:
+                    assert hbnfile.changed_labels() == changed
+                    hbnfile.read("yearly", "PERLND,,,")
+                    assert hbnfile.changed_labels() == changed
+                with open_mmap(path) as buf:
+                    records = sum(
+                        len(offs)
+                        for key, offs in scan(buf)[2].items()
+                        if key[0] == "PERLND" and key[3] == 5
+                    )
+                assert stats.as_dict()["digest"]["records"] == records
+
+                # Change the first value of a PERLND 905 PWATER record.
+                with open_mmap(path) as buf:
+                    offsets = scan(buf)[2][("PERLND", 905, "PWATER", 5)]
+                pos = int(offsets[3]) + 56
+                data[pos : pos + 4] = np.float32(123.5).tobytes()
+                with open(path, "wb") as fpointer:
+                    fpointer.write(data)
+                os.utime(path, ns=(0, 0))
+
+                changed = HBNFile(
+                    path, incremental=True, sidecar=sidecar
+                ).changed_labels()
+                assert "PERLND,905,PWATER,AGWS" in changed
+                assert not any(i.startswith("PERLND,411,") for i in changed)
+                second = hbnfile.read("yearly", "PERLND,,,")
+                assert second.equals(HBNFile(path).read("yearly", "PERLND,,,"))
+                diff = (first != second) & ~(first.isna() & second.isna())
+                assert list(second.columns[diff.any()]) == ["PERLND_905_PERS"]
+
+            os.remove(sidecar)
+            HBNFile(path, incremental=True).read("yearly", "PERLND,,,")
+            assert os.listdir(tmpdir) == ["run.hbn"]
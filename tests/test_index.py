@@ -0,0 +1,49 @@
+"""
+catalog
+----------------------------------
+
+Tests for `hspf_reader index` and `lookup`.
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from hspf_reader.hspf_reader import index_tree, lookup
+
+
+class TestIndex(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ("data_yearly.hbn", "data.wdm", "data_plotgen.plt"):
+            shutil.copy(os.path.join("tests", name), self.tmpdir)
+        self.database = os.path.join(self.tmpdir, "hspf_reader_index.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_index_api(self):
+        counts = index_tree(self.tmpdir)
+        assert counts["added"] == 3
+        out = lookup(self.database, "PERLND,905,PWATER,AGWS")
+        assert len(out) == 1
+        assert out["start_date"][0] == "1950-01-01T00:00:00"
+        assert out["end_date"][0] == "2000-01-01T00:00:00"
+        assert out["nrecords"][0] == 51
+        out = lookup(self.database, "2", "TOTAL OUTFLOW")
+        assert list(out["kind"]) == ["wdm", "plotgen"]
+        assert out["args"][0] == os.path.join(self.tmpdir, "data.wdm") + ",2"
+
+    def test_index_incremental_api(self):
+        index_tree(self.tmpdir)
+        os.remove(os.path.join(self.tmpdir, "data_plotgen.plt"))
+        counts = index_tree(self.tmpdir)
+        assert counts == {
+            "added": 0,
+            "updated": 0,
+            "removed": 1,
+            "unchanged": 2,
+            "series": 0,
+        }
+        assert len(lookup(self.database, file_type="plotgen")) == 0
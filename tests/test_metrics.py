@@ -0,0 +1,67 @@
+"""
+catalog
+----------------------------------
+
+Tests for `hspf_reader metrics`.
+"""
+
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generators import make_hbn
+from hspf_reader.hspf_reader import calibration_metrics, hbn, wdm
+
+
+class TestMetrics(TestCase):
+    def test_metrics_api(self):
+        out = calibration_metrics(
+            "tests/data_yearly.hbn", "yearly", "tests/data.wdm", ",905,,AGWS:1"
+        )
+        index, values, _ = hbn(
+            "tests/data_yearly.hbn", "yearly", ",905,,AGWS", return_type="numpy"
+        )
+        both = pd.concat(
+            [pd.Series(values[:, 0], index=index), wdm("tests/data.wdm,1")],
+            axis=1,
+            join="inner",
+        ).dropna()
+        sim, obs = both.to_numpy(dtype="float64").T
+        assert out["simulated"][0] == "PERLND_905_AGWS"
+        assert out["observed"][0] == "data.wdm_1"
+        assert out["count"][0] == len(both)
+        nse = 1 - ((sim - obs) ** 2).sum() / ((obs - obs.mean()) ** 2).sum()
+        assert np.isclose(out["nse"][0], nse)
+        assert np.isclose(out["r"][0], np.corrcoef(sim, obs)[0, 1])
+        assert np.isclose(out["pbias"][0], 100 * (obs - sim).sum() / obs.sum())
+
+    def test_metrics_ambiguous_label(self):
+        with self.assertRaises(ValueError):
+            calibration_metrics(
+                "tests/data_yearly.hbn", "yearly", "tests/data.wdm", ",905,,:1"
+            )
+
+    def test_metrics_blocks_api(self):
+        # Daily values read a few blocks at a time on both sides.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "test.hbn")
+            make_hbn(path, operations=2, variables=2, years=5, interval="daily")
+            pair = ",1,,V000:1"
+            expected = calibration_metrics(path, "daily", "tests/data.wdm", pair)
+            with mock.patch("hspf_reader.hspf_reader._AGGREGATE_ROWS", 100):
+                out = calibration_metrics(path, "daily", "tests/data.wdm", pair)
+            index, values, _ = hbn(path, "daily", ",1,,V000", return_type="numpy")
+        both = pd.concat(
+            [pd.Series(values[:, 0], index=index), wdm("tests/data.wdm,1")],
+            axis=1,
+            join="inner",
+        ).dropna()
+        sim, obs = both.to_numpy(dtype="float64").T
+        assert out["count"][0] == expected["count"][0] == len(both) > 1000
+        assert np.isclose(out["rmse"][0], np.sqrt(((sim - obs) ** 2).mean()))
+        assert np.allclose(
+            out.iloc[0, 2:].astype("float64"), expected.iloc[0, 2:].astype("float64")
+        )
@@ -5,9 +5,16 @@ catalog
 Tests for `hspf_reader plotgen` module.
 """
 
+import concurrent.futures
+import os
+import pickle
 import shlex
+import shutil
 import subprocess
-from unittest import TestCase
+import sys
+import tempfile
+import threading
+from unittest import TestCase, mock
 
 from pandas.testing import assert_frame_equal
 
@@ -20,7 +27,8 @@ except ImportError:
 
 import pandas as pd
 
-from hspf_reader.hspf_reader import plotgen
+from hspf_reader.hspf_reader import plotgen, plotgen_catalog, plotgen_iter
+from hspf_reader.plotgenfile import PlotgenFile
 
 
 class TestDescribe(TestCase):
@@ -780,3 +788,216 @@ class TestDescribe(TestCase):
     def test_api(self):
         out = plotgen("tests/data_plotgen.plt").astype("float64")
         assert_frame_equal(out, self.extract_api)
+
+    def test_api_numpy(self):
+        index, values, columns = plotgen("tests/data_plotgen.plt", return_type="numpy")
+        out = pd.DataFrame(values, index=pd.DatetimeIndex(index), columns=columns)
+        assert_frame_equal(
+            out, self.extract_api, check_index_type=False, check_freq=False, check_names=False
+        )
+
+    def test_api_fields(self):
+        out = plotgen("tests/data_plotgen.plt,SURFACE,SURFACE").astype("float64")
+        assert list(out.columns) == [
+            "data_plotgen.plt_SURFACE",
+            "data_plotgen.plt_SURFACE_1",
+        ]
+
+    def test_plotgenfile(self):
+        with PlotgenFile("tests/data_plotgen.plt") as pltfile:
+            assert pltfile.labels() == list(self.extract_api.columns)
+            out = pickle.loads(pickle.dumps(pltfile)).read()
+            assert_frame_equal(
+                tsutils.asbestfreq(out), self.extract_api, check_names=False
+            )
+            out = pltfile.read("SURFACE", start_date="1976-06-01")
+            assert list(out.columns) == ["SURFACE"]
+            assert out.index[0] == pd.Timestamp("1976-06-01")
+            with self.assertRaises(ValueError):
+                pltfile.read("RUNOFF")
+
+    def test_plotgenfile_threads(self):
+        pltfile = PlotgenFile("tests/data_plotgen.plt")
+        expected = pltfile.read("SURFACE")
+        stop = threading.Event()
+
+        def closer():
+            while not stop.is_set():
+                pltfile.close()
+                pltfile.header()
+
+        # Switch threads often so a close lands between the header and read.
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        thread = threading.Thread(target=closer)
+        thread.start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                outs = list(
+                    executor.map(lambda _: pltfile.read("SURFACE"), range(100))
+                )
+        finally:
+            stop.set()
+            thread.join()
+            sys.setswitchinterval(interval)
+            pltfile.close()
+        for out in outs:
+            assert_frame_equal(out, expected)
+
+    def test_plotgenfile_rows(self):
+        # Rows are dropped only when every curve is missing, not only the
+        # requested ones.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.plt")
+            with open("tests/data_plotgen.plt") as fpointer:
+                text = fpointer.read()
+            with open(path, "w") as fpointer:
+                fpointer.write(text.replace("0.1740387E-01", "-.1000000E+31", 1))
+            with PlotgenFile(path) as pltfile:
+                out = pltfile.read("SURFACE")
+                assert (out.index == pltfile.read().index).all()
+            assert out["SURFACE"].isna().sum() == 1
+            out = pd.concat(plotgen_iter(path, "SURFACE", chunksize=100))
+            assert_frame_equal(
+                out.astype("float64"),
+                plotgen(path, "SURFACE").astype("float64"),
+                check_freq=False,
+                check_index_type=False,
+            )
+
+    def test_plotgen_empty_window_cli(self):
+        for fields in ("", ",SURFACE"):
+            outs = [
+                subprocess.run(
+                    shlex.split(
+                        "hspf_reader plotgen --start_date 2050-01-01 "
+                        f"{extra} tests/data_plotgen.plt{fields}"
+                    ),
+                    capture_output=True,
+                    check=True,
+                ).stdout
+                for extra in ("", "--workers 1")
+            ]
+            assert outs[0] == outs[1]
+            assert outs[0].startswith(b"Datetime,")
+
+    def test_plotgen_catalog(self):
+        out = plotgen_catalog("tests/data_plotgen.plt")
+        assert list(out["label"]) == list(self.extract_api.columns)
+        assert list(out["tran"]) == ["AVER"] * 4
+        assert list(out["lintyp"]) == [0, 0, 1, 2]
+        assert out["interval"][0] == "720min"
+        assert out["title"][0] == "SIMULATED FLOW"
+        out = plotgen("tests/data_plotgen.plt,TOTAL OUTFLOW").astype("float64")
+        assert_frame_equal(
+            out,
+            self.extract_api[["TOTAL OUTFLOW"]].set_axis(
+                ["data_plotgen.plt_TOTAL OUTFLOW"], axis=1
+            ),
+            check_freq=False,
+            check_names=False,
+        )
+
+    def test_plotgen_iter(self):
+        chunks = list(plotgen_iter("tests/data_plotgen.plt", chunksize=100))
+        assert [len(i) for i in chunks[:-1]] == [100] * (len(chunks) - 1)
+        out = pd.concat(chunks).astype("float64")
+        assert_frame_equal(
+            out, self.extract_api, check_freq=False, check_index_type=False
+        )
+        out = pd.concat(
+            plotgen_iter(
+                "tests/data_plotgen.plt",
+                "SURFACE",
+                "SURFACE",
+                chunksize=7,
+                start_date="1976-03-01",
+                end_date="1976-05-01",
+            )
+        )
+        assert list(out.columns) == [
+            "data_plotgen.plt_SURFACE",
+            "data_plotgen.plt_SURFACE_1",
+        ]
+        assert out.index[0] == pd.Timestamp("1976-03-01")
+        assert out.index[-1] == pd.Timestamp("1976-05-01")
+
+    def test_api_spill(self):
+        with plotgen("tests/data_plotgen.plt", max_memory=0) as out:
+            assert_frame_equal(
+                out.to_frame(),
+                self.extract_api,
+                check_index_type=False,
+                check_freq=False,
+            )
+
+    def test_api_workers(self):
+        out = plotgen("tests/data_plotgen.plt", workers=3).astype("float64")
+        assert_frame_equal(out, self.extract_api)
+
+    def test_api_many_files_workers(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            other = os.path.join(tmpdir, "other.plt")
+            shutil.copy("tests/data_plotgen.plt", other)
+            args = (
+                f"{other},SURFACE",
+                "tests/data_plotgen.plt,SURFACE,INTERFLOW",
+                f"{other},SURFACE",
+            )
+            out = plotgen(*args, workers=2)
+            assert list(out.columns) == [
+                "other.plt_SURFACE",
+                "data_plotgen.plt_SURFACE",
+                "data_plotgen.plt_INTERFLOW",
+                "other.plt_SURFACE_1",
+            ]
+            assert_frame_equal(out, plotgen(*args))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_api_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.plt")
+            cache_dir = os.path.join(tmpdir, "cache")
+            shutil.copy("tests/data_plotgen.plt", path)
+            first = plotgen(path, cache_dir=cache_dir)
+            assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+            # Same size and modification time, different contents.
+            stat = os.stat(path)
+            with open(path) as fpointer:
+                text = fpointer.read()
+            with open(path, "w") as fpointer:
+                fpointer.write(text.replace("11.40474", "12.40474", 1))
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            assert_frame_equal(plotgen(path, cache_dir=cache_dir), first)
+            with mock.patch.dict(os.environ, {"HSPF_READER_CACHE_STRICT": "1"}):
+                out = plotgen(path, cache_dir=cache_dir)
+            assert out.iloc[0, 0] == 12.40474
+            os.chmod(cache_dir, 0o777)
+            with self.assertRaises(ValueError):
+                plotgen(path, cache_dir=cache_dir)
+
+    def test_api_many_whole_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            other = os.path.join(tmpdir, "other.plt")
+            same = os.path.join(tmpdir, "data_plotgen.plt")
+            shutil.copy("tests/data_plotgen.plt", other)
+            shutil.copy("tests/data_plotgen.plt", same)
+            labels = list(self.extract_api.columns)
+            out = plotgen("tests/data_plotgen.plt", other, same)
+            assert list(out.columns) == (
+                labels
+                + [f"other.plt_{i}" for i in labels]
+                + [f"data_plotgen.plt_{i}" for i in labels]
+            )
+            for num in range(3):
+                assert_frame_equal(
+                    out.iloc[:, 4 * num : 4 * num + 4]
+                    .set_axis(labels, axis=1)
+                    .astype("float64"),
+                    self.extract_api,
+                )
+            assert_frame_equal(
+                plotgen("tests/data_plotgen.plt", other, same, workers=2), out
+            )
@@ -0,0 +1,59 @@
+"""
+catalog
+----------------------------------
+
+Tests for the file pool.
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from hspf_reader.pool import FilePool
+
+
+class TestPool(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = []
+        for num in range(3):
+            path = os.path.join(self.tmpdir, f"file{num}.txt")
+            with open(path, "w") as fpointer:
+                fpointer.write(str(num))
+            self.paths.append(path)
+        self.pool = FilePool(2)
+
+    def tearDown(self):
+        self.pool.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, path):
+        with self.pool.borrow(path, open) as fpointer:
+            fpointer.seek(0)
+            return fpointer.read()
+
+    def test_lru(self):
+        assert [self.read(i) for i in self.paths[:2]] == ["0", "1"]
+        assert self.read(self.paths[0]) == "0"
+        self.read(self.paths[2])
+        stats = self.pool.stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
+        assert stats["open"] == 2
+        # file1 was the least recently used.
+        self.read(self.paths[0])
+        assert self.pool.stats()["hits"] == 2
+
+    def test_invalidate(self):
+        self.read(self.paths[0])
+        with open(self.paths[0], "w") as fpointer:
+            fpointer.write("changed")
+        assert self.read(self.paths[0]) == "changed"
+        assert self.pool.stats()["invalidations"] == 1
+
+    def test_borrowed_stay_open(self):
+        with self.pool.borrow(self.paths[0], open) as fpointer:
+            self.read(self.paths[1])
+            self.read(self.paths[2])
+            assert not fpointer.closed
+        assert fpointer.closed
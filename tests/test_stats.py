@@ -0,0 +1,39 @@
+"""
+catalog
+----------------------------------
+
+Tests for `hspf_reader stats`.
+"""
+
+from unittest import TestCase
+
+import numpy as np
+
+from hspf_reader.hspf_reader import hbn, series_stats, wdm
+
+
+class TestStats(TestCase):
+    def test_stats_hbn(self):
+        out = series_stats("tests/data_yearly.hbn", "PERLND,,,", interval="yearly")
+        index, values, names = hbn(
+            "tests/data_yearly.hbn", "yearly", "PERLND,,,", return_type="numpy"
+        )
+        assert list(out["label"]) == names
+        assert (out["count"] == (~np.isnan(values)).sum(axis=0)).all()
+        assert np.allclose(out["sum"], np.nansum(values, axis=0))
+        assert np.allclose(out["max"], np.nanmax(values, axis=0))
+        assert (out["start_date"] == index[0]).all()
+        assert (out["end_date"] == index[-1]).all()
+
+    def test_stats_wdm(self):
+        out = series_stats("tests/data.wdm", 2, start_date="2000-01-01")
+        nts = wdm("tests/data.wdm,2", start_date="2000-01-01").dropna()
+        assert list(out["label"]) == ["data.wdm_2"]
+        assert out["count"][0] == len(nts)
+        assert np.isclose(out["mean"][0], nts.iloc[:, 0].astype("float64").mean())
+        assert out["start_date"][0] == nts.index[0]
+        assert out["end_date"][0] == nts.index[-1]
+
+    def test_stats_interval_required(self):
+        with self.assertRaises(ValueError):
+            series_stats("tests/data_yearly.hbn", ",905,,AGWS")
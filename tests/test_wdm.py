@@ -5,6 +5,7 @@ test_wdm
 Tests for `hspf_reader` module.
 """
 
+import pickle
 import sys
 
 import pandas as pd
@@ -21,6 +22,7 @@ from unittest import TestCase
 from pandas.testing import assert_frame_equal
 
 from hspf_reader.hspf_reader import wdm
+from hspf_reader.wdmfile import WDMFile
 
 
 def capture(func, *args, **kwds):
@@ -50,3 +52,48 @@ class TestWDM(TestCase):
             pd.read_csv("tests/data_wdm_2.csv", index_col=0, parse_dates=True)
         )
         assert_frame_equal(ret1, ret2, check_dtype=False, check_index_type=False)
+
+    def test_extract_numpy(self):
+        ret1 = wdm("tests/data.wdm", 1, 2).dropna(how="all").astype("float64")
+        index, values, columns = wdm("tests/data.wdm", 1, 2, return_type="numpy")
+        assert columns == ["data.wdm_1", "data.wdm_2"]
+        ret2 = pd.DataFrame(values, index=pd.DatetimeIndex(index), columns=columns)
+        assert_frame_equal(
+            ret1,
+            ret2,
+            check_dtype=False,
+            check_index_type=False,
+            check_freq=False,
+            check_names=False,
+        )
+
+    def test_wdmfile(self):
+        wdmfile = pickle.loads(pickle.dumps(WDMFile("tests/data.wdm")))
+        assert wdmfile.dsns() == [1, 2]
+        ret1 = wdmfile.read(1, 2)
+        ret2 = wdm("tests/data.wdm", 1, 2).dropna(how="all").astype("float64")
+        assert list(ret1.columns) == ["data.wdm_1", "data.wdm_2"]
+        assert_frame_equal(
+            ret1, ret2, check_dtype=False, check_freq=False, check_index_type=False
+        )
+        ret3 = wdmfile.read(2, 1, start_date="1995-01-01", end_date="2000-01-01")
+        assert list(ret3.columns) == ["data.wdm_2", "data.wdm_1"]
+        assert_frame_equal(ret3, ret1.loc["1995-01-01":"2000-01-01", ret3.columns])
+        with self.assertRaises(ValueError):
+            wdmfile.read(3)
+
+    def test_extract_many_files(self):
+        ret1 = wdm("tests/data.wdm", 1, 2)
+        for args in (
+            ["tests/data.wdm,1 tests/data.wdm,2"],
+            ["tests/data.wdm,1", "tests/data.wdm,2"],
+        ):
+            assert_frame_equal(wdm(*args), ret1)
+
+    def test_extract_spill(self):
+        ret1 = wdm("tests/data.wdm", 1, 2, start_date="1990-01-01")
+        with wdm("tests/data.wdm", 1, 2, max_memory=0, start_date="1990-01-01") as out:
+            ret2 = out.to_frame()
+        assert_frame_equal(
+            ret1, tsutils.asbestfreq(tsutils.common_kwds(ret2)), check_index_type=False
+        )